@@ -0,0 +1,215 @@
+"""Due-date scheduler for advance (scheduled) payments.
+
+Every tbl_expense row with source 'advance' has a tbl_advance_notification row
+(expense_id, login_id, due_date, fired_at, acked_at), kept in step by the expense
+write routes in the same transaction. A background thread holds the unfired
+ones in a heap ordered by due date; when a payment falls due it sets fired_at
+and pushes a 'notification' event to the user's feed (events.py).
+
+GET /api/notifications/<id> reads the due, unacknowledged rows through the
+(login_id, acked_at, due_date) index, so it costs O(k) in the items it returns
+instead of rescanning the expense history; POST .../ack marks them handled.
+
+Each worker loads the pending rows at start and learns about its own writes;
+the ``fired_at IS NULL`` check on the update means a payment is announced once
+even when several workers hold it.
+"""
+import heapq
+import logging
+import threading
+from datetime import date, datetime, time as day_start
+
+import events
+from rollup import as_date
+
+ADVANCE = 'advance'
+MAX_SLEEP = 3600   # re-check at least hourly (clock changes, missed wake-ups)
+LOAD_RETRY = 30    # seconds between attempts to load the pending payments
+
+log = logging.getLogger(__name__)
+
+UPSERT = (
+    "INSERT INTO tbl_advance_notification (expense_id, login_id, due_date) VALUES (%s, %s, %s) "
+    "ON DUPLICATE KEY UPDATE login_id = VALUES(login_id), "
+    # A new due date makes it a new reminder; MySQL applies these left to right, so due_date goes last
+    "fired_at = IF(due_date = VALUES(due_date), fired_at, NULL), "
+    "acked_at = IF(due_date = VALUES(due_date), acked_at, NULL), "
+    "due_date = VALUES(due_date)"
+)
+
+# Rows for existing advance payments; those that fell due before today were already on show, so start handled
+BACKFILL = (
+    "INSERT INTO tbl_advance_notification (expense_id, login_id, due_date, fired_at, acked_at) "
+    "SELECT id, login_id, date, IF(date < CURDATE(), date, NULL), IF(date < CURDATE(), date, NULL) "
+    "FROM tbl_expense WHERE source = 'advance' "
+    "ON DUPLICATE KEY UPDATE expense_id = expense_id"
+)
+
+DUE = (
+    "SELECT e.*, c.category_name, n.fired_at FROM tbl_advance_notification n "
+    "INNER JOIN tbl_expense e ON e.id = n.expense_id "
+    "INNER JOIN tbl_category c ON e.category_id = c.id "
+    "WHERE n.login_id = %s AND n.acked_at IS NULL AND n.due_date <= %s "
+    "ORDER BY n.due_date, n.expense_id"
+)
+
+
+def is_advance(row):
+    return bool(row) and row.get('source') == ADVANCE
+
+
+def apply_change(tx, old, new):
+    """Keep tbl_advance_notification in step with an expense write.
+
+    Returns (expense_id, login_id, due_date) to schedule, (expense_id, None, None) to cancel, or None.
+    """
+    if is_advance(new):
+        due = as_date(new['date'])
+        tx.execute(UPSERT, (new['id'], new['login_id'], due))
+        return new['id'], new['login_id'], due
+    if is_advance(old):
+        tx.execute("DELETE FROM tbl_advance_notification WHERE expense_id = %s", (old['id'],))
+        return old['id'], None, None
+    return None
+
+
+def apply_inserted(tx, ids, rows):
+    """Add rows for the advance payments among freshly inserted tbl_expense ``rows`` (with their ``ids``)."""
+    added = [(expense_id, row['login_id'], as_date(row['date'])) for expense_id, row in zip(ids, rows) if is_advance(row)]
+    if added:
+        tx.insert_many('tbl_advance_notification', ('expense_id', 'login_id', 'due_date'), added)
+    return added
+
+
+def due(db, login_id, today=None):
+    return db.fetchall(DUE, (login_id, today or date.today()))
+
+
+def acknowledge(db, login_id, expense_ids=None, today=None):
+    """Mark due notifications handled (all of them, or just ``expense_ids``). Returns how many changed."""
+    query = ("UPDATE tbl_advance_notification SET acked_at = NOW() "
+             "WHERE login_id = %s AND acked_at IS NULL AND due_date <= %s")
+    params = [login_id, today or date.today()]
+    if expense_ids is not None:
+        if not expense_ids:
+            return 0
+        query += " AND expense_id IN ({})".format(', '.join(['%s'] * len(expense_ids)))
+        params.extend(expense_ids)
+    return db.execute(query, params)
+
+
+class Scheduler:
+    """Heap of unfired advance payments, fired by a background thread when they fall due."""
+
+    def __init__(self, db):
+        self.db = db
+        self._heap = []        # (due_date, expense_id, login_id)
+        self._current = {}     # expense_id -> (due_date, login_id); heap entries that disagree are stale
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='advance-scheduler', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def load(self):
+        rows = self.db.fetchall(
+            "SELECT expense_id, login_id, due_date FROM tbl_advance_notification WHERE fired_at IS NULL"
+        )
+        for row in rows:
+            self.schedule(row['expense_id'], row['login_id'], as_date(row['due_date']))
+        return len(rows)
+
+    def schedule(self, expense_id, login_id, due_date):
+        """Add or move a payment; a ``due_date`` of None cancels it."""
+        with self._cond:
+            if due_date is None:
+                self._current.pop(expense_id, None)
+                return
+            self._current[expense_id] = (due_date, login_id)
+            heapq.heappush(self._heap, (due_date, expense_id, login_id))
+            if self._heap[0][1] == expense_id:
+                self._cond.notify()   # new earliest item: wake the thread to recompute its sleep
+
+    def pending(self):
+        with self._cond:
+            return len(self._current)
+
+    def pop_due(self, today=None):
+        """Remove and return the (due_date, expense_id, login_id) entries due by ``today``."""
+        today = today or date.today()
+        fired = []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= today:
+                due_date, expense_id, login_id = heapq.heappop(self._heap)
+                if self._current.get(expense_id) == (due_date, login_id):
+                    del self._current[expense_id]
+                    fired.append((due_date, expense_id, login_id))
+        return fired
+
+    def _requeue(self, entries):
+        """Put back entries popped by pop_due that were not announced, unless they were rescheduled since."""
+        with self._cond:
+            for due_date, expense_id, login_id in entries:
+                if expense_id not in self._current:
+                    self._current[expense_id] = (due_date, login_id)
+                    heapq.heappush(self._heap, (due_date, expense_id, login_id))
+
+    def fire(self, today=None):
+        """Mark what is due as fired and tell the owners. Returns how many this process announced.
+
+        If the update or the publish fails, the payments not yet handled go back on the heap for the next wake.
+        """
+        announced = 0
+        due = self.pop_due(today)
+        for i, (due_date, expense_id, login_id) in enumerate(due):
+            try:
+                changed = self.db.execute(
+                    "UPDATE tbl_advance_notification SET fired_at = NOW() "
+                    "WHERE expense_id = %s AND due_date = %s AND fired_at IS NULL", (expense_id, due_date)
+                )
+            except Exception:
+                self._requeue(due[i:])
+                raise
+            if changed:
+                # Already marked fired, so a failed publish is only logged (publish_many never raises)
+                events.publish_many([login_id], {
+                    'type': 'notification', 'op': 'due', 'id': expense_id, 'date': str(due_date)
+                })
+                announced += 1
+        return announced
+
+    def _seconds_to_next(self):
+        if not self._heap:
+            return MAX_SLEEP
+        wake = datetime.combine(self._heap[0][0], day_start())
+        return min(MAX_SLEEP, max(0.0, (wake - datetime.now()).total_seconds()))
+
+    def _run(self):
+        loaded = False
+        while True:
+            if not loaded:
+                # Retried on every wake until it works (e.g. the database was not up when the worker started)
+                try:
+                    log.info("Advance scheduler loaded %d pending payment(s)", self.load())
+                    loaded = True
+                except Exception:
+                    log.exception("Advance scheduler could not load pending payments; retrying")
+            with self._cond:
+                if self._stopped:
+                    return
+                self._cond.wait(self._seconds_to_next() if loaded else LOAD_RETRY)
+                if self._stopped:
+                    return
+            try:
+                self.fire()
+            except Exception:
+                log.exception("Advance scheduler failed to fire due payments")
@@ -1,20 +1,135 @@
 #flask code
-from flask import Flask,render_template,request,url_for,redirect,flash,jsonify,session,render_template_string
-from config import Database 
+from flask import Flask,render_template,request,url_for,redirect,flash,jsonify,session,render_template_string,Response,stream_with_context,make_response,g
+from config import LazyDatabase
+from fanout import FanoutDatabase
+import fanout
+import querystats
+import metrics
+import logs
+from dashboard import DashboardSnapshot
+import home_bundle
+from daterange import in_range, month_bounds, year_bounds
+import rollup
+import forecast_state
+import suggestions as suggestion_rules
+import expense_import
+import expense_export
+import pagination
+import versions
+import changes
+import events
+import advance_scheduler
+import budgets
+import user_stats
+import expense_cube
+import replicas
 from flask_cors import CORS
-from datetime import datetime
-import numpy as np
-from sklearn.linear_model import LinearRegression
+import calendar
+import functools
+import logging
+from datetime import datetime, timedelta
+import time
 
 
 
 app = Flask(__name__)
 
-CORS(app)
+CORS(app, expose_headers=['X-Next-Cursor', 'Link'])
 
 app.secret_key='1234'
 
-db = Database()
+log = logging.getLogger(__name__)
+
+# Nothing connects at import: the pool is built on the first query, after create_app() had a chance to configure it
+db = LazyDatabase()
+fanout_db = FanoutDatabase(db)
+scheduler = advance_scheduler.Scheduler(db)
+cube = expense_cube.ExpenseCube()
+dashboard_snapshot = DashboardSnapshot()
+
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    metrics.http_in_flight.inc()
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is not None:
+        endpoint = request.endpoint or 'unmatched'
+        metrics.http_requests.inc(endpoint, request.method, str(response.status_code))
+        metrics.http_latency.observe(endpoint, request.method, value=time.perf_counter() - started)
+        if response.content_length is not None:
+            metrics.http_response_size.observe(endpoint, value=response.content_length)
+    return response
+
+
+@app.teardown_request
+def end_request_metrics(exc=None):
+    if g.pop('request_started', None) is not None:
+        metrics.http_in_flight.dec()
+
+
+@metrics.registry.collector
+def database_metrics():
+    pool = db.pool_stats()
+    statements = db.statement_cache_stats()
+    queries = db.query_stats(limit=0)
+    return [
+        ('db_pool_connections', 'gauge', 'Pooled connections by state.',
+         [({'state': 'in_use'}, pool['in_use']), ({'state': 'idle'}, pool['idle'])]),
+        ('db_pool_waits_total', 'counter', 'Checkouts that had to wait for a connection.', [({}, pool['waits'])]),
+        ('db_pool_timeouts_total', 'counter', 'Checkouts that timed out.', [({}, pool['timeouts'])]),
+        ('db_statement_cache_hits_total', 'counter', 'Prepared statement cache hits.', [({}, statements['hits'])]),
+        ('db_statement_cache_misses_total', 'counter', 'Prepared statement cache misses.', [({}, statements['misses'])]),
+        ('db_statements_total', 'counter', 'Statements executed.', [({}, queries['statements'])]),
+        ('db_slow_statements_total', 'counter', 'Statements over the slow-query threshold.', [({}, queries['slow'])]),
+    ] + replica_metrics(db.replica_stats())
+
+
+def replica_metrics(stats):
+    if stats is None:
+        return []
+    return [
+        ('db_reads_total', 'counter', 'Routed reads by target.',
+         [({'target': 'primary'}, stats['primary_reads'])] +
+         [({'target': replica['name']}, replica['reads']) for replica in stats['replicas']]),
+        ('db_replica_lag_seconds', 'gauge', 'Replica lag at the last check (-1: unknown or failing).',
+         [({'replica': replica['name']}, replica['lag'] if replica['lag'] is not None and replica['error'] is None else -1)
+          for replica in stats['replicas']]),
+    ]
+
+
+@app.before_request
+def start_query_count():
+    g.query_scope = querystats.begin_request()
+
+
+@app.before_request
+def start_replica_session():
+    # Reads follow this key's own writes to the primary until the replicas have caught up
+    user_id = (request.view_args or {}).get('user_id')
+    key = ('user', user_id) if user_id is not None else ('admin' if session.get('admin') else None)
+    g.replica_session = replicas.begin_request(key)
+
+
+@app.teardown_request
+def end_replica_session(exc=None):
+    token = g.pop('replica_session', None)
+    if token is not None:
+        replicas.end_request(token)
+
+
+@app.after_request
+def finish_query_count(response):
+    token = g.pop('query_scope', None)
+    if token is not None:
+        scope = querystats.end_request(token)
+        response.headers['Server-Timing'] = scope.server_timing()
+        db.pool.query_stats.check_request(request.endpoint, scope)
+    return response
 
 
 
@@ -27,7 +142,7 @@ def login():
     username = request.form['username']
     password = request.form['password']
 
-    user = db.fetchone("SELECT * FROM tbl_login WHERE username='{}' AND password='{}'".format(username, password))
+    user = db.fetchone("SELECT * FROM tbl_login WHERE username = %s AND password = %s", (username, password))
 
     if user:
         if user['role'] == 'admin':
@@ -53,131 +168,7 @@ def home():
     if not session.get("admin", False):
         return redirect(url_for('index'))
     
-    # Total Users
-    total_users = db.fetchone("SELECT COUNT(*) as count FROM tbl_user")['count']
-    active_users = db.fetchone(
-        "SELECT COUNT(DISTINCT login_id) as count FROM tbl_expense WHERE MONTH(date) = MONTH(CURDATE())"
-    )['count']
-    total_users_progress = min(total_users * 10, 100)
-    print(f"Total Users: {total_users}, Active Users: {active_users}, Progress: {total_users_progress}")
-    
-    # Total Expenses (Current Month vs Last Month)
-    total_expenses = db.fetchone(
-        "SELECT SUM(amount) as total FROM tbl_expense WHERE MONTH(date) = MONTH(CURDATE()) AND YEAR(date) = YEAR(CURDATE())"
-    )['total'] or 0
-    last_month_expenses = db.fetchone(
-        "SELECT SUM(amount) as total FROM tbl_expense WHERE MONTH(date) = MONTH(CURDATE() - INTERVAL 1 MONTH) AND YEAR(date) = YEAR(CURDATE())"
-    )['total'] or 0
-    expense_growth_rate = ((total_expenses - last_month_expenses) / last_month_expenses * 100) if last_month_expenses > 0 else 0
-    expense_progress = min(total_expenses / 1000, 100)
-    print(f"Total Expenses: {total_expenses}, Last Month: {last_month_expenses}, Growth Rate: {expense_growth_rate}, Progress: {expense_progress}")
-    
-    # Average Savings Rate
-    savings_data = db.fetchone(
-        "SELECT AVG((u.salary + COALESCE(ai.total_income, 0) - COALESCE(e.total_expense, 0)) / NULLIF(u.salary + COALESCE(ai.total_income, 0), 0)) * 100 as rate "
-        "FROM tbl_user u "
-        "LEFT JOIN (SELECT login_id, SUM(amount) as total_income FROM tbl_add_income WHERE MONTH(month) = MONTH(CURDATE()) GROUP BY login_id) ai ON u.login_id = ai.login_id "
-        "LEFT JOIN (SELECT login_id, SUM(amount) as total_expense FROM tbl_expense WHERE MONTH(date) = MONTH(CURDATE()) GROUP BY login_id) e ON u.login_id = e.login_id"
-    )
-    avg_savings_rate = savings_data['rate'] or 0
-    print(f"Average Savings Rate: {avg_savings_rate}")
-    
-    # Budget Adherence Rate
-    adherence_data = db.fetchone(
-        "SELECT (SUM(CASE WHEN e.total_amount <= s.suggested_amount THEN 1 ELSE 0 END) / COUNT(*)) * 100 as rate "
-        "FROM tbl_suggestions s "
-        "LEFT JOIN (SELECT login_id, category_id, SUM(amount) as total_amount FROM tbl_expense "
-        "WHERE MONTH(date) = MONTH(CURDATE()) GROUP BY login_id, category_id) e "
-        "ON s.login_id = e.login_id AND s.category_id = e.category_id "
-        "WHERE s.month = '{}' AND s.year = {}".format(datetime.now().strftime('%B'), datetime.now().year)
-    )
-    budget_adherence_rate = adherence_data['rate'] or 0
-    print(f"Budget Adherence Rate: {budget_adherence_rate}")
-    
-    # Highest Spending Category
-    highest_spending_category = db.fetchone(
-        "SELECT c.category_name, SUM(e.amount) as total FROM tbl_expense e "
-        "JOIN tbl_category c ON e.category_id = c.id WHERE MONTH(e.date) = MONTH(CURDATE()) "
-        "GROUP BY c.id, c.category_name ORDER BY total DESC LIMIT 1"
-    )
-    highest_category_name = highest_spending_category['category_name'] if highest_spending_category else "N/A"
-    highest_category_amount = float(highest_spending_category['total'] or 0) if highest_spending_category else 0
-    print(f"Highest Spending Category: {highest_category_name}, Amount: {highest_category_amount}")
-    
-    # Most Active User (by number of transactions)
-    most_active_user = db.fetchone(
-        "SELECT l.username, COUNT(e.id) as transaction_count FROM tbl_expense e "
-        "JOIN tbl_login l ON e.login_id = l.id WHERE MONTH(e.date) = MONTH(CURDATE()) "
-        "GROUP BY e.login_id, l.username ORDER BY transaction_count DESC LIMIT 1"
-    )
-    most_active_username = most_active_user['username'] if most_active_user else "N/A"
-    most_active_transactions = most_active_user['transaction_count'] if most_active_user else 0
-    print(f"Most Active User: {most_active_username}, Transactions: {most_active_transactions}")
-    
-    # New Card: Expense Distribution by Source
-    expense_by_source = db.fetchall(
-        "SELECT source, SUM(amount) as total FROM tbl_expense "
-        "WHERE MONTH(date) = MONTH(CURDATE()) GROUP BY source"
-    )
-    expense_by_source_labels = [row['source'] for row in expense_by_source]
-    expense_by_source_values = [float(row['total'] or 0) for row in expense_by_source]
-    print(f"Expense by Source: {expense_by_source_labels}, {expense_by_source_values}")
-    
-    # Trend Data (Last 6 Months)
-    trend_data = db.fetchall(
-        "SELECT MONTHNAME(date) as month, SUM(amount) as total FROM tbl_expense "
-        "WHERE date >= DATE_SUB(CURDATE(), INTERVAL 6 MONTH) "
-        "GROUP BY MONTH(date), MONTHNAME(date) ORDER BY MIN(date)"
-    )
-    trend_labels = [row['month'] for row in trend_data]
-    trend_values = [float(row['total'] or 0) for row in trend_data]
-    print(f"Trend Data: {trend_labels}, {trend_values}")
-    
-    # Category Data (Top 5)
-    category_data = db.fetchall(
-        "SELECT c.category_name, SUM(e.amount) as total FROM tbl_expense e "
-        "JOIN tbl_category c ON e.category_id = c.id WHERE MONTH(e.date) = MONTH(CURDATE()) "
-        "GROUP BY c.id, c.category_name ORDER BY total DESC LIMIT 5"
-    )
-    category_labels = [row['category_name'] for row in category_data]
-    category_values = [float(row['total'] or 0) for row in category_data]
-    print(f"Category Data: {category_labels}, {category_values}")
-    
-    # Top Spending Users (Top 5)
-    top_users_data = db.fetchall(
-        "SELECT l.username, SUM(e.amount) as total FROM tbl_expense e "
-        "JOIN tbl_login l ON e.login_id = l.id "
-        "WHERE MONTH(e.date) = MONTH(CURDATE()) GROUP BY e.login_id, l.username ORDER BY total DESC LIMIT 5"
-    )
-    top_users_labels = [row['username'] for row in top_users_data]
-    top_users_values = [float(row['total'] or 0) for row in top_users_data]
-    print(f"Top Users Data: {top_users_labels}, {top_users_values}")
-    
-    # Savings vs Expenses
-    savings_vs_expenses = db.fetchone(
-        "SELECT SUM(u.salary + COALESCE(ai.total_income, 0) - COALESCE(e.total_expense, 0)) as savings, "
-        "SUM(COALESCE(e.total_expense, 0)) as expenses "
-        "FROM tbl_user u "
-        "LEFT JOIN (SELECT login_id, SUM(amount) as total_income FROM tbl_add_income WHERE MONTH(month) = MONTH(CURDATE()) GROUP BY login_id) ai ON u.login_id = ai.login_id "
-        "LEFT JOIN (SELECT login_id, SUM(amount) as total_expense FROM tbl_expense WHERE MONTH(date) = MONTH(CURDATE()) GROUP BY login_id) e ON u.login_id = e.login_id"
-    )
-    savings_value = float(savings_vs_expenses['savings'] or 0)
-    expenses_value = float(savings_vs_expenses['expenses'] or 0)
-    print(f"Savings vs Expenses: Savings={savings_value}, Expenses={expenses_value}")
-
-    return render_template("home.html", 
-        total_users=total_users, active_users=active_users, total_users_progress=total_users_progress,
-        total_expenses=total_expenses, expense_growth_rate=expense_growth_rate, expense_progress=expense_progress,
-        avg_savings_rate=avg_savings_rate,
-        budget_adherence_rate=budget_adherence_rate,
-        highest_category_name=highest_category_name, highest_category_amount=highest_category_amount,
-        most_active_username=most_active_username, most_active_transactions=most_active_transactions,
-        expense_by_source_labels=expense_by_source_labels, expense_by_source_values=expense_by_source_values,
-        trend_labels=trend_labels, trend_data=trend_values,
-        category_labels=category_labels, category_data=category_values,
-        top_users_labels=top_users_labels, top_users_data=top_users_values,
-        savings_value=savings_value, expenses_value=expenses_value
-    )
+    return render_template("home.html", **dashboard_snapshot.get(db, fanout_db))
 
 
 @app.route('/category', methods=['GET', 'POST'])
@@ -189,16 +180,18 @@ def category():
         category_name = request.form['category_name']
         
         if action == 'add':
-            category = db.fetchone("SELECT * FROM tbl_category WHERE category_name='{}'".format(category_name))
+            category = db.fetchone("SELECT * FROM tbl_category WHERE category_name = %s", (category_name,))
             if category:
                 flash('Category already exists', 'error')
             else:
-                db.execute("INSERT INTO tbl_category (category_name) VALUES ('{}')".format(category_name))
+                db.execute("INSERT INTO tbl_category (category_name) VALUES (%s)", (category_name,))
+                versions.bump(db, versions.GLOBAL)
                 flash('Category added successfully', 'success')
         
         elif action == 'update':
             category_id = request.form['category_id']
-            db.execute("UPDATE tbl_category SET category_name='{}' WHERE id={}".format(category_name, category_id))
+            db.execute("UPDATE tbl_category SET category_name = %s WHERE id = %s", (category_name, category_id))
+            versions.bump(db, versions.GLOBAL)
             flash('Category updated successfully', 'success')
         
         return redirect(url_for('category'))
@@ -208,44 +201,77 @@ def category():
 
 @app.route('/user')
 def user():
+    """Admin user list: ?q= matches the start of the username or name.
+
+    The whole list unless ?limit= is given, then ?cursor= pages on login_id (user.html has no pager yet).
+    """
     if not session.get("admin", False):
         return redirect(url_for('index'))
+    search = request.args.get('q', '').strip()
+    try:
+        limit = pagination.parse_limit(request.args.get('limit'), None, pagination.MAX_LIMIT)
+        cursor = request.args.get('cursor')
+        after = pagination.decode_cursor(cursor, int) if cursor else None
+    except pagination.BadRequest as e:
+        flash(str(e), 'error')
+        return redirect(url_for('user', q=search or None))
+
+    conditions = ["l.role = 'user'"]
+    params = []
+    if search:
+        pattern = user_stats.prefix_pattern(search)
+        conditions.append("(l.username LIKE %s OR u.name LIKE %s)")
+        params.extend([pattern, pattern])
+    if after is not None:
+        conditions.append("u.login_id > %s")
+        params.append(after[0])
     users = db.fetchall(
-        "SELECT u.*, l.username FROM tbl_login l INNER JOIN tbl_user u ON u.login_id = l.id WHERE l.role = 'user'"
+        "SELECT u.*, l.username FROM tbl_login l INNER JOIN tbl_user u ON u.login_id = l.id "
+        "WHERE " + ' AND '.join(conditions) + " ORDER BY u.login_id" + ('' if limit is None else " LIMIT %s"),
+        params + ([] if limit is None else [limit + 1])
     )
-    return render_template("user.html", users=users)
+    next_cursor = None
+    if limit is not None and len(users) > limit:
+        users = users[:limit]
+        next_cursor = pagination.encode_cursor([users[-1]['login_id']])
+    return render_template("user.html", users=users, q=search, next_cursor=next_cursor)
 
 @app.route('/insights/users')
 def insights_users():
+    """Per-user expenses and savings rate for a month.
+
+    Query args: month (YYYY-MM, default this month), sort (expenses | savings_rate), order (desc | asc),
+    q (username / name prefix), limit and cursor to page (the whole list without them; the template
+    has no pager yet).
+    """
     if not session.get("admin", False):
         return redirect(url_for('index'))
-    
-    # Active Users (e.g., users with expenses this month)
-    active_users = db.fetchone(
-        "SELECT COUNT(DISTINCT login_id) as count FROM tbl_expense WHERE MONTH(date) = MONTH(CURDATE())"
-    )['count']
-    
-    # Average Expenses per User
-    avg_expenses = db.fetchone(
-        "SELECT AVG(total_expense) as avg FROM ("
-        "SELECT login_id, SUM(amount) as total_expense FROM tbl_expense "
-        "WHERE MONTH(date) = MONTH(CURDATE()) GROUP BY login_id) e"
-    )
-    avg_expenses_per_user = avg_expenses['avg'] or 0
-    
-    # User Activity Data
-    users = db.fetchall(
-        "SELECT u.login_id, l.username, u.name, "
-        "COALESCE(e.total_expense, 0) as total_expenses, "
-        "((u.salary + COALESCE(ai.total_income, 0) - COALESCE(e.total_expense, 0)) / NULLIF(u.salary + COALESCE(ai.total_income, 0), 0)) * 100 as savings_rate "
-        "FROM tbl_user u "
-        "JOIN tbl_login l ON u.login_id = l.id "
-        "LEFT JOIN (SELECT login_id, SUM(amount) as total_income FROM tbl_add_income WHERE MONTH(month) = MONTH(CURDATE()) GROUP BY login_id) ai ON u.login_id = ai.login_id "
-        "LEFT JOIN (SELECT login_id, SUM(amount) as total_expense FROM tbl_expense WHERE MONTH(date) = MONTH(CURDATE()) GROUP BY login_id) e ON u.login_id = e.login_id"
-    )
-    
+
+    now = datetime.now()
+    search = request.args.get('q', '').strip()
+    sort = request.args.get('sort', 'expenses')
+    order = request.args.get('order', 'desc')
+    try:
+        year, month = user_stats.income_month(request.args['month']) if request.args.get('month') else (now.year, now.month)
+        limit = pagination.parse_limit(request.args.get('limit'), None, pagination.MAX_LIMIT)
+        if not user_stats.month_seeded(db, year, month):
+            # Only users who wrote that month have rows until the monthly job runs
+            flash('Stats for {:04d}-{:02d} are not computed for every user yet (python user_stats.py refresh '
+                  '--month {:04d}-{:02d})'.format(year, month, year, month), 'error')
+        users, next_cursor = user_stats.page(db, year, month, sort, order, search, request.args.get('cursor'), limit)
+    except ValueError as e:   # includes pagination.BadRequest
+        # An admin page: say what was wrong and show the first page with the default sort instead
+        flash(str(e), 'error')
+        return redirect(url_for('insights_users', q=search or None))
+
+    # Headline numbers for the current month come from the cached dashboard snapshot, not a scan per view
+    snapshot = dashboard_snapshot.get(db, fanout_db)
+    active_users = snapshot['active_users']
+    avg_expenses_per_user = snapshot['total_expenses'] / active_users if active_users else 0
+
     return render_template("insights_users.html", 
-        active_users=active_users, avg_expenses_per_user=avg_expenses_per_user, users=users
+        active_users=active_users, avg_expenses_per_user=avg_expenses_per_user, users=users,
+        next_cursor=next_cursor, sort=sort, order=order, q=search, month='{:04d}-{:02d}'.format(year, month)
     )
 
 @app.route('/insights/expenses')
@@ -253,22 +279,21 @@ def insights_expenses():
     if not session.get("admin", False):
         return redirect(url_for('index'))
     
-    # Category Expenses
-    category_data = db.fetchall(
-        "SELECT c.category_name, SUM(e.amount) as total FROM tbl_expense e "
-        "JOIN tbl_category c ON e.category_id = c.id WHERE MONTH(e.date) = MONTH(CURDATE()) "
-        "GROUP BY c.id, c.category_name"
-    )
-    category_labels = [row['category_name'] for row in category_data]
-    category_values = [row['total'] or 0 for row in category_data]
-    
+    # Both charts come from the expense cube instead of grouping tbl_expense per view
+    cube.sync(db)
+    day = timedelta(days=1)
+    month_start, next_month = month_bounds()
+    category_rows, _ = cube.query(month_start, next_month - day, 'month', ['category'])
+    names = {row['id']: row['category_name'] for row in db.fetchall("SELECT id, category_name FROM tbl_category")}
+    category_rows = [row for row in category_rows if row['category_id'] in names]
+    category_labels = [names[row['category_id']] for row in category_rows]
+    category_values = [row['total'] for row in category_rows]
+
     # Monthly Trends
-    trend_data = db.fetchall(
-        "SELECT MONTHNAME(date) as month, SUM(amount) as total FROM tbl_expense "
-        "WHERE YEAR(date) = YEAR(CURDATE()) GROUP BY MONTH(date), MONTHNAME(date) ORDER BY MONTH(date)"
-    )
-    trend_labels = [row['month'] for row in trend_data]
-    trend_values = [row['total'] or 0 for row in trend_data]
+    year_start, next_year = year_bounds()
+    trend_rows, _ = cube.query(year_start, next_year - day, 'month')
+    trend_labels = [calendar.month_name[int(row['period'][5:7])] for row in trend_rows]
+    trend_values = [row['total'] for row in trend_rows]
     
     return render_template("insights_expenses.html",
         category_labels=category_labels, category_data=category_values,
@@ -288,13 +313,29 @@ def insights_suggestions():
         "JOIN tbl_login l ON u.login_id = l.id "
         "JOIN tbl_category c ON s.category_id = c.id "
         "LEFT JOIN (SELECT login_id, category_id, SUM(amount) as total_amount FROM tbl_expense "
-        "WHERE MONTH(date) = MONTH(CURDATE()) GROUP BY login_id, category_id) e "
+        "WHERE " + in_range('date') + " GROUP BY login_id, category_id) e "
         "ON s.login_id = e.login_id AND s.category_id = e.category_id "
-        "WHERE s.month = '{}' AND s.year = {}".format(datetime.now().strftime('%B'), datetime.now().year)
+        "WHERE s.month = %s AND s.year = %s", month_bounds() + (datetime.now().strftime('%B'), datetime.now().year)
     )
     
     return render_template("insights_suggestions.html", suggestions=suggestions)
-    
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@app.route('/admin/db-stats')
+def db_stats():
+    if not session.get("admin", False):
+        return redirect(url_for('index'))
+    return jsonify({
+        'pool': db.pool_stats(),
+        'statement_cache': db.statement_cache_stats(),
+        'queries': db.query_stats(request.args.get('limit', 50, type=int)),
+        'replicas': db.replica_stats(),
+    }), 200
+
 
     
 
@@ -305,6 +346,96 @@ def insights_suggestions():
 
 
 
+def after_commit(callback):
+    """Run ``callback`` once the request succeeded, i.e. after its transaction committed."""
+    g.setdefault('after_commit', []).append(callback)
+
+
+def notify(user_id, kind, **data):
+    """Queue an event for ``user_id``'s feed, published after commit."""
+    after_commit(functools.partial(events.publish_many, [user_id], dict(data, type=kind)))
+
+
+@app.after_request
+def run_after_commit(response):
+    callbacks = g.pop('after_commit', [])
+    if response.status_code < 400:
+        for callback in callbacks:
+            callback()
+    return response
+
+
+def budget_alerts_raised(alerts):
+    for alert in alerts:
+        notify(alert['login_id'], 'budget', op='alert', id=alert['id'], category_id=alert['category_id'],
+               threshold=alert['threshold'], spent=alert['spent'], budget=alert['budget'])
+
+
+def expense_written(tx, old, new):
+    """Keep the tables derived from tbl_expense in step with a write (old/new row, None when absent)."""
+    # First: the version rows lock out the users' other writers until commit, which the
+    # forecast state's before/after month counts rely on
+    versions.bump_users(tx, [row['login_id'] for row in (old, new) if row])
+    rollup.apply_change(tx, old, new)
+    forecast_state.apply_change(tx, old, new)
+    scheduled = advance_scheduler.apply_change(tx, old, new)
+    if scheduled:
+        after_commit(functools.partial(scheduler.schedule, *scheduled))
+    budget_alerts_raised(budgets.apply_change(tx, old, new))
+    user_stats.refresh(tx, user_stats.expense_months(old, new))
+    if old and (not new or new['login_id'] != old['login_id']):
+        changes.record(tx, old['login_id'], 'expense', old['id'], changes.DELETE)
+        notify(old['login_id'], 'expense', op=changes.DELETE, id=old['id'], source=old['source'])
+    if new:
+        changes.record(tx, new['login_id'], 'expense', new['id'])
+        notify(new['login_id'], 'expense', op=changes.UPSERT, id=new['id'], source=new['source'], date=str(new['date']))
+
+
+def expenses_imported(tx, user_id, rows, ids):
+    """Bulk counterpart of expense_written for freshly inserted rows (``ids`` in the same order)."""
+    versions.bump(tx, versions.user_scope(user_id))
+    rollup.apply_rows(tx, rows)
+    forecast_state.apply_rows(tx, rows)
+    for scheduled in advance_scheduler.apply_inserted(tx, ids, rows):
+        after_commit(functools.partial(scheduler.schedule, *scheduled))
+    budget_alerts_raised(budgets.apply_rows(tx, rows))
+    user_stats.refresh(tx, user_stats.expense_months(*rows))
+    changes.record_inserted(tx, user_id, 'expense', ids)
+    notify(user_id, 'expense', op='import', count=len(rows))
+
+
+def conditional_get(per_user=True):
+    """Answer GETs with an ETag built from the data versions, and If-None-Match hits with 304.
+
+    The version is read before the view runs, so a write racing the read can only make the
+    tag older than the body (the next poll refetches), never newer.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET':
+                return view(*args, **kwargs)
+            scopes = [versions.GLOBAL]
+            if per_user:
+                scopes.append(versions.user_scope(kwargs['user_id']))
+            # The current month is part of the tag: most of these views roll over with it
+            tag = versions.etag(
+                versions.current(db, scopes), request.endpoint, request.query_string.decode(),
+                datetime.now().strftime('%Y-%m')
+            )
+            if request.if_none_match.contains(tag):
+                response = app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(tag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
 @app.route('/api/login', methods=['POST'])
 def login_user():
     try:
@@ -317,8 +448,8 @@ def login_user():
             
         # Verify credentials
         user = db.fetchone(
-            "SELECT * FROM tbl_login WHERE username='{}' AND password='{}' AND role='user'"
-            .format(username, password)
+            "SELECT * FROM tbl_login WHERE username = %s AND password = %s AND role = 'user'",
+            (username, password)
         )
         
         if not user:
@@ -364,22 +495,23 @@ def register_user():
 
         # Check if username already exists
         existing_user = db.fetchone(
-            "SELECT * FROM tbl_login WHERE username='{}'".format(username)
+            "SELECT * FROM tbl_login WHERE username = %s", (username,)
         )
         if existing_user:
             return jsonify({'error': 'Username already taken'}), 409
 
         # Insert into tbl_login with role 'user' and get the login_id
         login_id = db.executeAndReturnId(
-            "INSERT INTO tbl_login (username, password, role) VALUES ('{}', '{}', 'user')"
-            .format(username, password)
+            "INSERT INTO tbl_login (username, password, role) VALUES (%s, %s, 'user')",
+            (username, password)
         )
 
         # Insert into tbl_user with the retrieved login_id
         db.execute(
-            "INSERT INTO tbl_user (name, gender, age, login_id,salary) VALUES ('{}', '{}', '{}', {},'{}')"
-            .format(name, gender, age, login_id, salary)
+            "INSERT INTO tbl_user (name, gender, age, login_id, salary) VALUES (%s, %s, %s, %s, %s)",
+            (name, gender, age, login_id, salary)
         )
+        user_stats.refresh(db, [(login_id, datetime.now().year, datetime.now().month)])
 
         return jsonify({
             'message': 'User registered successfully',
@@ -398,8 +530,8 @@ def get_user(user_id):
     try:
         if request.method == 'PUT':
             data = request.get_json()
-            user = db.fetchone("SELECT * FROM tbl_user WHERE login_id = {}".format(user_id))
-            login = db.fetchone("SELECT * FROM tbl_login WHERE id = {}".format(user_id))
+            user = db.fetchone("SELECT * FROM tbl_user WHERE login_id = %s", (user_id,))
+            login = db.fetchone("SELECT * FROM tbl_login WHERE id = %s", (user_id,))
             if not user or not login:
                 return jsonify({'error': 'User not found'}), 404
 
@@ -416,12 +548,17 @@ def get_user(user_id):
                 return jsonify({'error': 'Required fields missing'}), 400
             # ... (rest of validation logic remains the same)
 
-            db.execute("UPDATE tbl_login SET username = '{}', password = '{}' WHERE id = {}".format(username, password, user_id))
-            db.execute("UPDATE tbl_user SET name = '{}', gender = '{}', age = '{}', salary = '{}' WHERE login_id = {}".format(name, gender, age, salary, user_id))
+            with db.transaction() as tx:
+                tx.execute("UPDATE tbl_login SET username = %s, password = %s WHERE id = %s", (username, password, user_id))
+                tx.execute("UPDATE tbl_user SET name = %s, gender = %s, age = %s, salary = %s WHERE login_id = %s", (name, gender, age, salary, user_id))
+                user_stats.refresh(tx, [(user_id, datetime.now().year, datetime.now().month)])
+                versions.bump(tx, versions.user_scope(user_id))
+            if salary != user['salary']:
+                notify(user_id, 'income', op='salary', salary=salary)
             return jsonify({'message': 'User updated successfully'}), 200
         else:
             # GET logic remains unchanged
-            user = db.fetchone("SELECT u.*, l.username FROM tbl_user u JOIN tbl_login l ON u.login_id = l.id WHERE u.login_id = {}".format(user_id))
+            user = db.fetchone("SELECT u.*, l.username FROM tbl_user u JOIN tbl_login l ON u.login_id = l.id WHERE u.login_id = %s", (user_id,))
             if not user:
                 return jsonify({'error': 'User not found'}), 404
             return jsonify({
@@ -443,7 +580,7 @@ def verify_password(user_id):
         if not password:
             return jsonify({'error': 'Password is required'}), 400
         
-        user = db.fetchone("SELECT password FROM tbl_login WHERE id = {}".format(user_id))
+        user = db.fetchone("SELECT password FROM tbl_login WHERE id = %s", (user_id,))
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
@@ -459,7 +596,11 @@ def update_salary(user_id):
         salary = data.get('salary')
         if not isinstance(salary, (int, float)) or salary < 0:
             return jsonify({'error': 'Invalid salary'}), 400
-        db.execute("UPDATE tbl_user SET salary = '{}' WHERE login_id = {}".format(salary, user_id))
+        with db.transaction() as tx:
+            tx.execute("UPDATE tbl_user SET salary = %s WHERE login_id = %s", (salary, user_id))
+            user_stats.refresh(tx, [(user_id, datetime.now().year, datetime.now().month)])
+            versions.bump(tx, versions.user_scope(user_id))
+        notify(user_id, 'income', op='salary', salary=salary)
         return jsonify({'message': 'Salary updated successfully', 'salary': salary}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -469,7 +610,8 @@ def get_user_expenses(user_id):
     try:
         # Assuming a table tbl_expense with login_id, amount, and date
         total_expenses = db.fetchone(
-            "SELECT SUM(amount) as total FROM tbl_expense WHERE login_id = {} AND YEAR(date) = YEAR(CURDATE())".format(user_id)
+            "SELECT SUM(amount) as total FROM tbl_expense WHERE login_id = %s AND " + in_range('date'),
+            (user_id,) + year_bounds()
         )
         return jsonify({
             'total_expenses': total_expenses['total'] or 0,
@@ -489,14 +631,20 @@ def add_additional_income(user_id):
         if not isinstance(amount, (int, float)) or amount < 0:
             return jsonify({'error': 'Invalid amount'}), 400
         month = datetime.now().strftime('%Y-%m')  # e.g., '2025-03'
-        db.execute(
-            "INSERT INTO tbl_add_income (login_id, amount, month) VALUES ({},'{}','{}')".format(user_id, amount, month)
-        )
+        with db.transaction() as tx:
+            income_id = tx.single_insert(
+                "INSERT INTO tbl_add_income (login_id, amount, month) VALUES (%s, %s, %s)", (user_id, amount, month)
+            )
+            user_stats.refresh(tx, [(user_id,) + user_stats.income_month(month)])
+            versions.bump(tx, versions.user_scope(user_id))
+            changes.record(tx, user_id, 'income', income_id)
+            notify(user_id, 'income', op=changes.UPSERT, id=income_id)
         return jsonify({'message': 'Additional income added', 'amount': amount, 'month': month}), 201
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     
 @app.route('/api/category', methods=['GET'])
+@conditional_get(per_user=False)
 def get_categories():
     try:
         categories = db.fetchall("SELECT * FROM tbl_category")
@@ -504,6 +652,153 @@ def get_categories():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     
+@app.route('/api/expense/<int:user_id>/bulk', methods=['POST'])
+def import_expenses(user_id):
+    """Bulk-create expenses from a JSON array or an uploaded CSV file (field 'file')."""
+    try:
+        started = time.perf_counter()
+        if 'file' in request.files:
+            records = expense_import.read_csv(request.files['file'].stream)
+        elif request.mimetype == 'text/csv':
+            records = expense_import.read_csv(request.stream)
+        else:
+            records = request.get_json(silent=True)
+            if not isinstance(records, list):
+                return jsonify({'error': 'Expected a JSON array of expenses or a CSV file'}), 400
+
+        categories = db.fetchall("SELECT id, category_name FROM tbl_category")
+        rows, errors = expense_import.validate(records, user_id, categories)
+        if rows:
+            with db.transaction() as tx:
+                # The ids of exactly these rows, so a concurrent write by the same user is not picked up
+                ids = tx.insert_many_ids(
+                    'tbl_expense', expense_import.COLUMNS,
+                    [tuple(row[c] for c in expense_import.COLUMNS) for row in rows],
+                    batch_size=expense_import.BATCH_SIZE
+                )
+                expenses_imported(tx, user_id, rows, ids)
+
+        elapsed = time.perf_counter() - started
+        return jsonify({
+            'inserted': len(rows),
+            'errors': errors,
+            'elapsed_ms': round(elapsed * 1000, 1),
+            'rows_per_second': round(len(rows) / elapsed, 1) if elapsed > 0 else None
+        }), 201 if rows else 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/expense/<int:user_id>/export', methods=['GET'])
+def export_expenses(user_id):
+    """Stream all of a user's expenses (with category names) as NDJSON (default) or CSV.
+
+    ?format=ndjson|csv, optional from / to (YYYY-MM-DD, inclusive). The body is gzip-compressed on
+    the fly when the client sends Accept-Encoding: gzip. Rows come from an unbuffered cursor a batch
+    at a time, so memory stays flat however long the history is.
+    """
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in expense_export.FORMATS:
+        return jsonify({'error': 'format must be one of: {}'.format(', '.join(expense_export.FORMATS))}), 400
+    try:
+        date_from = pagination.parse_date(request.args.get('from'), 'from')
+        date_to = pagination.parse_date(request.args.get('to'), 'to')
+    except pagination.BadRequest as e:
+        return jsonify({'error': str(e)}), 400
+
+    conditions = ["e.login_id = %s"]
+    params = [user_id]
+    if date_from:
+        conditions.append("e.date >= %s")
+        params.append(date_from)
+    if date_to:
+        conditions.append("e.date <= %s")
+        params.append(date_to)
+
+    compress = 'gzip' in request.accept_encodings
+    batches = db.stream(
+        expense_export.QUERY.format(where=' AND '.join(conditions)), params, expense_export.BATCH_SIZE
+    )
+    response = Response(
+        stream_with_context(expense_export.encode(batches, fmt, compress)),
+        mimetype=expense_export.FORMATS[fmt]
+    )
+    response.headers['Content-Disposition'] = 'attachment; filename="expenses-{}.{}"'.format(user_id, fmt)
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.vary.add('Accept-Encoding')
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+EXPENSE_FIELDS = ('id', 'login_id', 'category_id', 'amount', 'details', 'source', 'date')
+
+
+def list_expenses(user_id):
+    """Newest-first page of a user's expenses, keyset-paginated on (date, id).
+
+    Query args: limit, cursor (from the X-Next-Cursor header of the previous page),
+    fields (comma-separated projection), from / to (inclusive dates), category_id, source.
+    The body stays a JSON array; the next cursor is sent in X-Next-Cursor and a Link header.
+    """
+    try:
+        limit = pagination.parse_limit(request.args.get('limit'))
+        fields = pagination.parse_fields(request.args.get('fields'), EXPENSE_FIELDS)
+        date_from = pagination.parse_date(request.args.get('from'), 'from')
+        date_to = pagination.parse_date(request.args.get('to'), 'to')
+        cursor = request.args.get('cursor')
+        after = pagination.decode_cursor(cursor, str, int) if cursor else None
+        if after is not None:
+            after[0] = pagination.parse_date(after[0], 'cursor')
+            if after[0] is None:
+                raise pagination.BadRequest('Invalid cursor')
+        category_id = pagination.parse_int(request.args.get('category_id'), 'category_id')
+    except pagination.BadRequest as e:
+        return jsonify({'error': str(e)}), 400
+
+    conditions = ["login_id = %s"]
+    params = [user_id]
+    if date_from:
+        conditions.append("date >= %s")
+        params.append(date_from)
+    if date_to:
+        conditions.append("date <= %s")
+        params.append(date_to)
+    if category_id is not None:
+        conditions.append("category_id = %s")
+        params.append(category_id)
+    if request.args.get('source'):
+        conditions.append("source = %s")
+        params.append(request.args['source'])
+    if after is not None:
+        conditions.append("(date < %s OR (date = %s AND id < %s))")
+        params.extend([after[0], after[0], after[1]])
+
+    # The sort key is always selected so the next cursor can be built, then dropped if not requested
+    columns = list(dict.fromkeys((fields or list(EXPENSE_FIELDS)) + ['date', 'id']))
+    rows = db.fetchall(
+        "SELECT {} FROM tbl_expense WHERE {} ORDER BY date DESC, id DESC LIMIT %s".format(
+            ', '.join(columns), ' AND '.join(conditions)
+        ),
+        params + [limit + 1]
+    )
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = pagination.encode_cursor([rows[-1]['date'], rows[-1]['id']])
+    if fields:
+        rows = [{f: row[f] for f in fields} for row in rows]
+
+    response = jsonify(rows)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+        args = request.args.to_dict()
+        args['cursor'] = next_cursor
+        response.headers['Link'] = '<{}>; rel="next"'.format(url_for('add_expense', user_id=user_id, **args))
+    return response, 200
+
+
 @app.route('/api/expense/<int:user_id>', methods=['POST','GET','PUT','DELETE'])
 def add_expense(user_id):
     try:
@@ -515,12 +810,16 @@ def add_expense(user_id):
             source = data.get('source')
             # date = data.get('date') ? data.get('date') : datetime.now().strftime('%Y-%m-%d')
             date = data.get('date') or datetime.now().strftime('%Y-%m-%d')
-            db.single_insert("INSERT INTO tbl_expense (login_id, category_id, amount, details, source, date) VALUES ({}, {}, {}, '{}', '{}', '{}')".format(user_id, category_id, amount, details, source, date))
+            with db.transaction() as tx:
+                expense_id = tx.single_insert(
+                    "INSERT INTO tbl_expense (login_id, category_id, amount, details, source, date) VALUES (%s, %s, %s, %s, %s, %s)",
+                    (user_id, category_id, amount, details, source, date)
+                )
+                expense_written(tx, None, tx.fetchone("SELECT * FROM tbl_expense WHERE id = %s", (expense_id,)))
             return jsonify({'message': 'Expense added successfully'}), 201
         
         elif request.method == 'GET':
-            expenses = db.fetchall("SELECT * FROM tbl_expense WHERE login_id = {}".format(user_id))
-            return jsonify(expenses), 200
+            return list_expenses(user_id)
         
         elif request.method == 'PUT':
             data = request.get_json()
@@ -530,12 +829,21 @@ def add_expense(user_id):
             details = data.get('details')
             source = data.get('source')
             date = data.get('date')
-            db.execute("UPDATE tbl_expense SET category_id = {}, amount = {}, details = '{}', source = '{}', date = '{}' WHERE id = {}".format(category_id, amount, details, source, date, expense_id))
+            with db.transaction() as tx:
+                old = tx.fetchone("SELECT * FROM tbl_expense WHERE id = %s FOR UPDATE", (expense_id,))
+                tx.execute(
+                    "UPDATE tbl_expense SET category_id = %s, amount = %s, details = %s, source = %s, date = %s WHERE id = %s",
+                    (category_id, amount, details, source, date, expense_id)
+                )
+                expense_written(tx, old, tx.fetchone("SELECT * FROM tbl_expense WHERE id = %s", (expense_id,)))
             return jsonify({'message': 'Expense updated successfully'}), 200
         
         elif request.method == 'DELETE':
             expense_id = request.args.get('expense_id')
-            db.execute("DELETE FROM tbl_expense WHERE id = {}".format(expense_id))
+            with db.transaction() as tx:
+                old = tx.fetchone("SELECT * FROM tbl_expense WHERE id = %s FOR UPDATE", (expense_id,))
+                tx.execute("DELETE FROM tbl_expense WHERE id = %s", (expense_id,))
+                expense_written(tx, old, None)
             return jsonify({'message': 'Expense deleted successfully'}), 200
         
     except Exception as e:
@@ -556,15 +864,19 @@ def add_priority(user_id):
             if priority not in valid_priorities:
                 return jsonify({'error': "Priority must be 'high', 'medium', or 'low'"}), 400
             
-            priority_exist = db.fetchone("SELECT * FROM tbl_priority WHERE login_id = {} AND category_id = {}".format(user_id, category_id))
+            priority_exist = db.fetchone("SELECT * FROM tbl_priority WHERE login_id = %s AND category_id = %s", (user_id, category_id))
             if priority_exist:
                 return jsonify({'error': 'Priority already exists for this category'}), 400
             
-            db.single_insert("INSERT INTO tbl_priority (login_id, category_id, priority) VALUES ({}, {}, '{}')".format(user_id, category_id, priority))
+            with db.transaction() as tx:
+                priority_id = tx.single_insert("INSERT INTO tbl_priority (login_id, category_id, priority) VALUES (%s, %s, %s)", (user_id, category_id, priority))
+                versions.bump(tx, versions.user_scope(user_id))
+                changes.record(tx, user_id, 'priority', priority_id)
+                notify(user_id, 'priority', op=changes.UPSERT, id=priority_id)
             return jsonify({'message': 'Priority added successfully'}), 201
         
         elif request.method == 'GET':
-            priorities = db.fetchall("SELECT * FROM tbl_priority WHERE login_id = {}".format(user_id))
+            priorities = db.fetchall("SELECT * FROM tbl_priority WHERE login_id = %s", (user_id,))
             return jsonify(priorities), 200
         
         elif request.method == 'PUT':
@@ -580,7 +892,13 @@ def add_priority(user_id):
             if priority not in valid_priorities:
                 return jsonify({'error': "Priority must be 'high', 'medium', or 'low'"}), 400
             
-            db.execute("UPDATE tbl_priority SET category_id = {}, priority = '{}' WHERE id = {}".format(category_id, priority, priority_id))
+            with db.transaction() as tx:
+                if not tx.fetchone("SELECT id FROM tbl_priority WHERE id = %s AND login_id = %s FOR UPDATE", (priority_id, user_id)):
+                    return jsonify({'error': 'Priority not found'}), 404
+                tx.execute("UPDATE tbl_priority SET category_id = %s, priority = %s WHERE id = %s AND login_id = %s", (category_id, priority, priority_id, user_id))
+                versions.bump(tx, versions.user_scope(user_id))
+                changes.record(tx, user_id, 'priority', priority_id)
+                notify(user_id, 'priority', op=changes.UPSERT, id=priority_id)
             return jsonify({'message': 'Priority updated successfully'}), 200
         
         elif request.method == 'DELETE':
@@ -589,7 +907,13 @@ def add_priority(user_id):
             if not priority_id or not isinstance(priority_id, int):
                 return jsonify({'error': 'Invalid or missing priority_id'}), 400
             
-            db.execute("DELETE FROM tbl_priority WHERE id = {}".format(priority_id))
+            with db.transaction() as tx:
+                if not tx.fetchone("SELECT id FROM tbl_priority WHERE id = %s AND login_id = %s FOR UPDATE", (priority_id, user_id)):
+                    return jsonify({'error': 'Priority not found'}), 404
+                tx.execute("DELETE FROM tbl_priority WHERE id = %s AND login_id = %s", (priority_id, user_id))
+                versions.bump(tx, versions.user_scope(user_id))
+                changes.record(tx, user_id, 'priority', priority_id, changes.DELETE)
+                notify(user_id, 'priority', op=changes.DELETE, id=priority_id)
             return jsonify({'message': 'Priority deleted successfully'}), 200
         
     except Exception as e:
@@ -708,128 +1032,65 @@ def add_priority(user_id):
 def add_suggestion(user_id):
     try:
         if request.method == 'POST':
-            print(f"🔵 Processing request for user ID: {user_id}")
-
-            # 🔹 Fetch user priorities
-            priorities = db.fetchall("""
-                SELECT p.priority, c.category_name, c.id as category_id 
-                FROM tbl_priority p 
-                INNER JOIN tbl_category c ON p.category_id = c.id 
-                WHERE p.login_id = {}
-            """.format(user_id))
-            print(f"🟢 Fetched Priorities: {priorities}")
+            log.debug("Generating suggestions for user %s", user_id)
+
+            # 🔹 Priorities, past expenses, income and monthly history don't depend on each other: fetch them together
+            priorities, expenses, income_data, trend_states = fanout.fetch_all(db, fanout_db, [
+                ('fetchall', """
+                    SELECT p.priority, c.category_name, c.id as category_id 
+                    FROM tbl_priority p 
+                    INNER JOIN tbl_category c ON p.category_id = c.id 
+                    WHERE p.login_id = %s
+                """, (user_id,)),
+                ('fetchall', """
+                    SELECT m.category_id, c.category_name, SUM(m.total) as total_amount 
+                    FROM tbl_expense_monthly m 
+                    INNER JOIN tbl_category c ON m.category_id = c.id 
+                    WHERE m.login_id = %s 
+                    GROUP BY m.category_id, c.category_name
+                """, (user_id,)),
+                ('fetchone', """
+                    SELECT (IFNULL(SUM(a.amount), 0) + IFNULL(u.salary, 0)) as total_amount 
+                    FROM tbl_user u 
+                    LEFT JOIN tbl_add_income a ON a.login_id = u.login_id 
+                    WHERE u.login_id = %s
+                """, (user_id,)),
+                ('fetchall', forecast_state.USER_STATE, (user_id,)),
+            ])
+            log.debug("Priorities for user %s: %s", user_id, priorities)
 
             if not priorities:
                 return jsonify({'error': 'No priorities found for user'}), 404
 
-            # 🔹 Fetch previous expenses
-            expenses = db.fetchall("""
-                SELECT e.category_id, c.category_name, SUM(e.amount) as total_amount 
-                FROM tbl_expense e 
-                INNER JOIN tbl_category c ON e.category_id = c.id 
-                WHERE e.login_id = {} 
-                GROUP BY e.category_id, c.category_name
-            """.format(user_id))
-            print(f"🟢 Fetched Expenses: {expenses}")
-
+            log.debug("Expenses by category for user %s: %s", user_id, expenses)
             total_expenses = sum((e['total_amount'] or 0) for e in expenses) if expenses else 0
-            print(f"🔹 Total Expenses: {total_expenses}")
-
-            # 🔹 Fetch total income
-            income_data = db.fetchone("""
-                SELECT (IFNULL(SUM(a.amount), 0) + IFNULL(u.salary, 0)) as total_amount 
-                FROM tbl_user u 
-                LEFT JOIN tbl_add_income a ON a.login_id = u.login_id 
-                WHERE u.login_id = {}
-            """.format(user_id))
-            print(f"🟢 Fetched Income Data: {income_data}")
+            log.debug("Total expenses for user %s: %s", user_id, total_expenses)
 
             total_income = income_data['total_amount'] if income_data and income_data['total_amount'] is not None else 0
-            print(f"🔹 Total Income: {total_income}")
+            log.debug("Total income for user %s: %s", user_id, total_income)
 
             if total_income <= 0:
                 return jsonify({'error': 'No valid income data available'}), 400
 
-            # 🔹 Priority Weights
-            priority_weights = {'high': 0.5, 'medium': 0.3, 'low': 0.2}
-            total_weight = sum(priority_weights[p['priority']] for p in priorities)
-            print(f"🔹 Total Weight: {total_weight}")
-
-            # 🔹 AI-Enhanced Suggestions
-            suggestions = []
             current_month = datetime.now().strftime('%B')
             current_year = datetime.now().year
 
-            for priority in priorities:
-                category_id = priority['category_id']
-                category_name = priority['category_name']
-                priority_level = priority['priority']
+            # 🔹 Forecast every priority category from its stored trend state
+            forecasts = forecast_state.forecasts(trend_states, [p['category_id'] for p in priorities])
+            log.debug("Forecasts for user %s: %s", user_id, forecasts)
 
-                priority_weight = priority_weights.get(priority_level, 0) / total_weight
-                past_expense = next((e['total_amount'] or 0 for e in expenses if e['category_id'] == category_id), 0)
-                expense_weight = (past_expense / total_expenses) if total_expenses > 0 else 0
-                
-                predicted_expense = predict_expense(category_id, user_id, db) or 0.0
-                ai_weight = (0.6 * priority_weight) + (0.4 * expense_weight)
-
-                # 🔥 Debugging Logs 🔥
-                print(f"\n🔸 Checking category: {category_name} (ID: {category_id})")
-                print(f"    🟡 Priority: {priority_level}")
-                print(f"    🟡 Priority Weight: {priority_weight}")
-                print(f"    🟡 Expense Weight: {expense_weight}")
-                print(f"    🟡 Predicted Expense: {predicted_expense}")
-                print(f"    🟡 AI Weight: {ai_weight}")
-                print(f"    🟡 Total Income: {total_income}")
-
-                # 🔴 Ensure no None values before calculation
-                predicted_expense = float(predicted_expense if predicted_expense is not None else 0)
-                total_income_safe = float(total_income if total_income is not None else 0)
-                ai_weight = float(ai_weight if ai_weight is not None else 0)
-
-                print(f"🔍 Debug Before Calculation: predicted_expense={predicted_expense}, total_income={total_income_safe}, ai_weight={ai_weight}")
-
-                try:
-                    suggested_amount = min(predicted_expense, total_income_safe * ai_weight)
-                except TypeError as e:
-                    print(f"❌ Exception Caught: {e}")
-                    print(f"❌ Debug Values at Error: predicted_expense={predicted_expense}, total_income={total_income_safe}, ai_weight={ai_weight}")
-                    suggested_amount = 0
-
-                print(f"✅ Final Suggested Amount for {category_name}: {suggested_amount}")
-
-                suggestions.append({
-                    'login_id': user_id,
-                    'category_id': category_id,
-                    'suggested_amount': round(suggested_amount, 2),
-                    'month': current_month,
-                    'year': current_year
-                })
-
-            # 🔹 Normalize suggestions if needed
-            total_suggested = sum(s['suggested_amount'] for s in suggestions)
-            print(f"🔹 Total Suggested: {total_suggested}")
-            if total_suggested > total_income and total_suggested > 0:
-                scale_factor = total_income / total_suggested
-                print(f"⚖️ Scaling suggestions by factor: {scale_factor}")
-                for s in suggestions:
-                    s['suggested_amount'] = round(s['suggested_amount'] * scale_factor, 2)
-
-            # 🔹 Delete old suggestions for this month
-            db.execute("""
-                DELETE FROM tbl_suggestions WHERE login_id = {} AND month = '{}' AND year = {}
-            """.format(user_id, current_month, current_year))
-
-            # 🔹 Insert new AI-enhanced suggestions
-            for suggestion in suggestions:
-                db.execute("""
-                    INSERT INTO tbl_suggestions (login_id, category_id, suggested_amount, month, year) 
-                    VALUES ({}, {}, {}, '{}', {})
-                """.format(
-                    suggestion['login_id'], suggestion['category_id'], suggestion['suggested_amount'],
-                    suggestion['month'], suggestion['year']
-                ))
-
-            print(f"✅ Suggestions Generated: {suggestions}")
+            # 🔹 AI-Enhanced Suggestions
+            suggestions = suggestion_rules.compute(
+                user_id, priorities, expenses, total_income, forecasts, current_month, current_year
+            )
+
+            # 🔹 Replace this month's suggestions with one multi-row insert
+            with db.transaction() as tx:
+                suggestion_rules.replace(tx, [user_id], current_month, current_year, suggestions)
+            notify(user_id, 'suggestions', month=current_month, year=current_year)
+
+            log.info("Generated %d suggestions for user %s", len(suggestions), user_id)
+            log.debug("Suggestions for user %s: %s", user_id, suggestions)
             return jsonify({'message': '✅ AI-enhanced suggestions added successfully', 'suggestions': suggestions}), 201
 
         elif request.method == 'GET':
@@ -837,143 +1098,229 @@ def add_suggestion(user_id):
                 SELECT s.category_id, c.category_name, s.suggested_amount, s.month, s.year 
                 FROM tbl_suggestions s 
                 INNER JOIN tbl_category c ON s.category_id = c.id 
-                WHERE s.login_id = {}
-            """.format(user_id))
+                WHERE s.login_id = %s
+            """, (user_id,))
             return jsonify(suggestions), 200
 
         else:
             return jsonify({'error': 'Method not implemented'}), 501
 
     except Exception as e:
-        print(f"❌ Exception: {str(e)}")
+        log.exception("Suggestion request failed for user %s", user_id)
         return jsonify({'error': str(e)}), 500
 
 
 def predict_expense(category_id, user_id, db):
-    """Predict future expenses using linear regression."""
-    past_expenses = db.fetchall("""
-        SELECT SUM(e.amount) as total_amount, MONTH(e.date) as month, YEAR(e.date) as year 
-        FROM tbl_expense e 
-        WHERE e.login_id = {} AND e.category_id = {} 
-        GROUP BY YEAR(e.date), MONTH(e.date) 
-        ORDER BY YEAR(e.date), MONTH(e.date)
-    """.format(user_id, category_id))
-    
-    print(f"🔍 predict_expense for category_id={category_id}: past_expenses={past_expenses}")
-    
-    if not past_expenses or len(past_expenses) < 2:
-        return past_expenses[0]['total_amount'] or 0 if past_expenses else 0  
-
-    X = np.array([[exp['year'] * 12 + exp['month']] for exp in past_expenses])
-    y = np.array([exp['total_amount'] or 0 for exp in past_expenses])  
-
-    model = LinearRegression()
-    model.fit(X, y)
-
-    next_month = datetime.now().year * 12 + datetime.now().month + 1
-    predicted_expense = model.predict([[next_month]])[0]
-
-    print(f"🔍 Predicted expense for category_id={category_id}: {predicted_expense}")
-    return max(predicted_expense, 0)
+    """Predict next month's expense for one category (least-squares trend, read from tbl_forecast_state)."""
+    predicted_expense = forecast_state.predict(db, user_id, category_id)
+    log.debug("Predicted expense for category=%s user=%s: %s", category_id, user_id, predicted_expense)
+    return predicted_expense
 
     
 @app.route('/api/progressbar/<int:user_id>', methods=['GET'])
+@conditional_get()
 def progressbar(user_id):
     try:
-       
-        # expense_data = db.fetchall(
-        #     "SELECT c.category_name, SUM(e.amount) as total_amount, s.suggested_amount "
-        #     "FROM tbl_expense e "
-        #     "INNER JOIN tbl_category c ON e.category_id = c.id "
-        #     "INNER JOIN tbl_suggestions s ON e.category_id = s.category_id "
-        #     "WHERE e.login_id = {} AND e.date = CURDATE() "
-        #     "GROUP BY c.category_name".format(user_id)
-        # )
-        # monthly
+        now = datetime.now()
+        # This month's spend against the budget, straight from the counters
         expense_data = db.fetchall(
-            "SELECT c.category_name, SUM(e.amount) as total_amount, s.suggested_amount "
-            "FROM tbl_expense e "
-            "INNER JOIN tbl_category c ON e.category_id = c.id "
-            "INNER JOIN tbl_suggestions s ON e.category_id = s.category_id "
-            "WHERE e.login_id = {} AND MONTH(e.date) = MONTH(CURDATE()) AND YEAR(e.date) = YEAR(CURDATE()) "
-            "GROUP BY c.category_name".format(user_id)
+            "SELECT c.category_name, b.spent as total_amount, b.budget as suggested_amount "
+            "FROM tbl_budget_counter b "
+            "INNER JOIN tbl_category c ON b.category_id = c.id "
+            "WHERE b.login_id = %s AND b.year = %s AND b.month = %s AND b.cnt > 0 AND b.budget IS NOT NULL",
+            (user_id, now.year, now.month)
         )
         return jsonify(expense_data), 200
 
     except Exception as e:  
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/user/<int:user_id>/budget-alerts', methods=['GET'])
+def get_budget_alerts(user_id):
+    """Threshold alerts raised by expense writes, oldest first; ?since=<alert id> for the newer ones."""
+    try:
+        since = int(request.args.get('since') or 0)
+        limit = pagination.parse_limit(request.args.get('limit'), 50, pagination.MAX_LIMIT)
+    except (ValueError, pagination.BadRequest) as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        alerts = budgets.alerts(db, user_id, since, limit)
+        return jsonify({'alerts': alerts, 'last_id': alerts[-1]['id'] if alerts else since}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+def range_analytics(login_id=None, dimensions=expense_cube.DIMENSIONS):
+    """Answer an analytics request from the expense cube.
+
+    ?from / to (YYYY-MM-DD, inclusive; default this year), granularity (day | week | month | year),
+    group_by (comma-separated ``dimensions``), category, source.
+    """
+    today = datetime.now().date()
+    try:
+        start = pagination.parse_date(request.args.get('from'), 'from') or today.replace(month=1, day=1)
+        end = pagination.parse_date(request.args.get('to'), 'to') or today
+        granularity = request.args.get('granularity', 'month')
+        group_by = pagination.parse_fields(request.args.get('group_by'), dimensions) or []
+        category_id = pagination.parse_int(request.args.get('category'), 'category')
+        source = request.args.get('source')
+        cube.sync(db, wait=False)
+        rows, summary = cube.query(start, end, granularity, group_by, login_id, category_id, source)
+        if 'category' in group_by:
+            names = {row['id']: row['category_name'] for row in db.fetchall("SELECT id, category_name FROM tbl_category")}
+            for row in rows:
+                row['category_name'] = names.get(row['category_id'])
+    except ValueError as e:   # includes pagination.BadRequest
+        return jsonify({'error': str(e)}), 400
+    except expense_cube.NotReady as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    return jsonify(dict(summary, rows=rows, granularity=granularity, group_by=group_by,
+                        **{'from': start.isoformat(), 'to': end.isoformat()})), 200
+
+
+@app.route('/api/user/<int:user_id>/analytics', methods=['GET'])
+def user_analytics(user_id):
+    """The user's expense totals over any date range and granularity, optionally by category / source."""
+    return range_analytics(user_id, ('category', 'source'))
+
+
+@app.route('/admin/analytics')
+def admin_analytics():
+    """Expense totals across users; group_by may also include user, and ?user= narrows to one."""
+    if not session.get("admin", False):
+        return redirect(url_for('index'))
+    try:
+        login_id = pagination.parse_int(request.args.get('user'), 'user')
+    except pagination.BadRequest as e:
+        return jsonify({'error': str(e)}), 400
+    return range_analytics(login_id)
+
+
+@app.route('/api/user/<int:user_id>/events', methods=['GET'])
+def event_stream(user_id):
+    """Server-Sent Events feed of the user's writes. Reconnects resume from Last-Event-ID."""
+    after = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        after = int(after) if after else None
+    except ValueError:
+        return jsonify({'error': 'Invalid event id'}), 400
+    response = Response(stream_with_context(events.stream(events.broker(), user_id, after)),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'   # stop nginx from buffering the stream
+    return response
+
+
+@app.route('/api/user/<int:user_id>/events/poll', methods=['GET'])
+def poll_events(user_id):
+    """Long-poll fallback: returns as soon as there are events after ?since=, or empty after ?timeout= seconds."""
+    try:
+        since = request.args.get('since')
+        timeout = min(float(request.args.get('timeout', events.POLL_TIMEOUT)), events.MAX_POLL_TIMEOUT)
+        source = events.broker()
+        since = int(since) if since else events.latest_seq(source, user_id)
+    except ValueError:
+        return jsonify({'error': 'Invalid since or timeout'}), 400
+    found = events.wait(source, user_id, since, max(timeout, 0))
+    return jsonify({'events': found, 'last_seq': found[-1]['seq'] if found else since}), 200
+
+
 @app.route('/api/notifications/<int:user_id>', methods=['GET'])
 def notifications(user_id):
+    """Advance payments that are due and not acknowledged yet."""
     try:
-        notifications=db.fetchall("SELECT e.*,category_name FROM tbl_expense e inner join tbl_category c on e.category_id=c.id WHERE login_id = {} AND source = 'advance' AND date <= CURDATE()".format(user_id))
+        notifications = advance_scheduler.due(db, user_id)
         return jsonify(notifications), 200
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+
+@app.route('/api/notifications/<int:user_id>/ack', methods=['POST'])
+def acknowledge_notifications(user_id):
+    """Mark due notifications handled: {"ids": [expense ids]}, or every due one when ids is left out."""
+    try:
+        data = request.get_json(silent=True) or {}
+        ids = data.get('ids')
+        if ids is not None and not (isinstance(ids, list) and all(isinstance(i, int) for i in ids)):
+            return jsonify({'error': 'ids must be a list of expense ids'}), 400
+        acked = advance_scheduler.acknowledge(db, user_id, ids)
+        if acked:
+            notify(user_id, 'notification', op='ack', ids=ids)
+        return jsonify({'acknowledged': acked}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/user/<int:user_id>/additional-income-sum', methods=['GET'])
 def get_additional_income_sum(user_id):
     try:
         month = request.args.get('month', datetime.now().strftime('%Y-%m'))  # e.g., "2025-03"
         income_data = db.fetchone(
-            "SELECT SUM(amount) as sum FROM tbl_add_income WHERE login_id = {} AND month = '{}'".format(user_id, month)
+            "SELECT SUM(amount) as sum FROM tbl_add_income WHERE login_id = %s AND month = %s", (user_id, month)
         )
         return jsonify({'sum': income_data['sum'] or 0}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/expense/<int:user_id>/by-category', methods=['GET'])
+@conditional_get()
 def get_expenses_by_category(user_id):
     try:
-        month = datetime.now().strftime('%Y-%m')  # e.g., "2025-03"
+        now = datetime.now()
         data = db.fetchall(
-            "SELECT c.category_name, SUM(e.amount) as total_amount, c.id as category_id "
-            "FROM tbl_expense e "
-            "INNER JOIN tbl_category c ON e.category_id = c.id "
-            "WHERE e.login_id = {} AND DATE_FORMAT(e.date, '%Y-%m') = '{}' "
-            "GROUP BY c.id, c.category_name".format(user_id, month)
+            "SELECT c.category_name, SUM(m.total) as total_amount, c.id as category_id "
+            "FROM tbl_expense_monthly m "
+            "INNER JOIN tbl_category c ON m.category_id = c.id "
+            "WHERE m.login_id = %s AND m.year = %s AND m.month = %s "
+            "GROUP BY c.id, c.category_name", (user_id, now.year, now.month)
         )
         return jsonify(data), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     
 @app.route('/api/expense/<int:user_id>/trends', methods=['GET'])
+@conditional_get()
 def get_expense_trends(user_id):
     try:
         trends = db.fetchall(
-            "SELECT YEAR(date) as year, MONTHNAME(date) as month, SUM(amount) as total_amount "
-            "FROM tbl_expense WHERE login_id = {} "
-            "GROUP BY YEAR(date), MONTH(date) "
-            "ORDER BY YEAR(date), MONTH(date)".format(user_id)
+            "SELECT year, month, SUM(total) as total_amount "
+            "FROM tbl_expense_monthly WHERE login_id = %s "
+            "GROUP BY year, month "
+            "ORDER BY year, month", (user_id,)
         )
+        for row in trends:
+            row['month'] = calendar.month_name[row['month']]
         return jsonify(trends), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/priority/<int:user_id>/vs-spending', methods=['GET'])
+@conditional_get()
 def get_priority_vs_spending(user_id):
     try:
-        month = datetime.now().strftime('%Y-%m')
+        now = datetime.now()
         data = db.fetchall(
-            "SELECT c.category_name, p.priority, s.suggested_amount, SUM(e.amount) as total_amount "
+            "SELECT c.category_name, p.priority, b.budget as suggested_amount, "
+            "IF(b.cnt > 0, b.spent, NULL) as total_amount "
             "FROM tbl_priority p "
             "INNER JOIN tbl_category c ON p.category_id = c.id "
-            "INNER JOIN tbl_suggestions s ON p.category_id = s.category_id "
-            "LEFT JOIN tbl_expense e ON p.category_id = e.category_id AND DATE_FORMAT(e.date, '%Y-%m') = '{}' "
-            "WHERE p.login_id = {} AND s.month = '{}' AND s.year = {} "
-            "GROUP BY c.category_name, p.priority, s.suggested_amount".format(
-                month, user_id, datetime.now().strftime('%B'), datetime.now().year
-            )
+            "INNER JOIN tbl_budget_counter b ON b.login_id = p.login_id AND b.category_id = p.category_id "
+            "AND b.year = %s AND b.month = %s "
+            "WHERE p.login_id = %s AND b.budget IS NOT NULL",
+            (now.year, now.month, user_id)
         )
         return jsonify(data), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/user/<int:user_id>/summary', methods=['GET'])
+@conditional_get()
 def get_user_summary(user_id):
     try:
-        month = datetime.now().strftime('%Y-%m')
+        now = datetime.now()
+        month = now.strftime('%Y-%m')
         summary = db.fetchone(
                 "SELECT "
                 "  u.salary AS fixed_salary, "
@@ -985,16 +1332,16 @@ def get_user_summary(user_id):
                 "LEFT JOIN ( "
                 "  SELECT login_id, SUM(amount) AS total_additional_income "
                 "  FROM tbl_add_income "
-                "  WHERE month = '{}' "
+                "  WHERE login_id = %s AND month = %s "
                 "  GROUP BY login_id "
                 ") ai ON u.login_id = ai.login_id "
                 "LEFT JOIN ( "
-                "  SELECT login_id, SUM(amount) AS total_expenses "
-                "  FROM tbl_expense "
-                "  WHERE DATE_FORMAT(date, '%Y-%m') = '{}' "
+                "  SELECT login_id, SUM(total) AS total_expenses "
+                "  FROM tbl_expense_monthly "
+                "  WHERE login_id = %s AND year = %s AND month = %s "
                 "  GROUP BY login_id "
                 ") ei ON u.login_id = ei.login_id "
-                "WHERE u.login_id = {}".format(month, month, user_id)
+                "WHERE u.login_id = %s", (user_id, month, user_id, now.year, now.month, user_id)
             )
 
         summary['month'] = datetime.now().strftime('%B')
@@ -1003,13 +1350,48 @@ def get_user_summary(user_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500   
 
+@app.route('/api/user/<int:user_id>/home-bundle', methods=['GET'])
+@conditional_get()
+def get_home_bundle(user_id):
+    """summary, by_category, progressbar, trends, additional_income_sum and priority_vs_spending in one call.
+
+    ?sections=summary,trends picks a subset (default: all).
+    """
+    try:
+        sections = home_bundle.parse_sections(request.args.get('sections'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        return jsonify(home_bundle.build(db, user_id, sections)), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/user/<int:user_id>/changes', methods=['GET'])
+def get_changes(user_id):
+    """Expenses, priorities and additional income changed since ?since=<token>, with tombstones for deletes.
+
+    Without ``since`` only the current token is returned: take it before loading the full lists,
+    then poll with it. Follow ``has_more`` by asking again with the returned token.
+    """
+    try:
+        since = request.args.get('since')
+        if not since:
+            return jsonify({'token': changes.latest_token(db, user_id)}), 200
+        try:
+            seq = changes.decode_token(since)
+            limit = pagination.parse_limit(request.args.get('limit'), changes.DEFAULT_LIMIT, changes.MAX_LIMIT)
+        except pagination.BadRequest as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(changes.since(db, user_id, seq, limit)), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/user/<int:user_id>/additional-income-list', methods=['GET'])
 def get_additional_income_list(user_id):
     try:
         month = datetime.now().strftime('%Y-%m')
-        print(month)
         data = db.fetchall(
-            "SELECT id, amount FROM tbl_add_income WHERE login_id = {} AND month = '{}'".format(user_id, month)
+            "SELECT id, amount FROM tbl_add_income WHERE login_id = %s AND month = %s", (user_id, month)
         )
         return jsonify(data), 200
     except Exception as e:
@@ -1020,9 +1402,19 @@ def update_additional_income(user_id, income_id):
     try:
         data = request.get_json()
         amount = data.get('amount')
-        db.execute(
-            "UPDATE tbl_add_income SET amount = {} WHERE id = {} AND login_id = {}".format(amount, income_id, user_id)
-        )
+        with db.transaction() as tx:
+            income = tx.fetchone(
+                "SELECT month FROM tbl_add_income WHERE id = %s AND login_id = %s FOR UPDATE", (income_id, user_id)
+            )
+            if not income:
+                return jsonify({'error': 'Income not found'}), 404
+            tx.execute(
+                "UPDATE tbl_add_income SET amount = %s WHERE id = %s AND login_id = %s", (amount, income_id, user_id)
+            )
+            user_stats.refresh(tx, [(user_id,) + user_stats.income_month(income['month'])])
+            versions.bump(tx, versions.user_scope(user_id))
+            changes.record(tx, user_id, 'income', income_id)
+            notify(user_id, 'income', op=changes.UPSERT, id=income_id)
         return jsonify({'message': 'Income updated'}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1030,9 +1422,19 @@ def update_additional_income(user_id, income_id):
 @app.route('/api/user/<int:user_id>/additional-income/<int:income_id>', methods=['DELETE'])
 def delete_additional_income(user_id, income_id):
     try:
-        db.execute(
-            "DELETE FROM tbl_add_income WHERE id = {} AND login_id = {}".format(income_id, user_id)
-        )
+        with db.transaction() as tx:
+            income = tx.fetchone(
+                "SELECT month FROM tbl_add_income WHERE id = %s AND login_id = %s FOR UPDATE", (income_id, user_id)
+            )
+            if not income:
+                return jsonify({'error': 'Income not found'}), 404
+            tx.execute(
+                "DELETE FROM tbl_add_income WHERE id = %s AND login_id = %s", (income_id, user_id)
+            )
+            user_stats.refresh(tx, [(user_id,) + user_stats.income_month(income['month'])])
+            versions.bump(tx, versions.user_scope(user_id))
+            changes.record(tx, user_id, 'income', income_id, changes.DELETE)
+            notify(user_id, 'income', op=changes.DELETE, id=income_id)
         return jsonify({'message': 'Income deleted'}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500     
@@ -1042,5 +1444,27 @@ def delete_additional_income(user_id, income_id):
 
 
 
+def create_app(config=None):
+    """Configure and return the app. Importing app.py stays cheap; this is where setup happens.
+
+    ``config`` updates app.config; its optional 'DATABASE' entry (connection settings such as
+    host / database and pool settings such as size) is applied to ``db`` before its first use.
+    ADVANCE_SCHEDULER=False skips starting the advance payment scheduler thread; ANALYTICS_CUBE=False
+    skips loading the expense cube in the background (the first analytics request then starts the
+    load and the analytics API answers 503 until it is done).
+    """
+    config = dict(config or {})
+    database = config.pop('DATABASE', None)
+    if database:
+        db.configure(**database)
+    app.config.update(config)
+    logs.configure()
+    if app.config.get('ADVANCE_SCHEDULER', True):
+        scheduler.start()
+    if app.config.get('ANALYTICS_CUBE', True):
+        cube.start(db)
+    return app
+
+
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0')
\ No newline at end of file
+    create_app().run(debug=True, host='0.0.0.0')
\ No newline at end of file
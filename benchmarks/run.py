@@ -0,0 +1,528 @@
+"""Micro-benchmarks for the hot request paths, against a database seeded by benchmarks.seed.
+
+Every /api/* handler, the admin dashboard and insight pages, and the forecast
+helpers are exercised through Flask's test client (no network), for a mix of
+typical and heavy users. Each case reports p50 / p95 / mean latency and the
+number of SQL statements it ran. Results can be saved as a JSON baseline and a
+later run compared against it; the comparison exits 1 when a case got slower
+than the tolerance allows or started issuing more queries.
+
+Usage:
+    python -m benchmarks.run [--database personal_finance_bench] [--iterations 30] [--only NAME ...]
+                             [--save benchmarks/baselines/main.json]
+                             [--compare benchmarks/baselines/main.json] [--tolerance 0.25]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import sys
+import time
+from collections import Counter, namedtuple
+from datetime import date, datetime
+
+from benchmarks.seed import DEFAULT_DATABASE
+
+Case = namedtuple('Case', 'name endpoint prepare')
+CASES = []
+MIN_REGRESSION_MS = 1.0   # ignore slowdowns smaller than this, they are noise at these latencies
+_SERVER_TIMING = re.compile(r'desc="(\d+) queries"')
+
+
+def case(name, endpoint=None):
+    """Register ``prepare(ctx) -> callable``. Setup in ``prepare`` is untimed; the callable is the timed part."""
+    def register(prepare):
+        CASES.append(Case(name, endpoint, prepare))
+        return prepare
+    return register
+
+
+class Context:
+    def __init__(self, app_module, seed, sample_size=50):
+        self.app = app_module
+        self.db = app_module.db
+        self.client = app_module.app.test_client()
+        self.admin = app_module.app.test_client()
+        with self.admin.session_transaction() as session:
+            session['admin'] = True
+        self.rng = random.Random(seed)
+        logins = self.db.fetchall("SELECT id, username FROM tbl_login WHERE role = 'user' ORDER BY id")
+        if not logins:
+            raise SystemExit('No users found; seed the database first (python -m benchmarks.seed)')
+        heavy = [row['login_id'] for row in self.db.fetchall(
+            "SELECT login_id FROM tbl_expense_monthly GROUP BY login_id ORDER BY SUM(cnt) DESC LIMIT 3"
+        )]
+        self.usernames = {row['id']: row['username'] for row in logins}
+        self.users = heavy + self.rng.sample(sorted(self.usernames), min(sample_size, len(self.usernames)))
+        self.categories = [row['id'] for row in self.db.fetchall("SELECT id FROM tbl_category ORDER BY id")]
+        self._turn = 0
+        self._counter = 0
+
+    def user(self):
+        self._turn += 1
+        return self.users[self._turn % len(self.users)]
+
+    def unique(self):
+        self._counter += 1
+        return '{}_{}'.format(int(time.time() * 1000), self._counter)
+
+    def get(self, path, client=None, **kwargs):
+        return lambda: (client or self.client).get(path, **kwargs)
+
+    def send(self, method, path, **kwargs):
+        return lambda: self.client.open(path, method=method, **kwargs)
+
+
+def serial(call):
+    """Run ``call`` with the concurrent query fan-out (fanout.py) switched off, for before/after comparisons."""
+    def run():
+        import fanout
+        previous, fanout.FANOUT = fanout.FANOUT, False
+        try:
+            return call()
+        finally:
+            fanout.FANOUT = previous
+    return run
+
+
+# --- /api handlers -----------------------------------------------------------------------------------------
+
+@case('api_login', 'login_user')
+def _(ctx):
+    user = ctx.user()
+    return ctx.send('POST', '/api/login', json={'username': ctx.usernames[user], 'password': 'bench'})
+
+
+@case('api_register', 'register_user')
+def _(ctx):
+    return ctx.send('POST', '/api/register', json={
+        'username': 'bench_new_' + ctx.unique(), 'password': 'bench', 'name': 'New', 'gender': 'other',
+        'age': 30, 'salary': 2500})
+
+
+@case('api_user_get', 'get_user')
+def _(ctx):
+    return ctx.get('/api/user/{}'.format(ctx.user()))
+
+
+@case('api_user_put', 'get_user')
+def _(ctx):
+    return ctx.send('PUT', '/api/user/{}'.format(ctx.user()), json={})
+
+
+@case('api_verify_password', 'verify_password')
+def _(ctx):
+    return ctx.send('POST', '/api/user/{}/verify-password'.format(ctx.user()), json={'password': 'bench'})
+
+
+@case('api_salary_put', 'update_salary')
+def _(ctx):
+    return ctx.send('PUT', '/api/user/{}/salary'.format(ctx.user()), json={'salary': 3000})
+
+
+@case('api_user_expenses', 'get_user_expenses')
+def _(ctx):
+    return ctx.get('/api/user/{}/expenses'.format(ctx.user()))
+
+
+@case('api_income_add', 'add_additional_income')
+def _(ctx):
+    return ctx.send('POST', '/api/user/{}/additional-income'.format(ctx.user()), json={'amount': 10})
+
+
+@case('api_income_sum', 'get_additional_income_sum')
+def _(ctx):
+    return ctx.get('/api/user/{}/additional-income-sum'.format(ctx.user()))
+
+
+@case('api_income_list', 'get_additional_income_list')
+def _(ctx):
+    return ctx.get('/api/user/{}/additional-income-list'.format(ctx.user()))
+
+
+def _income_id(ctx, user):
+    return ctx.db.executeAndReturnId(
+        "INSERT INTO tbl_add_income (login_id, amount, month) VALUES (%s, %s, %s)",
+        (user, 5, datetime.now().strftime('%Y-%m')))
+
+
+@case('api_income_put', 'update_additional_income')
+def _(ctx):
+    user = ctx.user()
+    return ctx.send('PUT', '/api/user/{}/additional-income/{}'.format(user, _income_id(ctx, user)),
+                    json={'amount': 7})
+
+
+@case('api_income_delete', 'delete_additional_income')
+def _(ctx):
+    user = ctx.user()
+    return ctx.send('DELETE', '/api/user/{}/additional-income/{}'.format(user, _income_id(ctx, user)))
+
+
+@case('api_categories', 'get_categories')
+def _(ctx):
+    return ctx.get('/api/category')
+
+
+@case('api_expense_page', 'add_expense')
+def _(ctx):
+    return ctx.get('/api/expense/{}'.format(ctx.user()))
+
+
+@case('api_expense_add', 'add_expense')
+def _(ctx):
+    return ctx.send('POST', '/api/expense/{}'.format(ctx.user()), json={
+        'category_id': ctx.rng.choice(ctx.categories), 'amount': 12.5, 'details': 'bench', 'source': 'cash'})
+
+
+def _expense_id(ctx, user):
+    row = ctx.db.fetchone(
+        "SELECT id FROM tbl_expense WHERE login_id = %s ORDER BY date DESC, id DESC LIMIT 1", (user,))
+    return row['id'] if row else None
+
+
+@case('api_expense_update', 'add_expense')
+def _(ctx):
+    user = ctx.user()
+    return ctx.send('PUT', '/api/expense/{}'.format(user), json={
+        'expense_id': _expense_id(ctx, user), 'category_id': ctx.rng.choice(ctx.categories), 'amount': 20,
+        'details': 'bench', 'source': 'cash', 'date': date.today().isoformat()})
+
+
+@case('api_expense_delete', 'add_expense')
+def _(ctx):
+    user = ctx.user()
+    return ctx.send('DELETE', '/api/expense/{}?expense_id={}'.format(user, _expense_id(ctx, user)))
+
+
+@case('api_expense_bulk', 'import_expenses')
+def _(ctx):
+    rows = [{'category_id': ctx.rng.choice(ctx.categories), 'amount': round(ctx.rng.uniform(1, 100), 2),
+             'source': 'cash', 'date': date.today().isoformat()} for _ in range(50)]
+    return ctx.send('POST', '/api/expense/{}/bulk'.format(ctx.user()), json=rows)
+
+
+@case('api_expense_export', 'export_expenses')
+def _(ctx):
+    request = ctx.get('/api/expense/{}/export?format=csv'.format(ctx.user()))
+
+    def run():
+        response = request()
+        response.get_data()   # drain the stream inside the timed section
+        return response
+    return run
+
+
+@case('api_expense_by_category', 'get_expenses_by_category')
+def _(ctx):
+    return ctx.get('/api/expense/{}/by-category'.format(ctx.user()))
+
+
+@case('api_expense_trends', 'get_expense_trends')
+def _(ctx):
+    return ctx.get('/api/expense/{}/trends'.format(ctx.user()))
+
+
+@case('api_priority_get', 'add_priority')
+def _(ctx):
+    return ctx.get('/api/priority/{}'.format(ctx.user()))
+
+
+@case('api_priority_add', 'add_priority')
+def _(ctx):
+    user = ctx.user()
+    category_id = ctx.rng.choice(ctx.categories)
+    ctx.db.execute("DELETE FROM tbl_priority WHERE login_id = %s AND category_id = %s", (user, category_id))
+    return ctx.send('POST', '/api/priority/{}'.format(user), json={'category_id': category_id, 'priority': 'medium'})
+
+
+def _priority_id(ctx, user):
+    return ctx.db.executeAndReturnId(
+        "INSERT INTO tbl_priority (login_id, category_id, priority) VALUES (%s, %s, 'low')",
+        (user, ctx.rng.choice(ctx.categories)))
+
+
+@case('api_priority_update', 'add_priority')
+def _(ctx):
+    user = ctx.user()
+    return ctx.send('PUT', '/api/priority/{}'.format(user), json={
+        'priority_id': _priority_id(ctx, user), 'category_id': ctx.rng.choice(ctx.categories), 'priority': 'high'})
+
+
+@case('api_priority_delete', 'add_priority')
+def _(ctx):
+    user = ctx.user()
+    return ctx.send('DELETE', '/api/priority/{}'.format(user), json={'priority_id': _priority_id(ctx, user)})
+
+
+@case('api_priority_vs_spending', 'get_priority_vs_spending')
+def _(ctx):
+    return ctx.get('/api/priority/{}/vs-spending'.format(ctx.user()))
+
+
+@case('api_suggestion_get', 'add_suggestion')
+def _(ctx):
+    return ctx.get('/api/suggestion/{}'.format(ctx.user()))
+
+
+@case('api_suggestion_generate', 'add_suggestion')
+def _(ctx):
+    return ctx.send('POST', '/api/suggestion/{}'.format(ctx.user()))
+
+
+@case('api_suggestion_generate_serial', 'add_suggestion')
+def _(ctx):
+    return serial(ctx.send('POST', '/api/suggestion/{}'.format(ctx.user())))
+
+
+@case('api_progressbar', 'progressbar')
+def _(ctx):
+    return ctx.get('/api/progressbar/{}'.format(ctx.user()))
+
+
+@case('api_notifications', 'notifications')
+def _(ctx):
+    return ctx.get('/api/notifications/{}'.format(ctx.user()))
+
+
+@case('api_summary', 'get_user_summary')
+def _(ctx):
+    return ctx.get('/api/user/{}/summary'.format(ctx.user()))
+
+
+@case('api_home_bundle', 'get_home_bundle')
+def _(ctx):
+    return ctx.get('/api/user/{}/home-bundle'.format(ctx.user()))
+
+
+@case('api_changes', 'get_changes')
+def _(ctx):
+    user = ctx.user()
+    token = ctx.client.get('/api/user/{}/changes'.format(user)).get_json()['token']
+    return ctx.get('/api/user/{}/changes?since={}'.format(user, token))
+
+
+@case('api_budget_alerts', 'get_budget_alerts')
+def _(ctx):
+    return ctx.get('/api/user/{}/budget-alerts'.format(ctx.user()))
+
+
+@case('api_notifications_ack', 'acknowledge_notifications')
+def _(ctx):
+    return ctx.send('POST', '/api/notifications/{}/ack'.format(ctx.user()), json={})
+
+
+@case('api_events_poll', 'poll_events')
+def _(ctx):
+    # since=0 replays the buffered history and timeout=0 never waits, so this times the request itself
+    return ctx.get('/api/user/{}/events/poll?since=0&timeout=0'.format(ctx.user()))
+
+
+@case('api_events_stream', 'event_stream')
+def _(ctx):
+    request = ctx.get('/api/user/{}/events?since=0'.format(ctx.user()), buffered=False)
+
+    def run():
+        response = request()
+        next(response.iter_encoded())   # the first chunk; the stream itself stays open for minutes
+        response.close()
+        return response
+    return run
+
+
+@case('api_analytics', 'user_analytics')
+def _(ctx):
+    # Load the cube up front (the endpoint answers 503 until it is); the timed part is query + refresh check
+    ctx.app.cube.sync(ctx.app.db)
+    return ctx.get('/api/user/{}/analytics?granularity=week&group_by=category'.format(ctx.user()))
+
+
+# --- admin pages and helpers -------------------------------------------------------------------------------
+
+@case('home_cold', 'home')
+def _(ctx):
+    ctx.app.dashboard_snapshot.invalidate()
+    return ctx.get('/home', client=ctx.admin)
+
+
+@case('home_cold_serial', 'home')
+def _(ctx):
+    ctx.app.dashboard_snapshot.invalidate()
+    return serial(ctx.get('/home', client=ctx.admin))
+
+
+@case('home_cached', 'home')
+def _(ctx):
+    return ctx.get('/home', client=ctx.admin)
+
+
+@case('insights_users', 'insights_users')
+def _(ctx):
+    return ctx.get('/insights/users', client=ctx.admin)
+
+
+@case('insights_expenses', 'insights_expenses')
+def _(ctx):
+    return ctx.get('/insights/expenses', client=ctx.admin)
+
+
+@case('admin_analytics', 'admin_analytics')
+def _(ctx):
+    return ctx.get('/admin/analytics?granularity=month&group_by=category,source', client=ctx.admin)
+
+
+@case('insights_suggestions', 'insights_suggestions')
+def _(ctx):
+    return ctx.get('/insights/suggestions', client=ctx.admin)
+
+
+@case('predict_expense')
+def _(ctx):
+    user = ctx.user()
+    category_id = ctx.rng.choice(ctx.categories)
+    return lambda: ctx.app.predict_expense(category_id, user, ctx.db)
+
+
+@case('forecast_categories')
+def _(ctx):
+    import forecast
+    user = ctx.user()
+    return lambda: forecast.forecast_categories(forecast.load_monthly_totals(ctx.db, user), ctx.categories)
+
+
+@case('forecast_state')
+def _(ctx):
+    import forecast_state
+    user = ctx.user()
+    return lambda: forecast_state.forecasts(ctx.db.fetchall(forecast_state.USER_STATE, (user,)), ctx.categories)
+
+
+# --- runner ------------------------------------------------------------------------------------------------
+
+def _queries(result, scope):
+    """Statements a case ran: from the Server-Timing header of a response, else the runner's own scope."""
+    headers = getattr(result, 'headers', None)
+    match = _SERVER_TIMING.search(headers.get('Server-Timing', '')) if headers is not None else None
+    return int(match.group(1)) if match else scope.count
+
+
+def run_case(ctx, bench_case, iterations, warmup, querystats):
+    timings, queries, statuses = [], [], Counter()
+    for i in range(warmup + iterations):
+        call = bench_case.prepare(ctx)
+        token = querystats.begin_request()
+        started = time.perf_counter()
+        result = call()
+        elapsed = time.perf_counter() - started
+        scope = querystats.end_request(token)
+        if i < warmup:
+            continue
+        timings.append(elapsed * 1000)
+        queries.append(_queries(result, scope))
+        statuses[str(getattr(result, 'status_code', 'ok'))] += 1
+    timings.sort()
+    return {
+        'iterations': iterations,
+        'p50_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(0.95 * len(timings)))], 3),
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'min_ms': round(timings[0], 3),
+        'queries': int(statistics.median(queries)),
+        'statuses': dict(statuses),
+    }
+
+
+def volumes(db):
+    return {table: db.fetchone("SELECT COUNT(*) AS count FROM " + table)['count']
+            for table in ('tbl_user', 'tbl_expense', 'tbl_priority', 'tbl_suggestions', 'tbl_add_income')}
+
+
+def similar_volumes(before, after, slack=0.01):
+    """True when every table is within ``slack`` of its baseline size (the write cases add a few rows)."""
+    return before.keys() == after.keys() and all(
+        abs(after[table] - count) <= max(100, count * slack) for table, count in before.items())
+
+
+def uncovered(app_module):
+    covered = {c.endpoint for c in CASES if c.endpoint}
+    return sorted({rule.endpoint for rule in app_module.app.url_map.iter_rules()
+                   if rule.rule.startswith('/api/') and rule.endpoint not in covered})
+
+
+def compare(results, baseline, tolerance):
+    """[(case, reason)] for every case that regressed against ``baseline``."""
+    regressions = []
+    for name, current in results['cases'].items():
+        before = baseline.get('cases', {}).get(name)
+        if not before:
+            continue
+        limit = before['p50_ms'] * (1 + tolerance)
+        if current['p50_ms'] > limit and current['p50_ms'] - before['p50_ms'] >= MIN_REGRESSION_MS:
+            regressions.append((name, 'p50 {:.2f} ms > {:.2f} ms (baseline {:.2f} ms + {:.0%})'.format(
+                current['p50_ms'], limit, before['p50_ms'], tolerance)))
+        if current['queries'] > before['queries']:
+            regressions.append((name, 'queries {} > baseline {}'.format(current['queries'], before['queries'])))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default=DEFAULT_DATABASE)
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--only', nargs='*', help='case names to run (default: all)')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p50 slowdown, as a fraction')
+    args = parser.parse_args(argv)
+
+    import app as app_module
+    app_module.create_app({'DATABASE': {'database': args.database}, 'ADVANCE_SCHEDULER': False, 'ANALYTICS_CUBE': False})
+    import querystats
+
+    ctx = Context(app_module, args.seed)
+    selected = [c for c in CASES if not args.only or c.name in args.only]
+    results = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'database': args.database,
+        'volumes': volumes(ctx.db),
+        'cases': {},
+    }
+    print('{:<28} {:>10} {:>10} {:>10} {:>8}  {}'.format('case', 'p50 ms', 'p95 ms', 'mean ms', 'queries', 'status'))
+    for bench_case in selected:
+        stats = run_case(ctx, bench_case, args.iterations, args.warmup, querystats)
+        results['cases'][bench_case.name] = stats
+        print('{:<28} {:>10.2f} {:>10.2f} {:>10.2f} {:>8}  {}'.format(
+            bench_case.name, stats['p50_ms'], stats['p95_ms'], stats['mean_ms'], stats['queries'],
+            ' '.join('{}x{}'.format(n, s) for s, n in sorted(stats['statuses'].items()))))
+
+    missing = uncovered(app_module)
+    if missing and not args.only:
+        print('No benchmark case for: ' + ', '.join(missing), file=sys.stderr)
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print('Saved ' + args.save)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not similar_volumes(baseline.get('volumes', {}), results['volumes']):
+            print('Warning: baseline was recorded on different data volumes', file=sys.stderr)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, reason in regressions:
+            print('REGRESSION {}: {}'.format(name, reason))
+        print('{} regression(s) against {}'.format(len(regressions), args.compare))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
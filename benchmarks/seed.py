@@ -0,0 +1,277 @@
+"""Seed a benchmark database with synthetic, reproducible data.
+
+Creates the database and the base tables if needed, applies migrations.py,
+then generates users, categories, priorities, additional income, expenses and
+suggestions from a fixed random seed. Activity is skewed the way real data is:
+a few heavy users produce most expenses, recent months are busier than old
+ones, and a handful of categories dominate. Derived tables (the monthly rollup,
+the forecast state, advance notifications and budget counters) are rebuilt at
+the end.
+
+Usage:
+    python -m benchmarks.seed [--database personal_finance_bench] [--users 10000] [--expenses 10000000]
+                              [--months 24] [--seed 42] [--reset]
+"""
+import argparse
+import sys
+import time
+from datetime import date
+
+import mysql.connector
+import numpy as np
+
+import migrations
+import advance_scheduler
+import budgets
+import forecast_state
+import rollup
+import user_stats
+from config import DB_CONFIG, Database
+from daterange import add_months
+
+DEFAULT_DATABASE = 'personal_finance_bench'
+CHUNK = 100000
+BATCH = 1000
+
+CATEGORY_NAMES = (
+    'Food', 'Rent', 'Transport', 'Utilities', 'Groceries', 'Health', 'Entertainment', 'Shopping',
+    'Education', 'Travel', 'Insurance', 'Savings', 'Gifts', 'Subscriptions', 'Personal care', 'Other',
+)
+SOURCES = ('cash', 'online', 'advance')
+SOURCE_WEIGHTS = (0.6, 0.35, 0.05)
+PRIORITIES = ('high', 'medium', 'low')
+
+# Base tables the app expects (derived tables come from migrations.py)
+BASE_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS tbl_login ("
+    "  id INT AUTO_INCREMENT PRIMARY KEY,"
+    "  username VARCHAR(100) NOT NULL UNIQUE,"
+    "  password VARCHAR(255) NOT NULL,"
+    "  role VARCHAR(20) NOT NULL"
+    ")",
+    "CREATE TABLE IF NOT EXISTS tbl_user ("
+    "  id INT AUTO_INCREMENT PRIMARY KEY,"
+    "  login_id INT NOT NULL UNIQUE,"
+    "  name VARCHAR(100),"
+    "  gender VARCHAR(10),"
+    "  age INT,"
+    "  salary DECIMAL(12, 2)"
+    ")",
+    "CREATE TABLE IF NOT EXISTS tbl_category ("
+    "  id INT AUTO_INCREMENT PRIMARY KEY,"
+    "  category_name VARCHAR(100) NOT NULL"
+    ")",
+    "CREATE TABLE IF NOT EXISTS tbl_expense ("
+    "  id INT AUTO_INCREMENT PRIMARY KEY,"
+    "  login_id INT NOT NULL,"
+    "  category_id INT NOT NULL,"
+    "  amount DECIMAL(12, 2) NOT NULL,"
+    "  details VARCHAR(255),"
+    "  source VARCHAR(50),"
+    "  date DATE NOT NULL"
+    ")",
+    "CREATE TABLE IF NOT EXISTS tbl_priority ("
+    "  id INT AUTO_INCREMENT PRIMARY KEY,"
+    "  login_id INT NOT NULL,"
+    "  category_id INT NOT NULL,"
+    "  priority VARCHAR(10) NOT NULL"
+    ")",
+    "CREATE TABLE IF NOT EXISTS tbl_suggestions ("
+    "  id INT AUTO_INCREMENT PRIMARY KEY,"
+    "  login_id INT NOT NULL,"
+    "  category_id INT NOT NULL,"
+    "  suggested_amount DECIMAL(12, 2) NOT NULL,"
+    "  month VARCHAR(20) NOT NULL,"
+    "  year INT NOT NULL"
+    ")",
+    "CREATE TABLE IF NOT EXISTS tbl_add_income ("
+    "  id INT AUTO_INCREMENT PRIMARY KEY,"
+    "  login_id INT NOT NULL,"
+    "  amount DECIMAL(12, 2) NOT NULL,"
+    "  month VARCHAR(7) NOT NULL"
+    ")",
+]
+
+SEEDED_TABLES = ('tbl_login', 'tbl_user', 'tbl_category', 'tbl_expense', 'tbl_priority',
+                 'tbl_suggestions', 'tbl_add_income')
+
+
+def connect(database):
+    """Create ``database`` if needed and return a Database pointed at it."""
+    args = dict(DB_CONFIG)
+    args.pop('database', None)
+    raw = mysql.connector.connect(**args)
+    try:
+        raw.cursor().execute("CREATE DATABASE IF NOT EXISTS `{}`".format(database.replace('`', '')))
+    finally:
+        raw.close()
+    return Database(size=2, **dict(args, database=database))
+
+
+def reset(db):
+    """Empty every seeded and derived table (the migrations bookkeeping is kept)."""
+    derived = [name for name in ('tbl_expense_monthly', 'tbl_forecast_state', 'tbl_advance_notification',
+                                 'tbl_budget_counter', 'tbl_budget_alert', 'tbl_user_stats', 'tbl_user_stats_month',
+                                 'tbl_data_version', 'tbl_change_log')
+               if db.fetchone("SHOW TABLES LIKE %s", (name,))]
+    for table in SEEDED_TABLES + tuple(derived):
+        db.execute("TRUNCATE TABLE " + table)
+
+
+def months_back(today, months):
+    """[(year, month)] oldest first, ending with the current month."""
+    return [add_months(today.year, today.month, -offset) for offset in range(months - 1, -1, -1)]
+
+
+def seed_users(db, rng, count):
+    with db.transaction() as tx:
+        tx.execute("INSERT INTO tbl_login (username, password, role) VALUES ('bench_admin', 'bench', 'admin')")
+        first = tx.fetchone("SELECT COALESCE(MAX(id), 0) + 1 AS id FROM tbl_login")['id']
+        tx.insert_many('tbl_login', ('username', 'password', 'role'),
+                       [('bench_user_{}'.format(i), 'bench', 'user') for i in range(count)], BATCH)
+        login_ids = [row['id'] for row in tx.fetchall(
+            "SELECT id FROM tbl_login WHERE role = 'user' AND id >= %s ORDER BY id", (first,)
+        )]
+        genders = rng.choice(['male', 'female', 'other'], size=len(login_ids), p=[0.48, 0.48, 0.04])
+        ages = rng.integers(18, 75, size=len(login_ids))
+        salaries = np.round(rng.lognormal(np.log(3000), 0.5, size=len(login_ids)), 2)
+        tx.insert_many('tbl_user', ('name', 'gender', 'age', 'login_id', 'salary'), [
+            ('User {}'.format(i), str(genders[i]), int(ages[i]), login_id, float(salaries[i]))
+            for i, login_id in enumerate(login_ids)
+        ], BATCH)
+    return login_ids
+
+
+def seed_categories(db):
+    db.insert_many('tbl_category', ('category_name',), [(name,) for name in CATEGORY_NAMES])
+    return [row['id'] for row in db.fetchall("SELECT id FROM tbl_category ORDER BY id")]
+
+
+def seed_priorities(db, rng, login_ids, category_ids):
+    rows = []
+    for login_id in login_ids:
+        picked = rng.choice(category_ids, size=min(len(category_ids), int(rng.integers(3, 7))), replace=False)
+        rows.extend((login_id, int(category_id), str(rng.choice(PRIORITIES))) for category_id in picked)
+    db.insert_many('tbl_priority', ('login_id', 'category_id', 'priority'), rows, BATCH)
+    return len(rows)
+
+
+def seed_incomes(db, rng, login_ids, periods):
+    rows = []
+    for year, month in periods:
+        earners = rng.random(len(login_ids)) < 0.3
+        amounts = np.round(rng.lognormal(np.log(300), 0.8, size=len(login_ids)), 2)
+        period = '{:04d}-{:02d}'.format(year, month)
+        rows.extend((login_id, float(amounts[i]), period) for i, login_id in enumerate(login_ids) if earners[i])
+    db.insert_many('tbl_add_income', ('login_id', 'amount', 'month'), rows, BATCH)
+    return len(rows)
+
+
+def seed_expenses(db, rng, login_ids, category_ids, periods, count, out=sys.stderr):
+    """``count`` expenses spread with Zipf-like user activity, recent-heavy months and skewed categories."""
+    users = np.asarray(login_ids)
+    user_weights = rng.pareto(1.2, size=len(users)) + 0.05
+    user_weights /= user_weights.sum()
+    month_weights = np.power(1.08, np.arange(len(periods)))   # ~8% more activity each month
+    month_weights /= month_weights.sum()
+    category_weights = 1.0 / np.arange(1, len(category_ids) + 1)
+    category_weights /= category_weights.sum()
+    categories = np.asarray(category_ids)
+    today = date.today()
+    month_starts = [date(year, month, 1) for year, month in periods]
+
+    started = time.monotonic()
+    done = 0
+    while done < count:
+        size = min(CHUNK, count - done)
+        who = rng.choice(users, size=size, p=user_weights)
+        what = rng.choice(categories, size=size, p=category_weights)
+        when = rng.choice(len(periods), size=size, p=month_weights)
+        days = rng.integers(0, 28, size=size)
+        amounts = np.round(rng.lognormal(np.log(25), 1.0, size=size), 2)
+        sources = rng.choice(SOURCES, size=size, p=SOURCE_WEIGHTS)
+        rows = []
+        for i in range(size):
+            day = month_starts[when[i]].toordinal() + int(days[i])
+            # Only scheduled (advance) payments may fall in the future
+            if sources[i] != 'advance':
+                day = min(day, today.toordinal())
+            rows.append((int(who[i]), int(what[i]), float(amounts[i]), 'bench', str(sources[i]),
+                         date.fromordinal(day)))
+        with db.transaction() as tx:
+            tx.insert_many('tbl_expense', ('login_id', 'category_id', 'amount', 'details', 'source', 'date'),
+                           rows, BATCH)
+        done += size
+        elapsed = time.monotonic() - started
+        print('expenses: {}/{} ({:.0f} rows/s)'.format(done, count, done / elapsed if elapsed else 0), file=out)
+    return done
+
+
+def seed_suggestions(db, rng, login_ids, periods):
+    """Suggestions for the last two months for every prioritised category."""
+    priorities = db.fetchall("SELECT login_id, category_id FROM tbl_priority")
+    rows = []
+    for year, month in periods[-2:]:
+        name = date(year, month, 1).strftime('%B')
+        amounts = np.round(rng.lognormal(np.log(200), 0.6, size=len(priorities)), 2)
+        rows.extend((p['login_id'], p['category_id'], float(amounts[i]), name, year)
+                    for i, p in enumerate(priorities))
+    db.insert_many('tbl_suggestions', ('login_id', 'category_id', 'suggested_amount', 'month', 'year'), rows, BATCH)
+    return len(rows)
+
+
+def seed(db, users, expenses, months, seed_value, out=sys.stderr):
+    rng = np.random.default_rng(seed_value)
+    periods = months_back(date.today(), months)
+    login_ids = seed_users(db, rng, users)
+    category_ids = seed_categories(db)
+    counts = {
+        'users': len(login_ids),
+        'categories': len(category_ids),
+        'priorities': seed_priorities(db, rng, login_ids, category_ids),
+        'incomes': seed_incomes(db, rng, login_ids, periods),
+        'expenses': seed_expenses(db, rng, login_ids, category_ids, periods, expenses, out),
+        'suggestions': seed_suggestions(db, rng, login_ids, periods),
+    }
+    rollup.rebuild(db)
+    forecast_state.rebuild(db)
+    db.execute(advance_scheduler.BACKFILL)
+    budgets.rebuild(db)
+    for year, month in periods:
+        user_stats.refresh_month(db, year, month)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default=DEFAULT_DATABASE)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--expenses', type=int, default=10000000)
+    parser.add_argument('--months', type=int, default=24)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--reset', action='store_true', help='empty the tables first')
+    args = parser.parse_args(argv)
+
+    if args.database == DB_CONFIG['database']:
+        print('Refusing to seed the application database ({}); pick another --database'.format(args.database),
+              file=sys.stderr)
+        return 2
+    db = connect(args.database)
+    for statement in BASE_SCHEMA:
+        db.execute(statement)
+    migrations.migrate(db)
+    if args.reset:
+        reset(db)
+    elif db.fetchone("SELECT COUNT(*) AS count FROM tbl_login")['count']:
+        print('{} already has data; rerun with --reset to reseed'.format(args.database), file=sys.stderr)
+        return 1
+
+    started = time.monotonic()
+    counts = seed(db, args.users, args.expenses, args.months, args.seed)
+    print('Seeded {} in {:.0f}s: {}'.format(
+        args.database, time.monotonic() - started, ', '.join('{} {}'.format(v, k) for k, v in counts.items())))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,67 @@
+"""Measure how long ``import app`` takes in a fresh interpreter.
+
+Each run starts a new Python process, so nothing is cached in sys.modules.
+The process also reports whether importing pulled in scikit-learn or NumPy and
+whether a database pool got built; both should wait until first use.
+
+Usage:
+    python -m benchmarks.startup [--runs 10] [--target-ms 500]
+
+Exits with 1 when the median import time is over --target-ms or when
+something heavy was loaded at import.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_TARGET_MS = 500
+
+PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+import app
+elapsed = time.perf_counter() - started
+print(json.dumps({
+    'import_ms': elapsed * 1000,
+    'sklearn': 'sklearn' in sys.modules,
+    'numpy': 'numpy' in sys.modules,
+    'db_started': app.db.started,
+}))
+'''
+
+
+def probe():
+    output = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--target-ms', type=float, default=DEFAULT_TARGET_MS)
+    args = parser.parse_args(argv)
+
+    runs = [probe() for _ in range(args.runs)]
+    times = sorted(run['import_ms'] for run in runs)
+    median = statistics.median(times)
+    print('import app: median {:.0f} ms, min {:.0f} ms, max {:.0f} ms over {} runs (target {:.0f} ms)'.format(
+        median, times[0], times[-1], len(times), args.target_ms))
+
+    problems = []
+    if median > args.target_ms:
+        problems.append('median import time is over the target')
+    for key, what in (('sklearn', 'scikit-learn'), ('numpy', 'NumPy'), ('db_started', 'the database pool')):
+        if any(run[key] for run in runs):
+            problems.append('{} was loaded at import'.format(what))
+    for problem in problems:
+        print('FAIL: ' + problem)
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+"""Spent-vs-budget counters per (login_id, category_id, year, month) and threshold alerts.
+
+tbl_budget_counter holds the month's spend (total and expense count, as in the
+rollup), the budget (that month's tbl_suggestions amount) and the highest alert
+threshold already reached. Expense writes adjust the counter in their
+transaction and compare it with BUDGET_THRESHOLDS (percent of the budget,
+default 50,80,100): reaching a higher one inserts a tbl_budget_alert row and the
+caller pushes it to the user's event feed. Each write touches one counter row
+per month it changes, so the check is O(1). The progress bar and
+priority-vs-spending endpoints read the counters directly.
+
+Changing a budget (suggestions.replace) re-levels the counters silently: alerts
+come from spending, not from a new suggestion run.
+
+Usage:
+    python budgets.py rebuild [--user ID]   recompute the counters from the rollup and tbl_suggestions
+"""
+import argparse
+import calendar
+import os
+import sys
+from datetime import datetime
+from decimal import Decimal
+
+from config import Database
+from rollup import as_date
+
+THRESHOLDS = tuple(sorted(int(t) for t in os.environ.get('BUDGET_THRESHOLDS', '50,80,100').split(',') if t.strip()))
+
+MONTH_NUMBER = "FIELD({}, " + ', '.join("'{}'".format(name) for name in calendar.month_name[1:]) + ")"
+
+
+def level_sql(thresholds=THRESHOLDS):
+    """SQL for the highest threshold ``spent`` has reached of ``budget`` (0 for none / no budget)."""
+    cases = ' '.join('WHEN spent * 100 >= budget * {0} THEN {0}'.format(t) for t in reversed(thresholds))
+    return "CASE WHEN budget IS NULL OR budget <= 0 THEN 0 {} ELSE 0 END".format(cases)
+
+
+def level(spent, budget, thresholds=THRESHOLDS):
+    if budget is None or budget <= 0:
+        return 0
+    reached = [t for t in thresholds if Decimal(spent) * 100 >= Decimal(budget) * t]
+    return reached[-1] if reached else 0
+
+
+def month_number(name):
+    return datetime.strptime(name, '%B').month
+
+
+def _populate(where, params):
+    """Statements filling the counters for the rows matching ``where`` (on login_id) from the rollup and suggestions."""
+    return [
+        ("INSERT INTO tbl_budget_counter (login_id, category_id, year, month, spent, cnt) "
+         "SELECT login_id, category_id, year, month, SUM(total), SUM(cnt) FROM tbl_expense_monthly " + where + " "
+         "GROUP BY login_id, category_id, year, month "
+         "ON DUPLICATE KEY UPDATE spent = VALUES(spent), cnt = VALUES(cnt)", params),
+        ("INSERT INTO tbl_budget_counter (login_id, category_id, year, month, budget) "
+         "SELECT login_id, category_id, year, " + MONTH_NUMBER.format('month') + ", suggested_amount "
+         "FROM tbl_suggestions " + where + " "
+         "ON DUPLICATE KEY UPDATE budget = VALUES(budget)", params),
+        ("UPDATE tbl_budget_counter SET alerted = " + level_sql() + " " + where, params),
+    ]
+
+
+def _month_deltas(old, new):
+    deltas = {}
+    for row, sign in ((old, -1), (new, 1)):
+        if row:
+            day = as_date(row['date'])
+            key = (row['login_id'], row['category_id'], day.year, day.month)
+            amount, count = deltas.get(key, (0, 0))
+            deltas[key] = (amount + sign * row['amount'], count + sign)
+    return deltas
+
+
+def _apply(tx, deltas):
+    """Add per-month (amount, count) deltas to the counters; returns the alerts raised."""
+    alerts = []
+    for key, (amount, count) in deltas.items():
+        if (amount, count) == (0, 0):
+            continue
+        tx.execute(
+            "INSERT INTO tbl_budget_counter (login_id, category_id, year, month, spent, cnt) "
+            "VALUES (%s, %s, %s, %s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE spent = spent + VALUES(spent), cnt = cnt + VALUES(cnt)",
+            key + (amount, count)
+        )
+        counter = tx.fetchone(
+            "SELECT budget, spent, alerted FROM tbl_budget_counter "
+            "WHERE login_id = %s AND category_id = %s AND year = %s AND month = %s", key
+        )
+        reached = level(counter['spent'], counter['budget'])
+        if reached == counter['alerted']:
+            continue
+        # Falling back below a threshold re-arms it
+        tx.execute(
+            "UPDATE tbl_budget_counter SET alerted = %s "
+            "WHERE login_id = %s AND category_id = %s AND year = %s AND month = %s", (reached,) + key
+        )
+        if reached > counter['alerted']:
+            login_id, category_id, year, month = key
+            alert_id = tx.single_insert(
+                "INSERT INTO tbl_budget_alert (login_id, category_id, year, month, threshold, spent, budget) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                key + (reached, counter['spent'], counter['budget'])
+            )
+            alerts.append({'id': alert_id, 'login_id': login_id, 'category_id': category_id, 'year': year,
+                           'month': month, 'threshold': reached, 'spent': counter['spent'],
+                           'budget': counter['budget']})
+    return alerts
+
+
+def apply_change(tx, old, new):
+    """Move ``old`` out of and ``new`` into the counters (either may be None). Returns new alerts."""
+    return _apply(tx, _month_deltas(old, new))
+
+
+def apply_rows(tx, rows):
+    deltas = {}
+    for row in rows:
+        for key, (amount, count) in _month_deltas(None, row).items():
+            total, n = deltas.get(key, (0, 0))
+            deltas[key] = (total + amount, n + count)
+    return _apply(tx, deltas)
+
+
+def set_budgets(tx, login_ids, month, year, suggestions):
+    """Make ``suggestions`` the (month name, year) budgets of ``login_ids``, replacing the previous ones."""
+    if not login_ids:
+        return
+    number = month_number(month)
+    scope = "WHERE login_id IN ({}) AND year = %s AND month = %s".format(', '.join(['%s'] * len(login_ids)))
+    params = tuple(login_ids) + (year, number)
+    tx.execute("UPDATE tbl_budget_counter SET budget = NULL " + scope, params)
+    tx.insert_many(
+        'tbl_budget_counter', ('login_id', 'category_id', 'year', 'month', 'budget'),
+        [(s['login_id'], s['category_id'], year, number, s['suggested_amount']) for s in suggestions],
+        on_duplicate='budget = VALUES(budget)'
+    )
+    tx.execute("UPDATE tbl_budget_counter SET alerted = " + level_sql() + " " + scope, params)
+
+
+def alerts(db, login_id, after=0, limit=50):
+    return db.fetchall(
+        "SELECT a.id, a.category_id, c.category_name, a.year, a.month, a.threshold, a.spent, a.budget, a.created_at "
+        "FROM tbl_budget_alert a INNER JOIN tbl_category c ON a.category_id = c.id "
+        "WHERE a.login_id = %s AND a.id > %s ORDER BY a.id LIMIT %s", (login_id, after, limit)
+    )
+
+
+def rebuild(db, login_id=None):
+    """Recompute the counters, for one user or everyone. Alert levels are reset silently."""
+    where = "WHERE login_id = %s" if login_id is not None else ""
+    params = (login_id,) if login_id is not None else ()
+    with db.transaction() as tx:
+        tx.execute("DELETE FROM tbl_budget_counter " + where, params)
+        for query, query_params in _populate(where, params):
+            tx.execute(query, query_params)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['rebuild'])
+    parser.add_argument('--user', type=int, help='only this login_id')
+    args = parser.parse_args(argv)
+
+    rebuild(Database(), args.user)
+    print('Budget counters rebuilt' + (' for user {}'.format(args.user) if args.user is not None else ''))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""Change log (tbl_change_log) behind GET /api/user/<id>/changes?since=<token>.
+
+Every write to a user's expenses, priorities or additional income appends
+(login_id, entity, entity_id, op) in the same transaction. Deletes are kept
+as tombstones. A sync token is the last seq the client has seen, so a poll
+returns only the rows touched since then.
+
+Writers bump the user's data version (versions.py) before recording, and that
+row lock serialises one user's writes, so a user's seqs become visible in
+commit order and a token never skips a change that commits later.
+"""
+from collections import OrderedDict
+
+import pagination
+
+ENTITIES = OrderedDict([
+    ('expense', 'tbl_expense'),
+    ('priority', 'tbl_priority'),
+    ('income', 'tbl_add_income'),
+])
+UPSERT = 'upsert'
+DELETE = 'delete'
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 2000
+
+
+def record(tx, login_id, entity, entity_id, op=UPSERT):
+    tx.execute(
+        "INSERT INTO tbl_change_log (login_id, entity, entity_id, op) VALUES (%s, %s, %s, %s)",
+        (login_id, entity, entity_id, op)
+    )
+
+
+def record_inserted(tx, login_id, entity, entity_ids):
+    """Log the freshly inserted ``entity_ids`` of ``login_id`` as upserted."""
+    tx.insert_many(
+        'tbl_change_log', ('login_id', 'entity', 'entity_id', 'op'),
+        [(login_id, entity, entity_id, UPSERT) for entity_id in entity_ids]
+    )
+
+
+def encode_token(seq):
+    return pagination.encode_cursor([seq])
+
+
+def decode_token(token):
+    try:
+        return pagination.decode_cursor(token, int)[0]
+    except pagination.BadRequest:
+        raise pagination.BadRequest('Invalid sync token')
+
+
+def latest_token(db, login_id):
+    row = db.fetchone("SELECT COALESCE(MAX(seq), 0) AS seq FROM tbl_change_log WHERE login_id = %s", (login_id,))
+    return encode_token(row['seq'])
+
+
+def since(db, login_id, seq, limit=DEFAULT_LIMIT):
+    """Rows changed after ``seq``, per entity, plus the token to resume from.
+
+    Returns {'token', 'has_more', '<entity>': {'upserted': [rows], 'deleted': [ids]}}. Several
+    changes to one row collapse to its current state; a row that no longer exists is reported as
+    deleted even if its tombstone is on a later page.
+    """
+    log = db.fetchall(
+        "SELECT seq, entity, entity_id, op FROM tbl_change_log WHERE login_id = %s AND seq > %s "
+        "ORDER BY seq LIMIT %s", (login_id, seq, limit + 1)
+    )
+    has_more = len(log) > limit
+    log = log[:limit]
+
+    latest = OrderedDict((entity, OrderedDict()) for entity in ENTITIES)
+    for entry in log:
+        ops = latest[entry['entity']]
+        ops.pop(entry['entity_id'], None)
+        ops[entry['entity_id']] = entry['op']
+
+    result = {'token': encode_token(log[-1]['seq'] if log else seq), 'has_more': has_more}
+    for entity, ops in latest.items():
+        upserted_ids = [entity_id for entity_id, op in ops.items() if op == UPSERT]
+        rows = []
+        if upserted_ids:
+            rows = db.fetchall(
+                "SELECT * FROM {} WHERE login_id = %s AND id IN ({})".format(
+                    ENTITIES[entity], ', '.join(['%s'] * len(upserted_ids))
+                ),
+                (login_id,) + tuple(upserted_ids)
+            )
+        found = {row['id'] for row in rows}
+        result[entity] = {
+            'upserted': rows,
+            'deleted': [entity_id for entity_id, op in ops.items() if op == DELETE or entity_id not in found],
+        }
+    return result
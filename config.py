@@ -0,0 +1,564 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import mysql.connector
+from mysql.connector import errors
+
+import replicas as replica_routing
+from querystats import QueryStats
+
+
+DB_CONFIG = {
+    'host': os.environ.get('DB_HOST', 'localhost'),
+    'port': int(os.environ.get('DB_PORT', 3306)),
+    'user': os.environ.get('DB_USER', 'root'),
+    'password': os.environ.get('DB_PASSWORD', ''),
+    'database': os.environ.get('DB_NAME', 'personal_finance'),
+}
+
+# Pool sizing: keep DB_POOL_SIZE >= the number of worker threads serving app.py
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))   # seconds to wait for a free connection
+POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))   # reconnect connections older than this
+POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') != '0'
+# Server-side prepared statements kept open per connection (LRU)
+STATEMENT_CACHE_SIZE = int(os.environ.get('DB_STATEMENT_CACHE_SIZE', 64))
+
+# "This command is not supported in the prepared statement protocol yet"
+ER_UNSUPPORTED_PS = 1295
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be checked out within the pool timeout."""
+
+
+class StatementStats:
+    """Hit/miss counters shared by every statement cache of a pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def record(self, hit, evicted=0):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.evictions += evicted
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class StatementCache:
+    """LRU of prepared cursors for one connection, keyed by SQL text.
+
+    mysql-connector only reuses a prepared statement when it is handed the
+    very same string object again, so the first string seen for a query is
+    kept alongside its cursor and passed back on every hit.
+    """
+
+    def __init__(self, raw, capacity, stats):
+        self.raw = raw
+        self.capacity = capacity
+        self.stats = stats
+        self._entries = OrderedDict()
+
+    def get(self, query):
+        entry = self._entries.get(query)
+        if entry is not None:
+            self._entries.move_to_end(query)
+            self.stats.record(hit=True)
+            return entry
+
+        evicted = 0
+        while self._entries and len(self._entries) >= self.capacity:
+            _, (_, old_cursor) = self._entries.popitem(last=False)
+            self._close_cursor(old_cursor)
+            evicted += 1
+        entry = (query, self.raw.cursor(prepared=True, dictionary=True))
+        if self.capacity > 0:
+            self._entries[query] = entry
+        self.stats.record(hit=False, evicted=evicted)
+        return entry
+
+    def discard(self, query):
+        entry = self._entries.pop(query, None)
+        if entry is not None:
+            self._close_cursor(entry[1])
+
+    def clear(self):
+        while self._entries:
+            _, (_, cursor) = self._entries.popitem()
+            self._close_cursor(cursor)
+
+    @staticmethod
+    def _close_cursor(cursor):
+        try:
+            cursor.close()
+        except errors.Error:
+            pass
+
+
+class PooledConnection:
+    """A MySQL connection plus the bookkeeping the pool needs."""
+
+    def __init__(self, raw, statement_cache_size=STATEMENT_CACHE_SIZE, statement_stats=None, query_stats=None):
+        self.raw = raw
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.statements = StatementCache(raw, statement_cache_size, statement_stats or StatementStats())
+        self.query_stats = query_stats
+
+    def run(self, query, params=None, fetch=None):
+        """Execute ``query`` with bound ``params`` through a cached prepared statement.
+
+        ``fetch`` selects the result: 'one', 'all', 'id' (lastrowid) or None (rowcount).
+        """
+        if self.query_stats is None:
+            return self._execute(query, params, fetch)
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = self._execute(query, params, fetch)
+            failed = False
+            return result
+        finally:
+            self.query_stats.observe(query, time.perf_counter() - started, failed)
+
+    def _execute(self, query, params, fetch):
+        params = tuple(params) if params is not None else ()
+        sql, cursor = self.statements.get(query)
+        try:
+            cursor.execute(sql, params)
+        except errors.ProgrammingError as e:
+            self.statements.discard(query)
+            if e.errno != ER_UNSUPPORTED_PS:
+                raise
+            # Statements the binary protocol can't prepare (some DDL/SHOW) go through a text cursor
+            cursor = self.raw.cursor(dictionary=True, buffered=True)
+            try:
+                cursor.execute(query, params or None)
+                return self._result(cursor, fetch)
+            finally:
+                cursor.close()
+        except Exception:
+            self.statements.discard(query)
+            raise
+        if self.statements.capacity <= 0:
+            try:
+                return self._result(cursor, fetch)
+            finally:
+                cursor.close()
+        return self._result(cursor, fetch)
+
+    @staticmethod
+    def _result(cursor, fetch):
+        if fetch == 'one':
+            # Prepared cursors are unbuffered, drain the result so the connection stays usable
+            rows = cursor.fetchall()
+            return rows[0] if rows else None
+        if fetch == 'all':
+            return cursor.fetchall()
+        if cursor.with_rows:
+            cursor.fetchall()
+        if fetch == 'id':
+            return cursor.lastrowid
+        return cursor.rowcount
+
+    def close(self):
+        self.statements.clear()
+        try:
+            self.raw.close()
+        except errors.Error:
+            pass
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of MySQL connections.
+
+    Connections are opened lazily up to ``size``. Checkout blocks for at most
+    ``timeout`` seconds, connections older than ``recycle`` seconds are
+    reopened and, with ``pre_ping``, each checkout verifies the connection is
+    still alive before handing it out.
+    """
+
+    def __init__(self, size=POOL_SIZE, timeout=POOL_TIMEOUT, recycle=POOL_RECYCLE,
+                 pre_ping=POOL_PRE_PING, statement_cache_size=STATEMENT_CACHE_SIZE,
+                 statement_stats=None, query_stats=None, **connect_args):
+        if size < 1:
+            raise ValueError('pool size must be at least 1')
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self.statement_cache_size = statement_cache_size
+        self.statement_stats = statement_stats or StatementStats()
+        self.query_stats = query_stats or QueryStats()
+        self.connect_args = connect_args or dict(DB_CONFIG)
+
+        self._idle = deque()
+        self._opened = 0
+        self._cond = threading.Condition()
+
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+        self._recycled = 0
+        self._ping_failures = 0
+
+    def _connect(self):
+        raw = mysql.connector.connect(autocommit=True, **self.connect_args)
+        return PooledConnection(raw, self.statement_cache_size, self.statement_stats, self.query_stats)
+
+    def _is_usable(self, conn):
+        if self.recycle and time.monotonic() - conn.created_at > self.recycle:
+            self._recycled += 1
+            return False
+        if self.pre_ping:
+            try:
+                conn.raw.ping(reconnect=False)
+            except errors.Error:
+                self._ping_failures += 1
+                return False
+        return True
+
+    def checkout(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._opened < self.size:
+                    self._opened += 1
+                    conn = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(
+                        'no database connection available after {:.1f}s (pool size {})'.format(self.timeout, self.size)
+                    )
+                waited = True
+                self._cond.wait(remaining)
+
+            wait = time.monotonic() - started
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+
+        # Health checks and connects happen outside the lock
+        try:
+            if conn is not None and not self._is_usable(conn):
+                conn.close()
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            self._release_slot()
+            raise
+        return conn
+
+    def checkin(self, conn, discard=False):
+        if discard:
+            conn.close()
+            self._release_slot()
+            return
+        conn.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def _release_slot(self):
+        with self._cond:
+            self._opened -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.checkout()
+        discard = False
+        try:
+            yield conn
+        except (errors.OperationalError, errors.InterfaceError):
+            # Broken connection: don't hand it to the next request
+            discard = True
+            raise
+        except Exception:
+            try:
+                conn.raw.rollback()
+            except errors.Error:
+                discard = True
+            raise
+        finally:
+            self.checkin(conn, discard=discard)
+
+    def dispose(self):
+        with self._cond:
+            while self._idle:
+                self._idle.pop().close()
+                self._opened -= 1
+
+    def stats(self):
+        with self._cond:
+            idle = len(self._idle)
+            return {
+                'size': self.size,
+                'opened': self._opened,
+                'in_use': self._opened - idle,
+                'idle': idle,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_time_total': round(self._wait_total, 6),
+                'wait_time_avg': round(self._wait_total / self._checkouts, 6) if self._checkouts else 0.0,
+                'wait_time_max': round(self._wait_max, 6),
+                'timeouts': self._timeouts,
+                'recycled': self._recycled,
+                'ping_failures': self._ping_failures,
+            }
+
+
+class QueryMethods:
+    """The query API shared by Database and Transaction; subclasses provide ``_run``."""
+
+    def _run(self, query, params, fetch):
+        raise NotImplementedError
+
+    def fetchone(self, query, params=None):
+        return self._run(query, params, 'one')
+
+    def fetchall(self, query, params=None):
+        return self._run(query, params, 'all')
+
+    def execute(self, query, params=None):
+        return self._run(query, params, None)
+
+    def executeAndReturnId(self, query, params=None):
+        return self._run(query, params, 'id')
+
+    def single_insert(self, query, params=None):
+        return self._run(query, params, 'id')
+
+    def insert_many(self, table, columns, rows, batch_size=1000, on_duplicate=None):
+        """Insert ``rows`` (sequences matching ``columns``) with multi-row INSERTs of ``batch_size``.
+
+        ``on_duplicate`` is an optional ON DUPLICATE KEY UPDATE clause. Returns the affected row count.
+        """
+        affected = 0
+        placeholders = '(' + ', '.join(['%s'] * len(columns)) + ')'
+        suffix = ' ON DUPLICATE KEY UPDATE ' + on_duplicate if on_duplicate else ''
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            affected += self._run(
+                "INSERT INTO {} ({}) VALUES {}{}".format(
+                    table, ', '.join(columns), ', '.join([placeholders] * len(batch)), suffix
+                ),
+                [value for row in batch for value in row], None
+            )
+        return affected
+
+    def insert_many_ids(self, table, columns, rows, batch_size=1000):
+        """Plain multi-row INSERTs like insert_many, returning the new AUTO_INCREMENT ids in row order.
+
+        InnoDB gives the rows of one INSERT with a known row count consecutive ids in every
+        innodb_autoinc_lock_mode, so each batch's ids follow from the first one (lastrowid) in
+        steps of auto_increment_increment (above 1 on multi-primary / Galera setups).
+        """
+        if not rows:
+            return []
+        step = self._run("SELECT @@SESSION.auto_increment_increment AS step", None, 'one')['step']
+        ids = []
+        placeholders = '(' + ', '.join(['%s'] * len(columns)) + ')'
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            first = self._run(
+                "INSERT INTO {} ({}) VALUES {}".format(table, ', '.join(columns), ', '.join([placeholders] * len(batch))),
+                [value for row in batch for value in row], 'id'
+            )
+            ids.extend(range(first, first + len(batch) * step, step))
+        return ids
+
+
+class LazyDatabase:
+    """Stands in for a Database that is only built, pool and all, on first use.
+
+    Call ``configure`` before the first query to override connection settings
+    (host, database, ...) or pool settings (size, timeout, ...).
+    """
+
+    def __init__(self, **pool_args):
+        self._pool_args = pool_args
+        self._db = None
+        self._lock = threading.Lock()
+
+    def configure(self, **pool_args):
+        with self._lock:
+            if self._db is not None:
+                raise RuntimeError('Database already in use; configure it before the first query')
+            self._pool_args.update(pool_args)
+
+    def get(self):
+        if self._db is None:
+            with self._lock:
+                if self._db is None:
+                    args = dict(self._pool_args)
+                    connection = {key: args.pop(key) for key in list(args) if key in DB_CONFIG}
+                    if connection:
+                        args.update(DB_CONFIG, **connection)
+                    self._db = Database(**args)
+        return self._db
+
+    @property
+    def started(self):
+        return self._db is not None
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+class Transaction(QueryMethods):
+    """Query helpers bound to one connection inside an explicit transaction."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def _run(self, query, params, fetch):
+        return self.conn.run(query, params, fetch)
+
+
+class Database(QueryMethods):
+    """Query helpers used by app.py.
+
+    Every call checks a connection out of the pool and runs the query as a
+    server-side prepared statement with ``%s`` placeholders bound to ``params``.
+    With ``replicas`` (host[:port] specs, default DB_REPLICAS) plain reads go to
+    a replica when replicas.py says it is fresh enough; see there.
+    """
+
+    def __init__(self, pool=None, replicas=None, **pool_args):
+        self.pool = pool or ConnectionPool(**pool_args)
+        specs = replica_routing.REPLICAS if replicas is None else replicas
+        self.replicas = replica_routing.ReplicaRouter([
+            replica_routing.Replica(spec, self._replica_pool(spec)) for spec in specs
+        ]) if specs else None
+
+    def _replica_pool(self, spec):
+        """A pool like the primary's (and sharing its stats) for the server at ``spec``."""
+        primary = self.pool
+        return ConnectionPool(
+            size=primary.size, timeout=primary.timeout, recycle=primary.recycle, pre_ping=primary.pre_ping,
+            statement_cache_size=primary.statement_cache_size, statement_stats=primary.statement_stats,
+            query_stats=primary.query_stats, **dict(primary.connect_args, **replica_routing.parse_spec(spec))
+        )
+
+    def _replica_for(self, query, fetch):
+        if self.replicas is None or fetch not in ('one', 'all', 'stream') or not replica_routing.is_read(query):
+            return None
+        return self.replicas.choose()
+
+    def _run(self, query, params, fetch):
+        replica = self._replica_for(query, fetch)
+        if replica is not None:
+            try:
+                with replica.pool.connection() as conn:
+                    return conn.run(query, params, fetch)
+            except (errors.OperationalError, errors.InterfaceError, PoolTimeout) as e:
+                self.replicas.failed(replica, e)
+        try:
+            with self.pool.connection() as conn:
+                return conn.run(query, params, fetch)
+        finally:
+            if self.replicas is not None and (fetch not in ('one', 'all') or not replica_routing.is_read(query)):
+                self.replicas.wrote()
+
+    @contextmanager
+    def transaction(self):
+        """Yield a Transaction; commits on success and rolls back if the block raises."""
+        with self.pool.connection() as conn:
+            conn.raw.start_transaction()
+            try:
+                yield Transaction(conn)
+            except BaseException:
+                conn.raw.rollback()
+                raise
+            conn.raw.commit()
+            if self.replicas is not None:
+                self.replicas.wrote()
+
+    @staticmethod
+    def _open_stream(pool, query, params):
+        """A connection checked out of ``pool`` and an unbuffered cursor that has executed ``query``."""
+        conn = pool.checkout()
+        try:
+            cursor = conn.raw.cursor(dictionary=True)
+            started = time.perf_counter()
+            cursor.execute(query, tuple(params) if params is not None else None)
+        except BaseException:
+            pool.checkin(conn, discard=True)
+            raise
+        # Only the execute is timed; the rows are paced by the consumer
+        pool.query_stats.observe(query, time.perf_counter() - started)
+        return conn, cursor
+
+    def stream(self, query, params=None, batch_size=1000):
+        """Yield the rows of ``query`` in lists of up to ``batch_size`` without buffering the result.
+
+        Uses an unbuffered (server-side streamed) cursor and ``fetchmany``, so memory stays at one
+        batch however many rows match. The connection is held until the generator finishes; if the
+        consumer stops early the unread result is abandoned with the connection instead of drained.
+        """
+        pool = self.pool
+        replica = self._replica_for(query, 'stream')
+        opened = None
+        if replica is not None:
+            try:
+                opened = self._open_stream(replica.pool, query, params)
+                pool = replica.pool
+            except (errors.OperationalError, errors.InterfaceError, PoolTimeout) as e:
+                # No rows were handed out yet, so the primary can answer instead, as in _run
+                self.replicas.failed(replica, e)
+        conn, cursor = opened or self._open_stream(pool, query, params)
+        finished = False
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+            cursor.close()
+            finished = True
+        finally:
+            pool.checkin(conn, discard=not finished)
+
+    def pool_stats(self):
+        return self.pool.stats()
+
+    def statement_cache_stats(self):
+        return self.pool.statement_stats.snapshot()
+
+    def query_stats(self, limit=50):
+        """Per-fingerprint timings (count, total, p50, p99, ...) and N+1 suspects."""
+        return self.pool.query_stats.snapshot(limit)
+
+    def replica_stats(self):
+        return self.replicas.stats() if self.replicas is not None else None
@@ -0,0 +1,185 @@
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import date
+
+import fanout
+from daterange import add_months, in_range, months_bounds
+
+
+DASHBOARD_TTL = float(os.environ.get('DASHBOARD_TTL', 60))   # seconds a computed snapshot is served
+TREND_MONTHS = 6
+
+
+def _num(value):
+    return float(value) if value not in (None, '') else 0.0
+
+
+INPUTS = ('expenses', 'users', 'incomes', 'suggestions', 'categories')
+
+
+def input_queries(today):
+    """(method, query, params) per entry of INPUTS; none depends on another, so they can run concurrently."""
+    return [
+        ('fetchall',
+         "SELECT login_id, category_id, source, YEAR(date) AS year, MONTH(date) AS month, "
+         "SUM(amount) AS total, COUNT(*) AS cnt "
+         "FROM tbl_expense WHERE " + in_range('date') + " "
+         "GROUP BY login_id, category_id, source, YEAR(date), MONTH(date)",
+         months_bounds(today.year, today.month, TREND_MONTHS)),
+        ('fetchall', "SELECT login_id, salary FROM tbl_user", None),
+        ('fetchall',
+         "SELECT login_id, SUM(amount) AS total FROM tbl_add_income WHERE month = %s GROUP BY login_id",
+         (today.strftime('%Y-%m'),)),
+        ('fetchall',
+         "SELECT login_id, category_id, suggested_amount FROM tbl_suggestions WHERE month = %s AND year = %s",
+         (today.strftime('%B'), today.year)),
+        ('fetchall', "SELECT id, category_name FROM tbl_category", None),
+    ]
+
+
+def load_inputs(db, today=None, fanout_db=None):
+    """Fetch everything the dashboard needs: one grouped scan of tbl_expense plus small lookups.
+
+    With a FanoutDatabase ``fanout_db`` the queries are issued concurrently.
+    """
+    today = today or date.today()
+    inputs = dict(zip(INPUTS, fanout.fetch_all(db, fanout_db, input_queries(today))))
+    inputs['today'] = today
+    return inputs
+
+
+def _usernames(db, login_ids):
+    if not login_ids:
+        return {}
+    placeholders = ', '.join(['%s'] * len(login_ids))
+    rows = db.fetchall(
+        "SELECT id, username FROM tbl_login WHERE id IN ({})".format(placeholders), tuple(login_ids)
+    )
+    return {row['id']: row['username'] for row in rows}
+
+
+def compute(inputs, resolve_usernames=None):
+    """Fold the grouped expense rows into every card shown on /home.
+
+    ``resolve_usernames`` maps the handful of login ids shown on the page to usernames.
+    """
+    today = inputs['today']
+    current = (today.year, today.month)
+    previous = add_months(today.year, today.month, -1)
+
+    month_totals = defaultdict(float)
+    user_month = defaultdict(float)            # login_id -> spent this month
+    user_txns = defaultdict(int)               # login_id -> expense rows this month
+    user_category = defaultdict(float)         # (login_id, category_id) -> spent this month
+    category_month = defaultdict(float)
+    source_month = defaultdict(float)
+
+    for row in inputs['expenses']:
+        key = (row['year'], row['month'])
+        total = _num(row['total'])
+        month_totals[key] += total
+        if key != current:
+            continue
+        user_month[row['login_id']] += total
+        user_txns[row['login_id']] += row['cnt']
+        user_category[(row['login_id'], row['category_id'])] += total
+        category_month[row['category_id']] += total
+        source_month[row['source']] += total
+
+    total_users = len(inputs['users'])
+    active_users = len(user_month)
+    total_expenses = month_totals.get(current, 0.0)
+    last_month_expenses = month_totals.get(previous, 0.0)
+    expense_growth_rate = ((total_expenses - last_month_expenses) / last_month_expenses * 100) if last_month_expenses > 0 else 0
+
+    # Savings rate / savings vs expenses, per registered user
+    income_by_user = {row['login_id']: _num(row['total']) for row in inputs['incomes']}
+    rates = []
+    savings_value = 0.0
+    expenses_value = 0.0
+    for row in inputs['users']:
+        income = _num(row['salary']) + income_by_user.get(row['login_id'], 0.0)
+        spent = user_month.get(row['login_id'], 0.0)
+        if income:
+            rates.append((income - spent) / income * 100)
+        savings_value += income - spent
+        expenses_value += spent
+    avg_savings_rate = sum(rates) / len(rates) if rates else 0
+
+    suggestions = inputs['suggestions']
+    within_budget = sum(
+        1 for s in suggestions
+        if (s['login_id'], s['category_id']) in user_category
+        and user_category[(s['login_id'], s['category_id'])] <= _num(s['suggested_amount'])
+    )
+    budget_adherence_rate = within_budget / len(suggestions) * 100 if suggestions else 0
+
+    category_names = {row['id']: row['category_name'] for row in inputs['categories']}
+    top_categories = sorted(
+        ((cid, total) for cid, total in category_month.items() if cid in category_names),
+        key=lambda item: item[1], reverse=True
+    )[:5]
+    top_users = sorted(user_month.items(), key=lambda item: item[1], reverse=True)[:5]
+    most_active = max(user_txns.items(), key=lambda item: item[1]) if user_txns else None
+
+    shown = [login_id for login_id, _ in top_users] + ([most_active[0]] if most_active else [])
+    usernames = resolve_usernames(sorted(set(shown))) if resolve_usernames else {}
+    trend_keys = [add_months(today.year, today.month, -k) for k in range(TREND_MONTHS - 1, -1, -1)]
+    trend_keys = [key for key in trend_keys if key in month_totals]
+
+    return {
+        'total_users': total_users,
+        'active_users': active_users,
+        'total_users_progress': min(total_users * 10, 100),
+        'total_expenses': total_expenses,
+        'expense_growth_rate': expense_growth_rate,
+        'expense_progress': min(total_expenses / 1000, 100),
+        'avg_savings_rate': avg_savings_rate,
+        'budget_adherence_rate': budget_adherence_rate,
+        'highest_category_name': category_names[top_categories[0][0]] if top_categories else "N/A",
+        'highest_category_amount': top_categories[0][1] if top_categories else 0,
+        'most_active_username': usernames.get(most_active[0], "N/A") if most_active else "N/A",
+        'most_active_transactions': most_active[1] if most_active else 0,
+        'expense_by_source_labels': list(source_month.keys()),
+        'expense_by_source_values': list(source_month.values()),
+        'trend_labels': [date(year, month, 1).strftime('%B') for year, month in trend_keys],
+        'trend_data': [month_totals[key] for key in trend_keys],
+        'category_labels': [category_names[cid] for cid, _ in top_categories],
+        'category_data': [total for _, total in top_categories],
+        'top_users_labels': [usernames.get(login_id, str(login_id)) for login_id, _ in top_users],
+        'top_users_data': [total for _, total in top_users],
+        'savings_value': savings_value,
+        'expenses_value': expenses_value,
+    }
+
+
+def build(db, today=None, fanout_db=None):
+    return compute(load_inputs(db, today, fanout_db), lambda login_ids: _usernames(db, login_ids))
+
+
+class DashboardSnapshot:
+    """Caches the computed dashboard for ``ttl`` seconds; only one thread rebuilds at a time."""
+
+    def __init__(self, ttl=DASHBOARD_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._value = None
+        self._expires = 0.0
+
+    def get(self, db, fanout_db=None):
+        value = self._value
+        if value is not None and time.monotonic() < self._expires:
+            return value
+        with self._lock:
+            if self._value is not None and time.monotonic() < self._expires:
+                return self._value
+            self._value = build(db, fanout_db=fanout_db)
+            self._expires = time.monotonic() + self.ttl
+            return self._value
+
+    def invalidate(self):
+        with self._lock:
+            self._value = None
+            self._expires = 0.0
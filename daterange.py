@@ -0,0 +1,44 @@
+"""Half-open date bounds for index-friendly (sargable) SQL filters.
+
+Filtering with ``MONTH(date) = MONTH(CURDATE())`` wraps the column in a
+function, which stops MySQL from using an index and silently ignores the
+year. The helpers here return ``date >= %s AND date < %s`` predicates with
+their bound parameters instead.
+"""
+from datetime import date
+
+
+def add_months(year, month, delta):
+    index = year * 12 + (month - 1) + delta
+    return index // 12, index % 12 + 1
+
+
+def month_bounds(year=None, month=None):
+    """(first day of the month, first day of the next month). Defaults to the current month."""
+    if year is None or month is None:
+        today = date.today()
+        year, month = today.year, today.month
+    next_year, next_month = add_months(year, month, 1)
+    return date(year, month, 1), date(next_year, next_month, 1)
+
+
+def months_bounds(year, month, count):
+    """Bounds covering ``count`` whole months ending with (year, month)."""
+    first_year, first_month = add_months(year, month, -(count - 1))
+    return date(first_year, first_month, 1), month_bounds(year, month)[1]
+
+
+def year_bounds(year=None):
+    year = year or date.today().year
+    return date(year, 1, 1), date(year + 1, 1, 1)
+
+
+def parse_month(value):
+    """'YYYY-MM' -> (year, month)."""
+    year, month = value.split('-')
+    return int(year), int(month)
+
+
+def in_range(column):
+    """SQL predicate for a half-open range on ``column``; bind it with a (start, end) pair."""
+    return "{0} >= %s AND {0} < %s".format(column)
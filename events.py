@@ -0,0 +1,230 @@
+"""Per-user event feed pushed to clients (Server-Sent Events, with a long-poll fallback).
+
+Write routes publish small events such as ``{'type': 'expense', 'op': 'upsert',
+'id': 5}`` once their transaction has committed. GET /api/user/<id>/events
+streams them as SSE and GET /api/user/<id>/events/poll long-polls, so a client
+refetches only when something changed and an idle client costs the database
+nothing.
+
+The default broker is in-process and only reaches subscribers connected to the
+same worker. With several workers set EVENTS_BROKER=redis://host:6379/0 (needs
+the ``redis`` package) so every worker sees every event.
+
+Each published event gets an increasing ``seq`` (the SSE id). Brokers keep the
+last HISTORY events per user, so a client reconnecting with Last-Event-ID (or
+?since=<seq>) gets what it missed in between. The in-process broker keeps that
+history for the HISTORY_USERS most recently notified users only.
+"""
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+
+EVENTS_BROKER = os.environ.get('EVENTS_BROKER', 'memory')
+HISTORY = 50
+HISTORY_USERS = int(os.environ.get('EVENTS_HISTORY_USERS', 10000))   # MemoryBroker: users with a history kept
+HEARTBEAT = float(os.environ.get('EVENTS_HEARTBEAT', 15))              # seconds between SSE keep-alives
+STREAM_SECONDS = float(os.environ.get('EVENTS_STREAM_SECONDS', 300))   # then the client reconnects
+POLL_TIMEOUT = 25
+MAX_POLL_TIMEOUT = 60
+RETRY_MS = 3000
+
+log = logging.getLogger(__name__)
+
+
+class _QueueSubscription:
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+
+    def put(self, event):
+        self._queue.put(event)
+
+    def get(self, timeout):
+        """The next event, or None after ``timeout`` seconds."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class MemoryBroker:
+    """Events for subscribers of this process."""
+
+    def __init__(self, history=HISTORY, max_users=HISTORY_USERS):
+        self._lock = threading.Lock()
+        # Start from the clock so seqs keep increasing across restarts and Last-Event-ID stays meaningful
+        self._seqs = itertools.count(int(time.time() * 1000))
+        self.history = history
+        self.max_users = max_users
+        self._history = OrderedDict()   # user_id -> deque of events, least recently notified first
+        self._subscribers = defaultdict(set)
+
+    def publish(self, user_id, event):
+        with self._lock:
+            event = dict(event, seq=next(self._seqs))
+            events = self._history.get(user_id)
+            if events is None:
+                events = self._history[user_id] = deque(maxlen=self.history)
+                while len(self._history) > self.max_users:
+                    self._history.popitem(last=False)
+            else:
+                self._history.move_to_end(user_id)
+            events.append(event)
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for subscription in subscribers:
+            subscription.put(event)
+        return event
+
+    @contextmanager
+    def subscribe(self, user_id):
+        subscription = _QueueSubscription()
+        with self._lock:
+            self._subscribers[user_id].add(subscription)
+        try:
+            yield subscription
+        finally:
+            with self._lock:
+                subscribers = self._subscribers[user_id]
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[user_id]
+
+    def recent(self, user_id, after):
+        """Buffered events for ``user_id`` with a seq above ``after``, oldest first."""
+        with self._lock:
+            return [event for event in self._history.get(user_id, ()) if event['seq'] > after]
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+class _RedisSubscription:
+    def __init__(self, pubsub):
+        self._pubsub = pubsub
+
+    def get(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            message = self._pubsub.get_message(timeout=max(0.0, deadline - time.monotonic()))
+            if message and message['type'] == 'message':
+                return json.loads(message['data'])
+            if time.monotonic() >= deadline:
+                return None
+
+
+class RedisBroker:
+    """Events shared by every worker through Redis pub/sub, with the history in a capped list."""
+
+    def __init__(self, url, history=HISTORY):
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+        self.history = history
+
+    @staticmethod
+    def _channel(user_id):
+        return 'events:{}'.format(user_id)
+
+    def publish(self, user_id, event):
+        event = dict(event, seq=self._redis.incr('events:seq'))
+        payload = json.dumps(event, default=str)
+        history = self._channel(user_id) + ':history'
+        pipe = self._redis.pipeline()
+        pipe.rpush(history, payload)
+        pipe.ltrim(history, -self.history, -1)
+        pipe.expire(history, 86400)
+        pipe.publish(self._channel(user_id), payload)
+        pipe.execute()
+        return event
+
+    @contextmanager
+    def subscribe(self, user_id):
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self._channel(user_id))
+        try:
+            yield _RedisSubscription(pubsub)
+        finally:
+            pubsub.close()
+
+    def recent(self, user_id, after):
+        events = (json.loads(payload) for payload in self._redis.lrange(self._channel(user_id) + ':history', 0, -1))
+        return [event for event in events if event['seq'] > after]
+
+    def subscriber_count(self):
+        return None   # spread over the workers; not known here
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def broker():
+    """The broker picked by EVENTS_BROKER, created on first use."""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = RedisBroker(EVENTS_BROKER) if shared() else MemoryBroker()
+    return _broker
+
+
+def shared():
+    """Whether events published here reach other processes (only the Redis broker does)."""
+    return EVENTS_BROKER.startswith('redis')
+
+
+def publish_many(user_ids, event):
+    """Publish ``event`` to each user. A broker failure is logged, never raised: the write already committed."""
+    for user_id in user_ids:
+        try:
+            broker().publish(user_id, event)
+        except Exception:
+            log.exception("Could not publish %s event for user %s", event.get('type'), user_id)
+
+
+def latest_seq(source, user_id):
+    events = source.recent(user_id, 0)
+    return events[-1]['seq'] if events else 0
+
+
+def wait(source, user_id, after, timeout):
+    """Events after ``after``; if there are none yet, wait up to ``timeout`` seconds for one."""
+    with source.subscribe(user_id) as subscription:
+        # Subscribed before reading the history, so nothing published in between is lost
+        events = source.recent(user_id, after)
+        if events or timeout <= 0:
+            return events
+        if subscription.get(timeout) is None:
+            return []
+        return source.recent(user_id, after)
+
+
+def format_sse(event):
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(event['seq'], event['type'], json.dumps(event, default=str))
+
+
+def stream(source, user_id, after=None, heartbeat=HEARTBEAT, duration=STREAM_SECONDS):
+    """SSE text chunks: missed events after ``after`` (if given), then live ones, for ``duration`` seconds."""
+    deadline = time.monotonic() + duration
+    yield 'retry: {}\n\n'.format(RETRY_MS)
+    with source.subscribe(user_id) as subscription:
+        last = after if after is not None else latest_seq(source, user_id)
+        for event in source.recent(user_id, last):
+            last = event['seq']
+            yield format_sse(event)
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            event = subscription.get(min(heartbeat, remaining))
+            if event is None:
+                yield ': keep-alive\n\n'
+            elif event['seq'] > last:
+                last = event['seq']
+                yield format_sse(event)
@@ -0,0 +1,398 @@
+"""In-memory columnar copy of tbl_expense for range analytics.
+
+Every expense is held in NumPy column arrays (id, login_id, category_id,
+source code, day, amount), sorted by id. A query filters a date range (and
+optionally a user / category / source) with vectorised masks, buckets the days
+by day, week, month or year and sums per bucket and dimension with bincount, so
+a new view is a different call instead of another GROUP BY over raw rows.
+
+The cube loads once (streamed, LOAD_BATCH rows at a time) and then follows
+tbl_change_log: at most every CUBE_REFRESH seconds a query re-reads the expense
+rows logged since its watermark and patches them in. Log entries stay above the
+watermark until they are CUBE_SETTLE seconds old, because a lower seq can commit
+after a higher one; re-reading them is harmless (rows are replaced by id).
+
+Memory is about 30 bytes per expense (300 MB for 10M rows) in each worker.
+
+Usage:
+    python expense_cube.py query [--from 2025-01-01] [--to 2025-12-31] [--granularity month]
+                                 [--group-by category,source] [--user ID]
+"""
+import argparse
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from datetime import date
+
+from config import Database
+from rollup import as_date
+
+GRANULARITIES = ('day', 'week', 'month', 'year')
+DIMENSIONS = ('user', 'category', 'source')
+CUBE_REFRESH = float(os.environ.get('CUBE_REFRESH', 5))   # seconds between change-log reads
+CUBE_SETTLE = float(os.environ.get('CUBE_SETTLE', 30))    # seconds before a log entry counts as committed in order
+LOAD_BATCH = 50000
+FETCH_BATCH = 1000
+DENSE_CELLS = 1 << 16        # group in a dense array up to this many cells (or 2x the rows) ...
+MAX_DENSE_CELLS = 1 << 24    # ... but never more
+MAX_GROUPS = 100000
+
+EPOCH = date(1970, 1, 1)   # day 0; it was a Thursday
+
+log = logging.getLogger(__name__)
+
+ROWS = "SELECT id, login_id, category_id, COALESCE(source, '') AS source, date, amount FROM tbl_expense"
+
+SETTLED_SEQ = (
+    "SELECT seq FROM tbl_change_log WHERE changed_at < NOW(6) - INTERVAL %s SECOND ORDER BY seq DESC LIMIT 1"
+)
+
+CHANGED = (
+    "SELECT seq, entity_id, changed_at < NOW(6) - INTERVAL %s SECOND AS settled FROM tbl_change_log "
+    "WHERE seq > %s AND entity = 'expense' ORDER BY seq"
+)
+
+
+def day_number(value):
+    return (value - EPOCH).days
+
+
+def day_date(number):
+    return date.fromordinal(EPOCH.toordinal() + int(number))
+
+
+class NotReady(Exception):
+    """The cube is still loading."""
+
+
+class ExpenseCube:
+    """Columnar expenses, loaded on first use and refreshed from the change log."""
+
+    COLUMNS = (('id', 'int64'), ('login_id', 'int32'), ('category_id', 'int32'), ('source', 'int16'),
+               ('day', 'int32'), ('amount', 'float64'), ('live', 'bool'))
+
+    def __init__(self, refresh_every=CUBE_REFRESH, settle=CUBE_SETTLE):
+        self.refresh_every = refresh_every
+        self.settle = settle
+        self._lock = threading.Lock()          # guards the arrays
+        self._sync_lock = threading.Lock()     # one loader / refresher at a time
+        self._columns = None
+        self._size = 0
+        self._dead = 0
+        self._sources = []                     # source code -> name
+        self._source_codes = {}
+        self._watermark = 0
+        self._next_refresh = 0.0
+
+    @property
+    def loaded(self):
+        return self._columns is not None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'loaded': self.loaded,
+                'rows': self._size - self._dead,
+                'dead': self._dead,
+                'bytes': sum(column.nbytes for column in self._columns.values()) if self.loaded else 0,
+                'watermark': self._watermark,
+            }
+
+    # -- building ------------------------------------------------------------------------------
+
+    def _encode(self, rows):
+        """Column arrays for tbl_expense rows (source names are dictionary-encoded)."""
+        import numpy as np
+
+        codes = []
+        for row in rows:
+            code = self._source_codes.get(row['source'])
+            if code is None:
+                code = self._source_codes[row['source']] = len(self._sources)
+                self._sources.append(row['source'])
+            codes.append(code)
+        count = len(rows)
+        return {
+            'id': np.fromiter((row['id'] for row in rows), dtype=np.int64, count=count),
+            'login_id': np.fromiter((row['login_id'] for row in rows), dtype=np.int32, count=count),
+            'category_id': np.fromiter((row['category_id'] for row in rows), dtype=np.int32, count=count),
+            'source': np.array(codes, dtype=np.int16),
+            'day': np.fromiter((day_number(as_date(row['date'])) for row in rows), dtype=np.int32, count=count),
+            'amount': np.fromiter((float(row['amount']) for row in rows), dtype=np.float64, count=count),
+            'live': np.ones(count, dtype=bool),
+        }
+
+    def _reserve(self, extra):
+        import numpy as np
+
+        capacity = len(self._columns['id'])
+        if self._size + extra <= capacity:
+            return
+        capacity = max(self._size + extra, capacity + capacity // 2, 1024)
+        for name, dtype in self.COLUMNS:
+            grown = np.zeros(capacity, dtype=dtype)
+            grown[:self._size] = self._columns[name][:self._size]
+            self._columns[name] = grown
+
+    def _append(self, batch):
+        count = len(batch['id'])
+        self._reserve(count)
+        for name, _ in self.COLUMNS:
+            self._columns[name][self._size:self._size + count] = batch[name]
+        self._size += count
+
+    def _sort(self):
+        order = self._columns['id'][:self._size].argsort(kind='stable')
+        for name, _ in self.COLUMNS:
+            self._columns[name][:self._size] = self._columns[name][:self._size][order]
+
+    def _compact(self):
+        live = self._columns['live'][:self._size].copy()
+        kept = int(live.sum())
+        for name, _ in self.COLUMNS:
+            self._columns[name][:kept] = self._columns[name][:self._size][live]
+        self._size, self._dead = kept, 0
+
+    def _positions(self, ids):
+        """(positions, found mask) of ``ids`` in the sorted id column."""
+        import numpy as np
+
+        existing = self._columns['id'][:self._size]
+        positions = np.searchsorted(existing, ids)
+        found = positions < self._size
+        found[found] = existing[positions[found]] == ids[found]
+        return positions, found
+
+    def _apply(self, rows, removed_ids):
+        """Replace or add ``rows`` and drop ``removed_ids``. Call with the lock held."""
+        import numpy as np
+
+        if rows:
+            batch = self._encode(rows)
+            positions, found = self._positions(batch['id'])
+            at = positions[found]
+            self._dead -= int((~self._columns['live'][at]).sum())
+            for name, _ in self.COLUMNS:
+                self._columns[name][at] = batch[name][found]
+            if not found.all():
+                new = {name: column[~found] for name, column in batch.items()}
+                in_order = self._size == 0 or new['id'].min() > self._columns['id'][self._size - 1]
+                self._append(new)
+                if not in_order:
+                    self._sort()   # an older id committed late; rare
+        if removed_ids:
+            positions, found = self._positions(np.array(sorted(removed_ids), dtype=np.int64))
+            at = positions[found]
+            self._dead += int(self._columns['live'][at].sum())
+            self._columns['live'][at] = False
+            if self._dead > self._size // 4:
+                self._compact()
+
+    def load(self, db):
+        """(Re)load every expense, streamed in id order. Queries keep seeing the old copy until it is done."""
+        import numpy as np
+
+        settled = db.fetchone(SETTLED_SEQ, (self.settle,))
+        fresh = ExpenseCube(self.refresh_every, self.settle)
+        fresh._columns = {name: np.zeros(0, dtype=dtype) for name, dtype in self.COLUMNS}
+        for rows in db.stream(ROWS + " ORDER BY id", None, LOAD_BATCH):
+            fresh._append(fresh._encode(rows))
+        with self._lock:
+            self._columns, self._size, self._dead = fresh._columns, fresh._size, 0
+            self._sources, self._source_codes = fresh._sources, fresh._source_codes
+            self._watermark = settled['seq'] if settled else 0
+            self._next_refresh = time.monotonic() + self.refresh_every
+
+    def refresh(self, db):
+        """Patch in the expenses logged since the watermark. Returns how many ids were re-read."""
+        entries = db.fetchall(CHANGED, (self.settle, self._watermark))
+        if not entries:
+            return 0
+        ids = sorted({entry['entity_id'] for entry in entries})
+        rows = []
+        for i in range(0, len(ids), FETCH_BATCH):
+            chunk = ids[i:i + FETCH_BATCH]
+            rows.extend(db.fetchall(ROWS + " WHERE id IN ({})".format(', '.join(['%s'] * len(chunk))), chunk))
+        watermark = self._watermark
+        for entry in entries:
+            if not entry['settled']:
+                break
+            watermark = entry['seq']
+        with self._lock:
+            self._apply(rows, set(ids) - {row['id'] for row in rows})
+            self._watermark = watermark
+        return len(ids)
+
+    def sync(self, db, wait=True):
+        """Load on first use, then refresh at most every ``refresh_every`` seconds.
+
+        With ``wait=False`` a cube that is not loaded yet raises NotReady instead of blocking the
+        caller on the full load (which is started in the background if nothing is loading it).
+        """
+        if self.loaded and time.monotonic() < self._next_refresh:
+            return
+        if not wait and not self.loaded:
+            if not self._sync_lock.locked():
+                self.start(db)
+            raise NotReady('Analytics are still loading, retry shortly')
+        with self._sync_lock:
+            if not self.loaded:
+                self.load(db)
+            elif time.monotonic() >= self._next_refresh:
+                try:
+                    self.refresh(db)
+                finally:
+                    self._next_refresh = time.monotonic() + self.refresh_every
+
+    def start(self, db):
+        """Load in a background thread so the first analytics request does not pay for it."""
+        thread = threading.Thread(target=self._preload, args=(db,), name='expense-cube-load', daemon=True)
+        thread.start()
+        return thread
+
+    def _preload(self, db):
+        try:
+            started = time.monotonic()
+            self.sync(db)
+            log.info("Expense cube loaded %d rows in %.1fs", self._size, time.monotonic() - started)
+        except Exception:
+            log.exception("Expense cube could not load; the first analytics request will retry")
+
+    # -- querying ------------------------------------------------------------------------------
+
+    def _select(self, start, end, login_id, category_id, source, columns):
+        """Copies of ``columns`` for the matching rows, plus the source names."""
+        import numpy as np
+
+        with self._lock:
+            size = self._size
+            day = self._columns['day'][:size]
+            mask = self._columns['live'][:size].copy()
+            if start is not None:
+                mask &= day >= day_number(start)
+            if end is not None:
+                mask &= day <= day_number(end)
+            if login_id is not None:
+                mask &= self._columns['login_id'][:size] == login_id
+            if category_id is not None:
+                mask &= self._columns['category_id'][:size] == category_id
+            if source is not None:
+                mask &= self._columns['source'][:size] == self._source_codes.get(source, -1)
+            rows = np.flatnonzero(mask)
+            return {name: self._columns[name][rows] for name in columns}, list(self._sources)
+
+    def query(self, start=None, end=None, granularity='month', group_by=(), login_id=None, category_id=None,
+              source=None, max_groups=MAX_GROUPS):
+        """Totals per period (and per ``group_by`` dimension) for days in [start, end], both inclusive.
+
+        Raises ValueError for an unknown granularity / dimension or more than ``max_groups`` result rows.
+
+        Returns ([{'period', <dimension>..., 'total', 'count'}] ordered by period then dimensions,
+        overall {'total', 'count'}). Periods are the first day of their day / week (Monday) / month / year.
+        """
+        import numpy as np
+
+        if granularity not in GRANULARITIES:
+            raise ValueError('granularity must be one of: {}'.format(', '.join(GRANULARITIES)))
+        unknown = [dimension for dimension in group_by if dimension not in DIMENSIONS]
+        if unknown:
+            raise ValueError('Unknown dimension(s): {}'.format(', '.join(unknown)))
+        names = {'user': 'login_id', 'category': 'category_id', 'source': 'source'}
+        picked, sources = self._select(start, end, login_id, category_id, source,
+                                       ['day', 'amount'] + [names[dimension] for dimension in group_by])
+        amounts = picked['amount']
+        summary = {'total': float(amounts.sum()), 'count': int(len(amounts))}
+        if not len(amounts):
+            return [], summary
+
+        # Bucket through a per-day lookup table covering the matched days, instead of converting every row
+        days = picked['day']
+        first = int(days.min())
+        calendar_days = np.arange(first, int(days.max()) + 1, dtype=np.int64)
+        if granularity == 'week':
+            buckets = calendar_days - (calendar_days + 3) % 7
+        elif granularity in ('month', 'year'):
+            unit = 'datetime64[M]' if granularity == 'month' else 'datetime64[Y]'
+            buckets = calendar_days.astype('datetime64[D]').astype(unit).astype('datetime64[D]').astype(np.int64)
+        else:
+            buckets = calendar_days
+        periods, period_index = np.unique(buckets, return_inverse=True)   # small: one entry per calendar day
+        keys = [period_index.reshape(-1)[days - first]] + [picked[names[dimension]].astype(np.int64)
+                                                           for dimension in group_by]
+
+        lows = [int(key.min()) for key in keys]
+        spans = [int(key.max()) - low + 1 for key, low in zip(keys, lows)]
+        cells = math.prod(spans)
+        if cells < 2 ** 62:
+            # One int64 per row (mixed radix over each key's range)
+            combined = np.zeros(len(amounts), dtype=np.int64)
+            for key, low, span in zip(keys, lows, spans):
+                combined = combined * span + (key - low)
+            if cells <= max(DENSE_CELLS, 2 * len(amounts)) and cells <= MAX_DENSE_CELLS:
+                # Small key space: count straight into a dense array, no sort
+                counts = np.bincount(combined, minlength=cells)
+                groups = np.flatnonzero(counts)
+                totals = np.bincount(combined, weights=amounts, minlength=cells)[groups]
+                counts = counts[groups]
+            else:
+                groups, inverse = np.unique(combined, return_inverse=True)
+                inverse = inverse.reshape(-1)
+                totals = np.bincount(inverse, weights=amounts, minlength=len(groups))
+                counts = np.bincount(inverse, minlength=len(groups))
+            decoded = []
+            rest = groups
+            for low, span in reversed(list(zip(lows, spans))):
+                decoded.append(rest % span + low)
+                rest = rest // span
+            decoded.reverse()
+        else:
+            groups, inverse = np.unique(np.column_stack(keys), axis=0, return_inverse=True)
+            inverse = inverse.reshape(-1)
+            totals = np.bincount(inverse, weights=amounts, minlength=len(groups))
+            counts = np.bincount(inverse, minlength=len(groups))
+            decoded = list(groups.T)
+
+        if len(groups) > max_groups:
+            raise ValueError('{} groups; narrow the range, coarsen the granularity or group by less'.format(len(groups)))
+        result = []
+        for i in range(len(groups)):
+            row = {'period': day_date(periods[decoded[0][i]]).isoformat()}
+            for dimension, values in zip(group_by, decoded[1:]):
+                value = int(values[i])
+                row[names[dimension]] = sources[value] if dimension == 'source' else value
+            row['total'] = round(float(totals[i]), 2)
+            row['count'] = int(counts[i])
+            result.append(row)
+        return result, summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['query'])
+    parser.add_argument('--from', dest='start', type=date.fromisoformat)
+    parser.add_argument('--to', dest='end', type=date.fromisoformat)
+    parser.add_argument('--granularity', choices=GRANULARITIES, default='month')
+    parser.add_argument('--group-by', default='', help='comma-separated: ' + ', '.join(DIMENSIONS))
+    parser.add_argument('--user', type=int, help='only this login_id')
+    args = parser.parse_args(argv)
+
+    cube = ExpenseCube()
+    started = time.monotonic()
+    cube.load(Database())
+    print('Loaded {rows} expenses ({bytes} bytes) in {seconds:.1f}s'.format(
+        seconds=time.monotonic() - started, **cube.stats()), file=sys.stderr)
+    group_by = [dimension for dimension in args.group_by.split(',') if dimension]
+    started = time.perf_counter()
+    rows, summary = cube.query(args.start, args.end, args.granularity, group_by, login_id=args.user)
+    print('Query took {:.1f} ms'.format((time.perf_counter() - started) * 1000), file=sys.stderr)
+    for row in rows:
+        print('\t'.join(str(value) for value in row.values()))
+    print('total\t{total}\t{count}'.format(**summary))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""Streaming expense export (NDJSON or CSV), optionally gzip-compressed on the fly."""
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+COLUMNS = ('id', 'date', 'category_id', 'category_name', 'amount', 'details', 'source')
+BATCH_SIZE = 1000
+
+QUERY = (
+    "SELECT e.id, e.date, e.category_id, c.category_name, e.amount, e.details, e.source "
+    "FROM tbl_expense e LEFT JOIN tbl_category c ON c.id = e.category_id "
+    "WHERE {where} ORDER BY e.date, e.id"
+)
+
+
+def _plain(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def ndjson_chunks(batches):
+    for rows in batches:
+        yield ''.join(
+            json.dumps({c: _plain(row[c]) for c in COLUMNS}, default=str) + '\n' for row in rows
+        ).encode()
+
+
+def csv_chunks(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    yield buffer.getvalue().encode()
+    for rows in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_plain(row[c]) for c in COLUMNS] for row in rows)
+        yield buffer.getvalue().encode()
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=31)  # 31 = gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def encode(batches, fmt, compress=False):
+    """Turn row batches into response body chunks in ``fmt``."""
+    chunks = csv_chunks(batches) if fmt == 'csv' else ndjson_chunks(batches)
+    return gzip_chunks(chunks) if compress else chunks
@@ -0,0 +1,82 @@
+"""Parsing and validation for bulk expense imports (JSON array or CSV upload)."""
+import csv
+import io
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+# Columns written to tbl_expense, in insert order
+COLUMNS = ('login_id', 'category_id', 'amount', 'details', 'source', 'date')
+BATCH_SIZE = 1000
+
+
+def read_csv(stream):
+    """Yield one dict per CSV row; the header names the fields (category_id or category, amount, ...)."""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    for record in csv.DictReader(text):
+        yield {key.strip(): (value.strip() if isinstance(value, str) else value)
+               for key, value in record.items() if key}
+
+
+def _category_id(record, ids, by_name):
+    value = record.get('category_id')
+    if value not in (None, ''):
+        try:
+            category_id = int(value)
+        except (TypeError, ValueError):
+            raise ValueError('category_id must be an integer')
+        if category_id not in ids:
+            raise ValueError('Unknown category_id {}'.format(category_id))
+        return category_id
+    name = record.get('category') or record.get('category_name')
+    if not name:
+        raise ValueError('category_id is required')
+    category_id = by_name.get(str(name).strip().lower())
+    if category_id is None:
+        raise ValueError('Unknown category {!r}'.format(name))
+    return category_id
+
+
+def _amount(value):
+    try:
+        amount = Decimal(str(value))
+    except (InvalidOperation, TypeError):
+        raise ValueError('amount must be a number')
+    if not amount.is_finite() or amount < 0:
+        raise ValueError('amount must be a non-negative number')
+    return amount
+
+
+def _date(value, today):
+    if value in (None, ''):
+        return today
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        raise ValueError('date must be YYYY-MM-DD')
+
+
+def validate(records, user_id, categories):
+    """Split ``records`` into (rows ready for tbl_expense, [{'row': n, 'error': msg}]).
+
+    ``categories`` are the tbl_category rows, fetched once for the whole import. Rows are numbered from 1.
+    """
+    ids = {row['id'] for row in categories}
+    by_name = {str(row['category_name']).strip().lower(): row['id'] for row in categories}
+    today = date.today()
+    rows, errors = [], []
+    for number, record in enumerate(records, start=1):
+        if not isinstance(record, dict):
+            errors.append({'row': number, 'error': 'Each expense must be an object'})
+            continue
+        try:
+            rows.append({
+                'login_id': user_id,
+                'category_id': _category_id(record, ids, by_name),
+                'amount': _amount(record.get('amount')),
+                'details': record.get('details') or '',
+                'source': record.get('source') or '',
+                'date': _date(record.get('date'), today),
+            })
+        except ValueError as e:
+            errors.append({'row': number, 'error': str(e)})
+    return rows, errors
@@ -0,0 +1,58 @@
+"""Issue independent queries concurrently on a thread pool.
+
+Each call runs on a worker thread with its own pooled connection, so the round
+trips of queries that don't depend on each other overlap. Transactions stay on
+the Database.
+
+DB_FANOUT=0 makes callers fall back to running the same queries one after
+another.
+"""
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+FANOUT = os.environ.get('DB_FANOUT', '1') != '0'
+
+
+class FanoutDatabase:
+    def __init__(self, db, max_workers=None):
+        self.db = db
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        # Created on first use so that wrapping a lazy Database doesn't build its pool
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # No point in more threads than connections: extra calls would only queue on the pool
+                    self._executor = ThreadPoolExecutor(
+                        self.max_workers or self.db.pool.size, thread_name_prefix='fanout'
+                    )
+        return self._executor
+
+    def run(self, calls):
+        """Results of ``calls`` — (method name, query, params) — in order, all submitted at once."""
+        # Each call carries its own copy of the contextvars (e.g. the per-request query counter)
+        futures = [
+            self.executor.submit(contextvars.copy_context().run, getattr(self.db, method), query, params)
+            for method, query, params in calls
+        ]
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+def fetch_all(db, fanout_db, calls):
+    """Run ``calls`` — a list of (method name, query, params) — and return their results in order.
+
+    Concurrently through ``fanout_db`` when fan-out is enabled, otherwise one by one on ``db``.
+    """
+    if fanout_db is None or not FANOUT:
+        return [getattr(db, method)(query, params) for method, query, params in calls]
+    return fanout_db.run(calls)
@@ -0,0 +1,68 @@
+"""Batch expense forecasting for all of a user's categories at once.
+
+An ordinary least-squares line through each category's monthly totals
+(x = year * 12 + month), evaluated at next month and clamped at 0; the same
+numbers the old scikit-learn LinearRegression gave, with NumPy alone.
+Categories with fewer than two months of history fall back to their single
+month's total (or 0). NumPy is imported on first use, not at import time.
+"""
+from datetime import datetime
+
+
+MONTHLY_TOTALS = (
+    "SELECT category_id, year, month, SUM(total) AS total_amount "
+    "FROM tbl_expense_monthly WHERE login_id = %s "
+    "GROUP BY category_id, year, month"
+)
+
+
+def load_monthly_totals(db, user_id):
+    """One query for every (category, month) total of a user, served from the monthly rollup."""
+    return db.fetchall(MONTHLY_TOTALS, (user_id,))
+
+
+def next_month_index(now=None):
+    now = now or datetime.now()
+    return now.year * 12 + now.month + 1
+
+
+def from_sums(n, sum_x, sum_xx, sum_y, sum_xy, target):
+    """The same forecast from the fit's sums (see forecast_state.py); x and ``target`` on one scale."""
+    if n < 2:
+        return float(sum_y) if n else 0.0
+    n, sum_x, sum_xx, sum_y, sum_xy = (float(v) for v in (n, sum_x, sum_xx, sum_y, sum_xy))
+    slope = (n * sum_xy - sum_x * sum_y) / (n * sum_xx - sum_x * sum_x)
+    return max((sum_y + slope * (n * target - sum_x)) / n, 0.0)
+
+
+def forecast_categories(monthly_totals, category_ids, target=None):
+    """Return {category_id: forecast} for ``category_ids`` from rows of load_monthly_totals()."""
+    import numpy as np
+
+    category_ids = list(category_ids)
+    if not category_ids:
+        return {}
+    target = next_month_index() if target is None else target
+    position = {category_id: i for i, category_id in enumerate(category_ids)}
+
+    rows = [row for row in monthly_totals if row['category_id'] in position]
+    k = len(category_ids)
+    idx = np.fromiter((position[row['category_id']] for row in rows), dtype=np.intp, count=len(rows))
+    # Centre x on the target month so the forecast is simply the fitted intercept
+    x = np.fromiter((row['year'] * 12 + row['month'] - target for row in rows), dtype=float, count=len(rows))
+    y = np.fromiter((float(row['total_amount'] or 0) for row in rows), dtype=float, count=len(rows))
+
+    n = np.bincount(idx, minlength=k).astype(float)
+    sx = np.bincount(idx, weights=x, minlength=k)
+    sy = np.bincount(idx, weights=y, minlength=k)
+    sxx = np.bincount(idx, weights=x * x, minlength=k)
+    sxy = np.bincount(idx, weights=x * y, minlength=k)
+
+    fitted = n >= 2
+    denominator = np.where(fitted, n * sxx - sx * sx, 1.0)
+    slope = np.where(fitted, (n * sxy - sx * sy) / denominator, 0.0)
+    intercept = np.where(fitted, (sy - slope * sx) / np.maximum(n, 1.0), 0.0)
+
+    # < 2 points: the single month's total (sy), or 0 with no history
+    result = np.where(fitted, np.maximum(intercept, 0.0), sy)
+    return {category_id: float(result[i]) for i, category_id in enumerate(category_ids)}
@@ -0,0 +1,184 @@
+"""Persisted linear-trend state per (login_id, category_id) (tbl_forecast_state).
+
+Holds the sufficient statistics of the least-squares fit forecast.py does over
+a category's monthly totals: n (months with expenses), sum_x, sum_xx, sum_y and
+sum_xy, with x = year * 12 + month - EPOCH. The expense write routes update it
+in the same transaction as the monthly rollup: an amount change only moves
+sum_y / sum_xy, and a month appearing or emptying moves n / sum_x / sum_xx, so
+each write costs one small lookup plus one upsert, and a forecast is a single
+row read instead of a scan of the history.
+
+Usage:
+    python forecast_state.py verify [--user ID] [--fix]   compare the state with tbl_expense
+    python forecast_state.py rebuild [--user ID]          recompute the state from tbl_expense
+"""
+import argparse
+import sys
+
+import forecast
+from config import Database
+from rollup import as_date
+
+# Months are counted from here so the squared sums stay small and exact
+EPOCH = 2000 * 12
+
+COLUMNS = ('login_id', 'category_id', 'n', 'sum_x', 'sum_xx', 'sum_y', 'sum_xy')
+
+RAW_STATE = (
+    "SELECT login_id, category_id, COUNT(*) AS n, SUM(x) AS sum_x, SUM(x * x) AS sum_xx, "
+    "SUM(total) AS sum_y, SUM(x * total) AS sum_xy "
+    "FROM ("
+    "  SELECT login_id, category_id, YEAR(date) * 12 + MONTH(date) - " + str(EPOCH) + " AS x, SUM(amount) AS total "
+    "  FROM tbl_expense {where} GROUP BY login_id, category_id, x"
+    ") months "
+    "GROUP BY login_id, category_id"
+)
+
+USER_STATE = (
+    "SELECT category_id, n, sum_x, sum_xx, sum_y, sum_xy FROM tbl_forecast_state WHERE login_id = %s"
+)
+
+ON_DUPLICATE = ', '.join('{0} = {0} + VALUES({0})'.format(column) for column in COLUMNS[2:])
+
+
+def month_x(year, month):
+    return year * 12 + month - EPOCH
+
+
+def _month_deltas(rows, sign, deltas):
+    for row in rows:
+        day = as_date(row['date'])
+        key = (row['login_id'], row['category_id'], day.year, day.month)
+        amount, count = deltas.get(key, (0, 0))
+        deltas[key] = (amount + sign * row['amount'], count + sign)
+    return deltas
+
+
+def _apply(tx, deltas):
+    """Fold per-month (amount, row count) deltas into the state. Run after the rollup has them."""
+    deltas = {key: delta for key, delta in deltas.items() if delta != (0, 0)}
+    if not deltas:
+        return
+    keys = list(deltas)
+    # Rows per month *after* the write, straight from the rollup's primary key. A locking read, so
+    # rollup rows committed by the user's previous writer (serialised on tbl_data_version) are counted
+    counts = {
+        (row['login_id'], row['category_id'], row['year'], row['month']): row['cnt']
+        for row in tx.fetchall(
+            "SELECT login_id, category_id, year, month, SUM(cnt) AS cnt FROM tbl_expense_monthly "
+            "WHERE (login_id, category_id, year, month) IN ({}) "
+            "GROUP BY login_id, category_id, year, month LOCK IN SHARE MODE".format(', '.join(['(%s, %s, %s, %s)'] * len(keys))),
+            [value for key in keys for value in key]
+        )
+    }
+    states = {}
+    for key, (amount, count) in deltas.items():
+        login_id, category_id, year, month = key
+        after = counts.get(key, 0) > 0
+        before = counts.get(key, 0) - count > 0
+        x = month_x(year, month)
+        dn = after - before
+        n, sx, sxx, sy, sxy = states.get((login_id, category_id), (0, 0, 0, 0, 0))
+        states[(login_id, category_id)] = (n + dn, sx + dn * x, sxx + dn * x * x, sy + amount, sxy + x * amount)
+    tx.insert_many('tbl_forecast_state', COLUMNS,
+                   [key + state for key, state in states.items()], on_duplicate=ON_DUPLICATE)
+    for key, state in states.items():
+        if state[0] < 0:
+            tx.execute("DELETE FROM tbl_forecast_state WHERE login_id = %s AND category_id = %s AND n <= 0", key)
+
+
+def apply_change(tx, old, new):
+    """Move ``old`` out of and ``new`` into the state. Either may be None (insert / delete)."""
+    deltas = _month_deltas([old] if old else [], -1, {})
+    _apply(tx, _month_deltas([new] if new else [], 1, deltas))
+
+
+def apply_rows(tx, rows):
+    """Add many new tbl_expense rows at once."""
+    _apply(tx, _month_deltas(rows, 1, {}))
+
+
+def forecasts(states, category_ids, target=None):
+    """{category_id: forecast} from USER_STATE rows; categories without a row forecast 0.
+
+    ``target`` is a month index as in forecast.next_month_index().
+    """
+    target = (forecast.next_month_index() if target is None else target) - EPOCH
+    by_category = {row['category_id']: row for row in states}
+    result = {}
+    for category_id in category_ids:
+        row = by_category.get(category_id)
+        result[category_id] = forecast.from_sums(
+            row['n'], row['sum_x'], row['sum_xx'], row['sum_y'], row['sum_xy'], target
+        ) if row else 0.0
+    return result
+
+
+def predict(db, login_id, category_id):
+    """Next month's forecast for one category, from its state row."""
+    row = db.fetchone(
+        "SELECT category_id, n, sum_x, sum_xx, sum_y, sum_xy FROM tbl_forecast_state "
+        "WHERE login_id = %s AND category_id = %s", (login_id, category_id)
+    )
+    return forecasts([row] if row else [], [category_id])[category_id]
+
+
+def rebuild(db, login_id=None):
+    """Recompute the state from tbl_expense, for one user or everyone."""
+    user_filter = "WHERE login_id = %s" if login_id is not None else ""
+    params = (login_id,) if login_id is not None else ()
+    with db.transaction() as tx:
+        tx.execute("DELETE FROM tbl_forecast_state " + user_filter, params)
+        tx.execute(
+            "INSERT INTO tbl_forecast_state ({}) ".format(', '.join(COLUMNS)) + RAW_STATE.format(where=user_filter),
+            params
+        )
+
+
+def verify(db, login_id=None):
+    """Return the (login_id, category_id) states that disagree with tbl_expense."""
+    user_filter = "WHERE login_id = %s" if login_id is not None else ""
+    params = (login_id,) if login_id is not None else ()
+    raw = RAW_STATE.format(where=user_filter)
+    join = "r.login_id = s.login_id AND r.category_id = s.category_id"
+    differs = " OR ".join("s.{0} <> r.{0}".format(column) for column in COLUMNS[2:])
+    return db.fetchall(
+        "SELECT r.login_id, r.category_id, r.n AS raw_n, r.sum_y AS raw_sum_y, s.n AS state_n, s.sum_y AS state_sum_y "
+        "FROM (" + raw + ") r LEFT JOIN tbl_forecast_state s ON " + join + " "
+        "WHERE s.login_id IS NULL OR " + differs + " "
+        "UNION ALL "
+        "SELECT s.login_id, s.category_id, NULL, NULL, s.n, s.sum_y "
+        "FROM tbl_forecast_state s LEFT JOIN (" + raw + ") r ON " + join + " "
+        "WHERE r.login_id IS NULL" + (" AND s.login_id = %s" if login_id is not None else ""),
+        params * 3
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['verify', 'rebuild'])
+    parser.add_argument('--user', type=int, help='only this login_id')
+    parser.add_argument('--fix', action='store_true', help='rebuild the users that fail verification')
+    args = parser.parse_args(argv)
+
+    db = Database()
+    if args.command == 'rebuild':
+        rebuild(db, args.user)
+        print('Forecast state rebuilt' + (' for user {}'.format(args.user) if args.user is not None else ''))
+        return 0
+
+    mismatches = verify(db, args.user)
+    for row in mismatches:
+        print('{login_id} cat={category_id}: raw n={raw_n} sum_y={raw_sum_y} '
+              'state n={state_n} sum_y={state_sum_y}'.format(**row))
+    if mismatches and args.fix:
+        for login_id in sorted({row['login_id'] for row in mismatches}):
+            rebuild(db, login_id)
+        print('Rebuilt {} user(s)'.format(len({row['login_id'] for row in mismatches})))
+        return 0
+    print('{} mismatching state row(s)'.format(len(mismatches)))
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""Everything the home and report screens show, for one user, in one response.
+
+Each section matches the body of the standalone endpoint it replaces. Sections
+are computed from a few shared intermediate results (the user's monthly rollup
+rows, this month's income, budget counters and priorities), each loaded at
+most once and only if a requested section needs it.
+"""
+import calendar
+from collections import OrderedDict
+from datetime import datetime
+
+SECTIONS = ('summary', 'by_category', 'progressbar', 'trends', 'additional_income_sum', 'priority_vs_spending')
+
+
+class BundleInputs:
+    """Lazily loaded, memoised queries shared between sections."""
+
+    def __init__(self, db, user_id, now):
+        self.db = db
+        self.user_id = user_id
+        self.now = now
+        self._cache = {}
+
+    def _once(self, name, load):
+        if name not in self._cache:
+            self._cache[name] = load()
+        return self._cache[name]
+
+    def monthly(self):
+        """Per (category, year, month) totals from the rollup; trends and the current-month sections derive from it."""
+        return self._once('monthly', lambda: self.db.fetchall(
+            "SELECT m.category_id, c.category_name, m.year, m.month, SUM(m.total) AS total_amount "
+            "FROM tbl_expense_monthly m INNER JOIN tbl_category c ON m.category_id = c.id "
+            "WHERE m.login_id = %s GROUP BY m.category_id, c.category_name, m.year, m.month",
+            (self.user_id,)
+        ))
+
+    def this_month(self):
+        """{category_id: row} for the current month."""
+        return self._once('this_month', lambda: OrderedDict(
+            (row['category_id'], row) for row in self.monthly()
+            if row['year'] == self.now.year and row['month'] == self.now.month
+        ))
+
+    def user(self):
+        return self._once('user', lambda: self.db.fetchone(
+            "SELECT salary FROM tbl_user WHERE login_id = %s", (self.user_id,)
+        ))
+
+    def additional_income(self):
+        return self._once('additional_income', lambda: self.db.fetchone(
+            "SELECT SUM(amount) AS sum FROM tbl_add_income WHERE login_id = %s AND month = %s",
+            (self.user_id, self.now.strftime('%Y-%m'))
+        )['sum'] or 0)
+
+    def budgets(self):
+        """{category_id: counter} for this month's categories with a budget (see budgets.py)."""
+        return self._once('budgets', lambda: OrderedDict(
+            (row['category_id'], row) for row in self.db.fetchall(
+                "SELECT b.category_id, c.category_name, b.spent, b.cnt, b.budget "
+                "FROM tbl_budget_counter b INNER JOIN tbl_category c ON b.category_id = c.id "
+                "WHERE b.login_id = %s AND b.year = %s AND b.month = %s AND b.budget IS NOT NULL",
+                (self.user_id, self.now.year, self.now.month)
+            )
+        ))
+
+    def priorities(self):
+        return self._once('priorities', lambda: self.db.fetchall(
+            "SELECT p.category_id, p.priority, c.category_name "
+            "FROM tbl_priority p INNER JOIN tbl_category c ON p.category_id = c.id WHERE p.login_id = %s",
+            (self.user_id,)
+        ))
+
+
+def summary(inputs):
+    user = inputs.user()
+    if not user:
+        return None
+    salary = user['salary']
+    additional = inputs.additional_income()
+    expenses = sum(row['total_amount'] for row in inputs.this_month().values())
+    total_income = salary + additional if salary is not None else None
+    return {
+        'fixed_salary': salary,
+        'additional_income': additional,
+        'total_income': total_income,
+        'total_expenses': expenses,
+        'balance': total_income - expenses if total_income is not None else None,
+        'month': inputs.now.strftime('%B'),
+        'year': inputs.now.year,
+    }
+
+
+def by_category(inputs):
+    return [{'category_name': row['category_name'], 'total_amount': row['total_amount'],
+             'category_id': row['category_id']} for row in inputs.this_month().values()]
+
+
+def progressbar(inputs):
+    return [{'category_name': row['category_name'], 'total_amount': row['spent'], 'suggested_amount': row['budget']}
+            for row in inputs.budgets().values() if row['cnt'] > 0]
+
+
+def trends(inputs):
+    totals = OrderedDict()
+    for row in sorted(inputs.monthly(), key=lambda r: (r['year'], r['month'])):
+        key = (row['year'], row['month'])
+        totals[key] = totals.get(key, 0) + row['total_amount']
+    return [{'year': year, 'month': calendar.month_name[month], 'total_amount': total}
+            for (year, month), total in totals.items()]
+
+
+def additional_income_sum(inputs):
+    return {'sum': inputs.additional_income()}
+
+
+def priority_vs_spending(inputs):
+    budgets = inputs.budgets()
+    return [{'category_name': p['category_name'], 'priority': p['priority'],
+             'suggested_amount': budgets[p['category_id']]['budget'],
+             'total_amount': budgets[p['category_id']]['spent'] if budgets[p['category_id']]['cnt'] > 0 else None}
+            for p in inputs.priorities() if p['category_id'] in budgets]
+
+
+BUILDERS = {
+    'summary': summary,
+    'by_category': by_category,
+    'progressbar': progressbar,
+    'trends': trends,
+    'additional_income_sum': additional_income_sum,
+    'priority_vs_spending': priority_vs_spending,
+}
+
+
+def parse_sections(value):
+    """Comma-separated ``sections=`` argument; empty means all. Raises ValueError on unknown names."""
+    if not value:
+        return list(SECTIONS)
+    sections = [s.strip() for s in value.split(',') if s.strip()]
+    unknown = [s for s in sections if s not in BUILDERS]
+    if unknown:
+        raise ValueError('Unknown section(s): {}'.format(', '.join(unknown)))
+    return sections
+
+
+def build(db, user_id, sections=SECTIONS, now=None):
+    inputs = BundleInputs(db, user_id, now or datetime.now())
+    return {name: BUILDERS[name](inputs) for name in sections}
@@ -0,0 +1,32 @@
+"""Logging setup for app.py.
+
+Records are handed to a queue and written to stderr by a background thread,
+so a log call on the request path never blocks on the terminal or a pipe.
+The level comes from LOG_LEVEL (default INFO).
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+_listener = None
+
+
+def configure(level=LOG_LEVEL):
+    """Install the queued stderr handler on the root logger, unless logging is already configured."""
+    global _listener
+    root = logging.getLogger()
+    if root.handlers or _listener is not None:
+        return
+    records = queue.SimpleQueue()
+    output = logging.StreamHandler()
+    output.setFormatter(logging.Formatter(LOG_FORMAT))
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(level)
@@ -0,0 +1,276 @@
+"""Versioned schema migrations.
+
+Usage:
+    python migrations.py migrate    apply pending migrations
+    python migrations.py status     list applied / pending versions
+    python migrations.py explain    EXPLAIN the hot queries and check they use the expected indexes
+"""
+import argparse
+import sys
+
+from mysql.connector import errors
+
+from config import Database
+from daterange import in_range, month_bounds
+
+
+# Errors that mean a migration step already ran (duplicate index / column / table)
+ALREADY_APPLIED = {1050, 1060, 1061}
+
+# Statements are literal SQL, frozen once released: the backfills repeat what rollup, forecast_state,
+# advance_scheduler and budgets compute, but later changes to those modules must not rewrite history.
+
+MIGRATIONS = [
+    (1, 'composite indexes for date-range filters', [
+        "CREATE INDEX idx_expense_login_date ON tbl_expense (login_id, date)",
+        "CREATE INDEX idx_expense_login_category_date ON tbl_expense (login_id, category_id, date)",
+        "CREATE INDEX idx_expense_date ON tbl_expense (date)",
+        "CREATE INDEX idx_add_income_login_month ON tbl_add_income (login_id, month)",
+        "CREATE INDEX idx_suggestions_login_period ON tbl_suggestions (login_id, year, month)",
+    ]),
+    (2, 'per-user monthly expense rollup', [
+        "CREATE TABLE tbl_expense_monthly ("
+        "  login_id INT NOT NULL,"
+        "  category_id INT NOT NULL,"
+        "  year SMALLINT NOT NULL,"
+        "  month TINYINT NOT NULL,"
+        "  source VARCHAR(50) NOT NULL DEFAULT '',"
+        "  total DECIMAL(14, 2) NOT NULL DEFAULT 0,"
+        "  cnt INT NOT NULL DEFAULT 0,"
+        "  PRIMARY KEY (login_id, category_id, year, month, source),"
+        "  KEY idx_expense_monthly_period (login_id, year, month)"
+        ")",
+        "INSERT INTO tbl_expense_monthly (login_id, category_id, year, month, source, total, cnt) "
+        "SELECT login_id, category_id, YEAR(date) AS year, MONTH(date) AS month, COALESCE(source, '') AS source, "
+        "SUM(amount) AS total, COUNT(*) AS cnt FROM tbl_expense "
+        "GROUP BY login_id, category_id, YEAR(date), MONTH(date), COALESCE(source, '') "
+        "ON DUPLICATE KEY UPDATE total = VALUES(total), cnt = VALUES(cnt)",
+    ]),
+    (3, 'data version counters for ETags', [
+        "CREATE TABLE tbl_data_version ("
+        "  scope VARCHAR(64) NOT NULL PRIMARY KEY,"
+        "  version BIGINT NOT NULL DEFAULT 0"
+        ")",
+    ]),
+    (4, 'updated_at columns and change log for delta sync', [
+        "ALTER TABLE tbl_expense ADD COLUMN updated_at TIMESTAMP(6) NOT NULL "
+        "DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)",
+        "ALTER TABLE tbl_priority ADD COLUMN updated_at TIMESTAMP(6) NOT NULL "
+        "DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)",
+        "ALTER TABLE tbl_add_income ADD COLUMN updated_at TIMESTAMP(6) NOT NULL "
+        "DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)",
+        "CREATE TABLE tbl_change_log ("
+        "  seq BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,"
+        "  login_id INT NOT NULL,"
+        "  entity VARCHAR(16) NOT NULL,"
+        "  entity_id INT NOT NULL,"
+        "  op ENUM('upsert', 'delete') NOT NULL,"
+        "  changed_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),"
+        "  KEY idx_change_log_login_seq (login_id, seq)"
+        ")",
+    ]),
+    (5, 'per-category forecast state', [
+        "CREATE TABLE tbl_forecast_state ("
+        "  login_id INT NOT NULL,"
+        "  category_id INT NOT NULL,"
+        "  n INT NOT NULL DEFAULT 0,"
+        "  sum_x BIGINT NOT NULL DEFAULT 0,"
+        "  sum_xx BIGINT NOT NULL DEFAULT 0,"
+        "  sum_y DECIMAL(16, 2) NOT NULL DEFAULT 0,"
+        "  sum_xy DECIMAL(20, 2) NOT NULL DEFAULT 0,"
+        "  PRIMARY KEY (login_id, category_id)"
+        ")",
+        "INSERT INTO tbl_forecast_state (login_id, category_id, n, sum_x, sum_xx, sum_y, sum_xy) "
+        "SELECT login_id, category_id, COUNT(*) AS n, SUM(x) AS sum_x, SUM(x * x) AS sum_xx, "
+        "SUM(total) AS sum_y, SUM(x * total) AS sum_xy FROM ("
+        "  SELECT login_id, category_id, YEAR(date) * 12 + MONTH(date) - 24000 AS x, SUM(amount) AS total"
+        "  FROM tbl_expense GROUP BY login_id, category_id, x"
+        ") months GROUP BY login_id, category_id "
+        "ON DUPLICATE KEY UPDATE n = VALUES(n), sum_x = VALUES(sum_x), sum_xx = VALUES(sum_xx), "
+        "sum_y = VALUES(sum_y), sum_xy = VALUES(sum_xy)",
+    ]),
+    (6, 'advance payment notifications', [
+        "CREATE TABLE tbl_advance_notification ("
+        "  expense_id INT NOT NULL PRIMARY KEY,"
+        "  login_id INT NOT NULL,"
+        "  due_date DATE NOT NULL,"
+        "  fired_at DATETIME NULL,"
+        "  acked_at DATETIME NULL,"
+        "  KEY idx_advance_notification_inbox (login_id, acked_at, due_date),"
+        "  KEY idx_advance_notification_pending (fired_at, due_date)"
+        ")",
+        "INSERT INTO tbl_advance_notification (expense_id, login_id, due_date, fired_at, acked_at) "
+        "SELECT id, login_id, date, IF(date < CURDATE(), date, NULL), IF(date < CURDATE(), date, NULL) "
+        "FROM tbl_expense WHERE source = 'advance' "
+        "ON DUPLICATE KEY UPDATE expense_id = expense_id",
+    ]),
+    (7, 'budget counters and alerts', [
+        "CREATE TABLE tbl_budget_counter ("
+        "  login_id INT NOT NULL,"
+        "  category_id INT NOT NULL,"
+        "  year SMALLINT NOT NULL,"
+        "  month TINYINT NOT NULL,"
+        "  spent DECIMAL(14, 2) NOT NULL DEFAULT 0,"
+        "  cnt INT NOT NULL DEFAULT 0,"
+        "  budget DECIMAL(12, 2) NULL,"
+        "  alerted SMALLINT NOT NULL DEFAULT 0,"
+        "  PRIMARY KEY (login_id, year, month, category_id)"
+        ")",
+        "CREATE TABLE tbl_budget_alert ("
+        "  id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,"
+        "  login_id INT NOT NULL,"
+        "  category_id INT NOT NULL,"
+        "  year SMALLINT NOT NULL,"
+        "  month TINYINT NOT NULL,"
+        "  threshold SMALLINT NOT NULL,"
+        "  spent DECIMAL(14, 2) NOT NULL,"
+        "  budget DECIMAL(12, 2) NOT NULL,"
+        "  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,"
+        "  KEY idx_budget_alert_login (login_id, id)"
+        ")",
+        # The ON DUPLICATE KEY UPDATE was added after release so a rerun after a partial failure
+        # goes through; on the fresh table above it changes nothing, so databases that ran the
+        # original statement need no follow-up
+        "INSERT INTO tbl_budget_counter (login_id, category_id, year, month, spent, cnt) "
+        "SELECT login_id, category_id, year, month, SUM(total), SUM(cnt) FROM tbl_expense_monthly "
+        "GROUP BY login_id, category_id, year, month "
+        "ON DUPLICATE KEY UPDATE spent = VALUES(spent), cnt = VALUES(cnt)",
+        "INSERT INTO tbl_budget_counter (login_id, category_id, year, month, budget) "
+        "SELECT login_id, category_id, year, FIELD(month, 'January', 'February', 'March', 'April', 'May', "
+        "'June', 'July', 'August', 'September', 'October', 'November', 'December'), suggested_amount "
+        "FROM tbl_suggestions "
+        "ON DUPLICATE KEY UPDATE budget = VALUES(budget)",
+        "UPDATE tbl_budget_counter SET alerted = CASE WHEN budget IS NULL OR budget <= 0 THEN 0 "
+        "WHEN spent * 100 >= budget * 100 THEN 100 WHEN spent * 100 >= budget * 80 THEN 80 "
+        "WHEN spent * 100 >= budget * 50 THEN 50 ELSE 0 END",
+    ]),
+    (8, 'per-user monthly stats for the admin pages', [
+        "CREATE TABLE tbl_user_stats ("
+        "  login_id INT NOT NULL,"
+        "  year SMALLINT NOT NULL,"
+        "  month TINYINT NOT NULL,"
+        "  income DECIMAL(14, 2) NOT NULL DEFAULT 0,"
+        "  expenses DECIMAL(14, 2) NOT NULL DEFAULT 0,"
+        "  savings_rate DECIMAL(12, 2) AS (IF(income > 0, (income - expenses) * 100 / income, NULL)) STORED,"
+        "  PRIMARY KEY (login_id, year, month),"
+        "  KEY idx_user_stats_expenses (year, month, expenses, login_id),"
+        "  KEY idx_user_stats_savings (year, month, savings_rate, login_id)"
+        ")",
+        "CREATE TABLE tbl_user_stats_month ("
+        "  year SMALLINT NOT NULL,"
+        "  month TINYINT NOT NULL,"
+        "  seeded_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,"
+        "  PRIMARY KEY (year, month)"
+        ")",
+        "CREATE INDEX idx_user_name ON tbl_user (name)",
+    ]),
+    (9, 'seed user stats for every month with data', [
+        "INSERT IGNORE INTO tbl_user_stats_month (year, month) "
+        "SELECT DISTINCT year, month FROM tbl_expense_monthly "
+        "UNION SELECT DISTINCT CAST(LEFT(month, 4) AS UNSIGNED), CAST(SUBSTRING(month, 6, 2) AS UNSIGNED) "
+        "FROM tbl_add_income WHERE month REGEXP '^[0-9]{4}-[0-9]{2}' "
+        "UNION SELECT YEAR(CURDATE()), MONTH(CURDATE())",
+        "INSERT INTO tbl_user_stats (login_id, year, month, income, expenses) "
+        "SELECT u.login_id, p.year, p.month, "
+        "COALESCE(u.salary, 0) + COALESCE((SELECT SUM(a.amount) FROM tbl_add_income a "
+        "  WHERE a.login_id = u.login_id AND a.month = CONCAT(LPAD(p.year, 4, '0'), '-', LPAD(p.month, 2, '0'))), 0), "
+        "COALESCE((SELECT SUM(m.total) FROM tbl_expense_monthly m "
+        "  WHERE m.login_id = u.login_id AND m.year = p.year AND m.month = p.month), 0) "
+        "FROM tbl_user u CROSS JOIN tbl_user_stats_month p "
+        "ON DUPLICATE KEY UPDATE income = VALUES(income), expenses = VALUES(expenses)",
+    ]),
+]
+
+
+def _ensure_version_table(db):
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "  version INT PRIMARY KEY,"
+        "  description VARCHAR(255) NOT NULL,"
+        "  applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP"
+        ")"
+    )
+
+
+def applied_versions(db):
+    _ensure_version_table(db)
+    return {row['version'] for row in db.fetchall("SELECT version FROM schema_migrations")}
+
+
+def migrate(db, target=None):
+    """Apply every pending migration up to ``target`` (default: latest). Returns the versions applied."""
+    done = applied_versions(db)
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        if version in done or (target is not None and version > target):
+            continue
+        for statement in statements:
+            try:
+                db.execute(statement)
+            except errors.DatabaseError as e:
+                # DDL isn't transactional in MySQL, so a rerun after a partial failure must skip finished steps
+                if e.errno not in ALREADY_APPLIED:
+                    raise
+        db.execute(
+            "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)", (version, description)
+        )
+        applied.append(version)
+    return applied
+
+
+def explain_checks():
+    """(description, query, params, acceptable indexes) for the queries the indexes exist for."""
+    start, end = month_bounds()
+    login_id = 1
+    return [
+        ("user expenses for a month",
+         "SELECT SUM(amount) FROM tbl_expense WHERE login_id = %s AND " + in_range('date'),
+         (login_id, start, end), {'idx_expense_login_date', 'idx_expense_login_category_date'}),
+        ("user expenses per category for a month",
+         "SELECT category_id, SUM(amount) FROM tbl_expense WHERE login_id = %s AND category_id = %s AND "
+         + in_range('date') + " GROUP BY category_id",
+         (login_id, 1, start, end), {'idx_expense_login_category_date'}),
+        ("all expenses for a month",
+         "SELECT login_id, SUM(amount) FROM tbl_expense WHERE " + in_range('date') + " GROUP BY login_id",
+         (start, end), {'idx_expense_date', 'idx_expense_login_date'}),
+        ("additional income for a month",
+         "SELECT SUM(amount) FROM tbl_add_income WHERE login_id = %s AND month = %s",
+         (login_id, start.strftime('%Y-%m')), {'idx_add_income_login_month'}),
+    ]
+
+
+def explain(db):
+    """Run EXPLAIN on each check; returns a list of (description, chosen key, ok)."""
+    results = []
+    for description, query, params, expected in explain_checks():
+        plan = db.fetchall("EXPLAIN " + query, params)
+        keys = {row.get('key') for row in plan if row.get('key')}
+        results.append((description, ', '.join(sorted(keys)) or None, bool(keys & expected)))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['migrate', 'status', 'explain'])
+    parser.add_argument('--target', type=int, help='migrate up to this version only')
+    args = parser.parse_args(argv)
+
+    db = Database()
+    if args.command == 'migrate':
+        applied = migrate(db, args.target)
+        print('Applied: {}'.format(', '.join(map(str, applied)) if applied else 'nothing to do'))
+    elif args.command == 'status':
+        done = applied_versions(db)
+        for version, description, _ in MIGRATIONS:
+            print('{:>4}  {:<8} {}'.format(version, 'applied' if version in done else 'pending', description))
+    else:
+        failed = 0
+        for description, key, ok in explain(db):
+            print('{:<4} {:<45} key={}'.format('ok' if ok else 'FAIL', description, key))
+            failed += not ok
+        return 1 if failed else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""Keyset (cursor) pagination helpers.
+
+A cursor is the sort key of the last row on a page, JSON-encoded and
+base64url'd so clients treat it as an opaque token.
+"""
+import base64
+import json
+from datetime import date
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 500
+
+
+class BadRequest(ValueError):
+    """Invalid pagination / projection parameter; the message is safe to return to the client."""
+
+
+def encode_cursor(values):
+    plain = [v.isoformat() if isinstance(v, date) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(plain, default=str).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, *types):
+    """The values of ``token``; with ``types`` (one type or tuple of types per value) their shape is checked too."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise BadRequest('Invalid cursor')
+    if not isinstance(values, list):
+        raise BadRequest('Invalid cursor')
+    if types and (len(values) != len(types) or not all(
+            isinstance(value, kind) and not isinstance(value, bool) for value, kind in zip(values, types))):
+        raise BadRequest('Invalid cursor')
+    return values
+
+
+def parse_limit(value, default=DEFAULT_LIMIT, maximum=MAX_LIMIT):
+    if value in (None, ''):
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise BadRequest('limit must be an integer')
+    if limit < 1:
+        raise BadRequest('limit must be positive')
+    return min(limit, maximum)
+
+
+def parse_int(value, name):
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise BadRequest('{} must be an integer'.format(name))
+
+
+def parse_fields(value, allowed):
+    """Comma-separated ``fields=`` projection, validated against ``allowed`` (None means all)."""
+    if not value:
+        return None
+    fields = [f.strip() for f in value.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in allowed]
+    if unknown:
+        raise BadRequest('Unknown field(s): {}'.format(', '.join(unknown)))
+    return fields
+
+
+def parse_date(value, name):
+    if value in (None, ''):
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise BadRequest('{} must be YYYY-MM-DD'.format(name))
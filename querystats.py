@@ -0,0 +1,176 @@
+"""Per-statement timing for Database: fingerprints, latency stats, slow-query log, per-request counts.
+
+Every statement run through a pooled connection is timed and filed under its
+fingerprint (the SQL with literals, placeholders and IN / VALUES lists
+normalised), so the same query with different arguments aggregates together.
+Statements slower than DB_SLOW_QUERY_MS go to the ``slow_queries`` logger
+(and to DB_SLOW_QUERY_LOG when set). Inside a request scope the statements
+are also counted per request; one fingerprint repeated DB_N_PLUS_ONE times or
+more in a single request is reported as a likely N+1.
+"""
+import contextvars
+import logging
+import os
+import re
+import threading
+from collections import Counter, deque
+from functools import lru_cache
+
+SLOW_QUERY_MS = float(os.environ.get('DB_SLOW_QUERY_MS', 200))
+SLOW_QUERY_LOG = os.environ.get('DB_SLOW_QUERY_LOG')
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('DB_N_PLUS_ONE', 10))
+SAMPLES = 1024  # latest durations kept per fingerprint for the percentiles
+
+slow_log = logging.getLogger('slow_queries')
+if SLOW_QUERY_LOG:
+    _handler = logging.FileHandler(SLOW_QUERY_LOG)
+    _handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    slow_log.addHandler(_handler)
+    slow_log.setLevel(logging.WARNING)
+log = logging.getLogger(__name__)
+
+_COMMENTS = re.compile(r'/\*.*?\*/|--[^\n]*', re.S)
+_STRINGS = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBERS = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_PLACEHOLDERS = re.compile(r'%s|%\(\w+\)s')
+_TUPLE = r'\(\s*\?(?:\s*,\s*\?)*\s*\)'
+_VALUES_LIST = re.compile(r'({0})(?:\s*,\s*{0})+'.format(_TUPLE))
+_IN_LIST = re.compile(r'\bIN\s*' + _TUPLE, re.I)
+_SPACES = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(sql):
+    """``sql`` with every literal / placeholder as ``?`` and variable-length lists collapsed."""
+    text = _COMMENTS.sub(' ', sql)
+    text = _STRINGS.sub('?', text)
+    text = _PLACEHOLDERS.sub('?', text)
+    text = _NUMBERS.sub('?', text)
+    text = _IN_LIST.sub('IN (?+)', text)
+    text = _VALUES_LIST.sub(r'\1', text)
+    return _SPACES.sub(' ', text).strip()
+
+
+def _percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class _Entry:
+    __slots__ = ('count', 'errors', 'total', 'max', 'samples')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=SAMPLES)
+
+
+class RequestScope:
+    """Statements run while handling one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.by_fingerprint = Counter()
+        self._lock = threading.Lock()   # concurrent fan-out queries report from several threads
+
+    def add(self, fp, seconds):
+        with self._lock:
+            self.count += 1
+            self.seconds += seconds
+            self.by_fingerprint[fp] += 1
+
+    def repeated(self, threshold=N_PLUS_ONE_THRESHOLD):
+        """[(fingerprint, times)] run at least ``threshold`` times in this request."""
+        return [(fp, n) for fp, n in self.by_fingerprint.most_common() if n >= threshold]
+
+    def server_timing(self):
+        return 'db;dur={:.1f};desc="{} queries"'.format(self.seconds * 1000, self.count)
+
+
+_scope = contextvars.ContextVar('query_scope', default=None)
+
+
+def begin_request():
+    """Start counting statements for the current request; pass the result to ``end_request``."""
+    return _scope.set(RequestScope())
+
+
+def end_request(token):
+    scope = _scope.get()
+    _scope.reset(token)
+    return scope
+
+
+class QueryStats:
+    """Thread-safe per-fingerprint statement statistics, shared by every connection of a pool."""
+
+    def __init__(self, slow_ms=SLOW_QUERY_MS):
+        self.slow_ms = slow_ms
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._slow = 0
+        self._n_plus_one = Counter()
+
+    def observe(self, sql, seconds, failed=False):
+        fp = fingerprint(sql)
+        with self._lock:
+            entry = self._entries.get(fp)
+            if entry is None:
+                entry = self._entries[fp] = _Entry()
+            entry.count += 1
+            entry.errors += failed
+            entry.total += seconds
+            entry.max = max(entry.max, seconds)
+            entry.samples.append(seconds)
+            slow = seconds * 1000 >= self.slow_ms
+            self._slow += slow
+        scope = _scope.get()
+        if scope is not None:
+            scope.add(fp, seconds)
+        if slow:
+            slow_log.warning('%.1f ms %s', seconds * 1000, fp)
+
+    def check_request(self, endpoint, scope, threshold=N_PLUS_ONE_THRESHOLD):
+        """Record and log the fingerprints ``scope`` repeated often enough to look like N+1."""
+        repeated = scope.repeated(threshold)
+        if not repeated:
+            return repeated
+        with self._lock:
+            for fp, _ in repeated:
+                self._n_plus_one[(endpoint, fp)] += 1
+        for fp, times in repeated:
+            log.warning('possible N+1 in %s: %d x %s', endpoint, times, fp)
+        return repeated
+
+    def snapshot(self, limit=50):
+        """Top ``limit`` fingerprints by total time, plus the N+1 suspects seen so far."""
+        with self._lock:
+            items = [(fp, e.count, e.errors, e.total, e.max, sorted(e.samples)) for fp, e in self._entries.items()]
+            slow = self._slow
+            n_plus_one = [{'endpoint': endpoint, 'fingerprint': fp, 'requests': n}
+                          for (endpoint, fp), n in self._n_plus_one.most_common()]
+        items.sort(key=lambda item: item[3], reverse=True)
+        return {
+            'statements': sum(item[1] for item in items),
+            'slow': slow,
+            'slow_threshold_ms': self.slow_ms,
+            'fingerprints': [{
+                'fingerprint': fp,
+                'count': count,
+                'errors': errors,
+                'total_ms': round(total * 1000, 3),
+                'avg_ms': round(total * 1000 / count, 3),
+                'p50_ms': round(_percentile(ordered, 0.5) * 1000, 3),
+                'p99_ms': round(_percentile(ordered, 0.99) * 1000, 3),
+                'max_ms': round(maximum * 1000, 3),
+            } for fp, count, errors, total, maximum, ordered in items[:limit]],
+            'n_plus_one': n_plus_one,
+        }
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+            self._slow = 0
+            self._n_plus_one.clear()
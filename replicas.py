@@ -0,0 +1,233 @@
+"""Read-replica routing for config.Database, with read-your-writes per user.
+
+Set DB_REPLICAS=host[:port],... (same user / password / database as the
+primary) and Database sends plain reads (SELECT / WITH / SHOW outside a
+transaction, without FOR UPDATE / FOR SHARE) to a replica and everything else
+to the primary.
+
+Reads stay on the primary for a user who has just written: app.py tags each
+request with a session key (the user in the URL, or the admin session) and
+writes remember when that key last wrote. A background thread reads each
+replica's lag (SHOW REPLICA STATUS) every DB_REPLICA_LAG_CHECK seconds; a
+replica gets a key's reads again once a lag check taken after the write shows
+the write must have been applied. Replicas behind by more than
+DB_REPLICA_MAX_LAG seconds, or not replicating at all, get no reads; neither
+does one that just failed a query (it is retried on the primary).
+DB_REPLICA_MAX_LAG=-1 skips the lag check (e.g. two unrelated local servers
+for testing), then a key reads from the primary for LAG_SLACK seconds after
+writing.
+
+The recent-writer map is per process. With several workers, a user whose read
+lands on a different worker than the write can still see replica lag, unless
+the load balancer keeps users on one worker.
+
+Usage:
+    python replicas.py status   lag and routing state of each DB_REPLICAS entry
+"""
+import argparse
+import contextvars
+import functools
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+REPLICAS = [spec.strip() for spec in os.environ.get('DB_REPLICAS', '').split(',') if spec.strip()]
+MAX_LAG = float(os.environ.get('DB_REPLICA_MAX_LAG', 5))       # seconds; -1 turns the lag check off
+LAG_CHECK = float(os.environ.get('DB_REPLICA_LAG_CHECK', 1))   # seconds between lag checks
+LAG_SLACK = 1.0          # Seconds_Behind_Source is in whole seconds
+RECENT_WRITERS = 100000  # keys remembered; the oldest writers are forgotten first
+LOCKING = ('FOR UPDATE', 'FOR SHARE', 'LOCK IN SHARE MODE')
+
+log = logging.getLogger(__name__)
+
+_key = contextvars.ContextVar('db_session_key', default=None)
+
+
+def begin_request(key):
+    """Attribute this context's queries to ``key`` (e.g. ('user', 5)); pass the result to ``end_request``."""
+    return _key.set(key)
+
+
+def end_request(token):
+    _key.reset(token)
+
+
+@functools.lru_cache(maxsize=2048)
+def is_read(query):
+    """Whether ``query`` may run on a replica."""
+    if query.lstrip()[:6].upper().rstrip() not in ('SELECT', 'WITH', 'SHOW'):
+        return False
+    upper = query.upper()
+    return not any(clause in upper for clause in LOCKING)
+
+
+def parse_spec(spec):
+    """'host[:port]' -> {'host', 'port'} connection overrides."""
+    host, _, port = spec.partition(':')
+    return dict(host=host, port=int(port)) if port else dict(host=host)
+
+
+def replica_lag(conn):
+    """Seconds the replica behind ``conn`` is behind its source; None when it is not replicating."""
+    try:
+        row = conn.run("SHOW REPLICA STATUS", None, 'one')
+    except Exception:
+        row = conn.run("SHOW SLAVE STATUS", None, 'one')   # before MySQL 8.0.22
+    if not row:
+        return None
+    lag = row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+    return float(lag) if lag is not None else None
+
+
+class Replica:
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        self.lag = None          # seconds, from the last successful check
+        self.checked_at = None   # monotonic time of that check
+        self.error = None
+        self.reads = 0
+
+    def usable(self, max_lag, last_write, now):
+        """Whether this replica may serve a read for a key that last wrote at ``last_write`` (or never)."""
+        if self.error is not None:
+            return False
+        if max_lag < 0:
+            return last_write is None or now - last_write > LAG_SLACK
+        if self.lag is None or self.lag > max_lag:
+            return False
+        # At checked_at the replica had applied everything committed before checked_at - lag
+        return last_write is None or last_write + self.lag + LAG_SLACK < self.checked_at
+
+    def check(self):
+        started = time.monotonic()   # the lag holds as of when it was asked for, not when the answer arrived
+        with self.pool.connection() as conn:
+            lag = replica_lag(conn)
+        self.lag, self.checked_at, self.error = lag, started, None
+        if lag is None:
+            self.error = 'not replicating'
+        return lag
+
+
+class ReplicaRouter:
+    """Picks a replica for each read and remembers which session keys wrote recently."""
+
+    def __init__(self, replicas, max_lag=MAX_LAG, check_every=LAG_CHECK):
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.check_every = check_every
+        self.primary_reads = 0
+        self._writes = OrderedDict()   # session key -> monotonic time of its last write
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def wrote(self):
+        """Note that the current session key just wrote (call after the write committed)."""
+        key = _key.get()
+        with self._lock:
+            self._writes[key] = time.monotonic()
+            self._writes.move_to_end(key)
+            while len(self._writes) > RECENT_WRITERS:
+                self._writes.popitem(last=False)
+
+    def choose(self):
+        """A replica for a read by the current session key, or None to read from the primary."""
+        self.start()
+        key = _key.get()
+        now = time.monotonic()
+        with self._lock:
+            last_write = self._writes.get(key)
+            candidates = [replica for replica in self.replicas if replica.usable(self.max_lag, last_write, now)]
+            # The counters are bumped under the lock too: many request threads choose at once
+            if not candidates:
+                self.primary_reads += 1
+                return None
+            replica = random.choice(candidates)
+            replica.reads += 1
+            return replica
+
+    def failed(self, replica, error):
+        """Take ``replica`` out of rotation until its next successful lag check."""
+        replica.error = str(error) or type(error).__name__
+        log.warning("Replica %s failed, reading from the primary: %s", replica.name, replica.error)
+
+    def check(self):
+        for replica in self.replicas:
+            try:
+                replica.check()
+            except Exception as e:
+                replica.error = str(e) or type(e).__name__
+
+    def start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='replica-lag', daemon=True)
+                    self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            if self.max_lag >= 0:
+                self.check()
+            else:
+                # No lag to read; just bring failed replicas back once they answer again
+                for replica in self.replicas:
+                    if replica.error is not None:
+                        try:
+                            with replica.pool.connection() as conn:
+                                conn.run("SELECT 1", None, 'one')
+                            replica.error = None
+                        except Exception as e:
+                            replica.error = str(e) or type(e).__name__
+            self._stopped.wait(self.check_every)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            recent = len(self._writes)
+            primary_reads = self.primary_reads
+            reads = [replica.reads for replica in self.replicas]
+        return {
+            'max_lag': self.max_lag,
+            'primary_reads': primary_reads,
+            'recent_writers': recent,
+            'replicas': [{
+                'name': replica.name,
+                'lag': replica.lag,
+                'checked_ago': round(now - replica.checked_at, 3) if replica.checked_at is not None else None,
+                'usable': replica.usable(self.max_lag, None, now),
+                'reads': replica_reads,
+                'error': replica.error,
+                'pool': replica.pool.stats(),
+            } for replica, replica_reads in zip(self.replicas, reads)],
+        }
+
+
+def main(argv=None):
+    from config import Database
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['status'])
+    parser.parse_args(argv)
+
+    db = Database()
+    if db.replicas is None:
+        print('DB_REPLICAS is not set; every query goes to the primary')
+        return 1
+    db.replicas.check()
+    for replica in db.replica_stats()['replicas']:
+        print('{name}: lag={lag} usable={usable} error={error}'.format(**replica))
+    return 0 if all(replica.error is None for replica in db.replicas.replicas) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
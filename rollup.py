@@ -0,0 +1,147 @@
+"""Per-user monthly expense rollup (tbl_expense_monthly).
+
+One row per (login_id, category_id, year, month, source) holding the summed
+amount and the number of expense rows. The expense write routes keep it in
+step inside the same transaction as the tbl_expense change, so the mobile
+read endpoints aggregate O(months x categories) rows instead of every expense.
+
+Usage:
+    python rollup.py verify [--user ID] [--fix]   compare the rollup with tbl_expense
+    python rollup.py rebuild [--user ID]          recompute the rollup from tbl_expense
+"""
+import argparse
+import sys
+from datetime import date, datetime
+
+import versions
+from config import Database
+
+
+RAW_GROUPED = (
+    "SELECT login_id, category_id, YEAR(date) AS year, MONTH(date) AS month, COALESCE(source, '') AS source, "
+    "SUM(amount) AS total, COUNT(*) AS cnt "
+    "FROM tbl_expense {where} "
+    "GROUP BY login_id, category_id, YEAR(date), MONTH(date), COALESCE(source, '')"
+)
+
+UPSERT = (
+    "INSERT INTO tbl_expense_monthly (login_id, category_id, year, month, source, total, cnt) "
+    "VALUES (%s, %s, %s, %s, %s, %s, %s) "
+    "ON DUPLICATE KEY UPDATE total = total + VALUES(total), cnt = cnt + VALUES(cnt)"
+)
+
+
+def as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def key_of(row):
+    """Rollup key for a tbl_expense row."""
+    day = as_date(row['date'])
+    return (row['login_id'], row['category_id'], day.year, day.month, row.get('source') or '')
+
+
+def _add(tx, key, amount, count):
+    tx.execute(UPSERT, key + (amount, count))
+    if count < 0:
+        tx.execute(
+            "DELETE FROM tbl_expense_monthly "
+            "WHERE login_id = %s AND category_id = %s AND year = %s AND month = %s AND source = %s AND cnt <= 0",
+            key
+        )
+
+
+def apply_change(tx, old, new):
+    """Move ``old`` out of and ``new`` into the rollup. Either may be None (insert / delete)."""
+    old_key = key_of(old) if old else None
+    new_key = key_of(new) if new else None
+    if old_key is not None and old_key == new_key:
+        if new['amount'] != old['amount']:
+            tx.execute(UPSERT, new_key + (new['amount'] - old['amount'], 0))
+        return
+    if old_key is not None:
+        _add(tx, old_key, -old['amount'], -1)
+    if new_key is not None:
+        _add(tx, new_key, new['amount'], 1)
+
+
+def apply_rows(tx, rows):
+    """Add many new tbl_expense rows at once, folded into one upsert per rollup key."""
+    deltas = {}
+    for row in rows:
+        key = key_of(row)
+        total, count = deltas.get(key, (0, 0))
+        deltas[key] = (total + row['amount'], count + 1)
+    tx.insert_many(
+        'tbl_expense_monthly', ('login_id', 'category_id', 'year', 'month', 'source', 'total', 'cnt'),
+        [key + delta for key, delta in deltas.items()],
+        on_duplicate='total = total + VALUES(total), cnt = cnt + VALUES(cnt)'
+    )
+
+
+def rebuild(db, login_id=None):
+    """Recompute the rollup from tbl_expense, for one user or everyone."""
+    user_filter = "WHERE login_id = %s" if login_id is not None else ""
+    params = (login_id,) if login_id is not None else ()
+    with db.transaction() as tx:
+        tx.execute("DELETE FROM tbl_expense_monthly " + user_filter, params)
+        tx.execute(
+            "INSERT INTO tbl_expense_monthly (login_id, category_id, year, month, source, total, cnt) "
+            + RAW_GROUPED.format(where=user_filter),
+            params
+        )
+        versions.bump(tx, versions.user_scope(login_id) if login_id is not None else versions.GLOBAL)
+
+
+def verify(db, login_id=None):
+    """Return the rollup keys whose total/count disagree with tbl_expense."""
+    user_filter = "WHERE login_id = %s" if login_id is not None else ""
+    params = (login_id,) if login_id is not None else ()
+    raw = RAW_GROUPED.format(where=user_filter)
+    join = ("r.login_id = m.login_id AND r.category_id = m.category_id AND r.year = m.year "
+            "AND r.month = m.month AND r.source = m.source")
+    return db.fetchall(
+        "SELECT r.login_id, r.category_id, r.year, r.month, r.source, r.total AS raw_total, r.cnt AS raw_cnt, "
+        "m.total AS rollup_total, m.cnt AS rollup_cnt "
+        "FROM (" + raw + ") r LEFT JOIN tbl_expense_monthly m ON " + join + " "
+        "WHERE m.login_id IS NULL OR m.total <> r.total OR m.cnt <> r.cnt "
+        "UNION ALL "
+        "SELECT m.login_id, m.category_id, m.year, m.month, m.source, NULL, NULL, m.total, m.cnt "
+        "FROM tbl_expense_monthly m LEFT JOIN (" + raw + ") r ON " + join + " "
+        "WHERE r.login_id IS NULL" + (" AND m.login_id = %s" if login_id is not None else ""),
+        params * 3
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['verify', 'rebuild'])
+    parser.add_argument('--user', type=int, help='only this login_id')
+    parser.add_argument('--fix', action='store_true', help='rebuild the users that fail verification')
+    args = parser.parse_args(argv)
+
+    db = Database()
+    if args.command == 'rebuild':
+        rebuild(db, args.user)
+        print('Rollup rebuilt' + (' for user {}'.format(args.user) if args.user is not None else ''))
+        return 0
+
+    mismatches = verify(db, args.user)
+    for row in mismatches:
+        print('{login_id} cat={category_id} {year}-{month:02d} source={source!r}: '
+              'raw={raw_total}/{raw_cnt} rollup={rollup_total}/{rollup_cnt}'.format(**row))
+    if mismatches and args.fix:
+        for login_id in sorted({row['login_id'] for row in mismatches}):
+            rebuild(db, login_id)
+        print('Rebuilt {} user(s)'.format(len({row['login_id'] for row in mismatches})))
+        return 0
+    print('{} mismatching rollup row(s)'.format(len(mismatches)))
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
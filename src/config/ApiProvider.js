@@ -2,6 +2,35 @@
 import axios from 'axios';
 import API_URL from './config';
 
+// Conditional GETs: remember each response's ETag and body, send If-None-Match on the next
+// request to the same URL and reuse the cached body when the server answers 304 Not Modified.
+const etagCache = new Map();
+
+axios.interceptors.request.use((config) => {
+  if ((config.method || 'get').toLowerCase() === 'get') {
+    const cached = etagCache.get(axios.getUri(config));
+    if (cached) {
+      config.headers = { ...config.headers, 'If-None-Match': cached.etag };
+    }
+    config.validateStatus = (status) => (status >= 200 && status < 300) || status === 304;
+  }
+  return config;
+});
+
+axios.interceptors.response.use((response) => {
+  if ((response.config.method || 'get').toLowerCase() !== 'get') {
+    return response;
+  }
+  const key = axios.getUri(response.config);
+  if (response.status === 304 && etagCache.has(key)) {
+    return { ...response, status: 200, data: etagCache.get(key).data };
+  }
+  if (response.headers?.etag) {
+    etagCache.set(key, { etag: response.headers.etag, data: response.data });
+  }
+  return response;
+});
+
 const ApiProvider = {
   // Fetch user data (including salary)
   getUser: async (userId) => {
@@ -171,6 +200,16 @@ const ApiProvider = {
       throw error.response?.data?.error || 'Failed to fetch notifications';
     }
   },
+
+  // Mark due advance payments as seen so they are not returned again (all due ones when ids is omitted).
+  ackNotifications: async (userId, ids = undefined) => {
+    try {
+      const response = await axios.post(`${API_URL}/notifications/${userId}/ack`, ids ? { ids } : {});
+      return response.data;
+    } catch (error) {
+      throw error.response?.data?.error || 'Failed to acknowledge notifications';
+    }
+  },
   addSuggestion: async (userId) => {
     try {
       const response = await axios.post(`${API_URL}/suggestion/${userId}`);
@@ -377,6 +416,108 @@ const ApiProvider = {
     }
   },
 
+  // Bulk import: expenses is an array of { category_id | category, amount, details, source, date }
+  importExpenses: async (userId, expenses) => {
+    try {
+      const response = await axios.post(`${API_URL}/expense/${userId}/bulk`, expenses);
+      return response.data;
+    } catch (error) {
+      throw error.response?.data?.error || 'Failed to import expenses';
+    }
+  },
+
+  // One page of expenses, newest first. Pass the returned nextCursor back as params.cursor;
+  // it is null on the last page. Optional params: limit, fields, from, to, category_id, source.
+  getExpensesPage: async (userId, params = {}) => {
+    try {
+      const response = await axios.get(`${API_URL}/expense/${userId}`, { params });
+      return { items: response.data, nextCursor: response.headers['x-next-cursor'] || null };
+    } catch (error) {
+      throw error.response?.data?.error || 'Failed to fetch expenses';
+    }
+  },
+
+  // Full history as NDJSON (default) or CSV text, for sharing / backups. params: format, from, to.
+  exportExpenses: async (userId, params = {}) => {
+    try {
+      const response = await axios.get(`${API_URL}/expense/${userId}/export`, { params, responseType: 'text' });
+      return response.data;
+    } catch (error) {
+      throw error.response?.data?.error || 'Failed to export expenses';
+    }
+  },
+
+  // Home/report screen data in one request. sections: any of summary, by_category, progressbar,
+  // trends, additional_income_sum, priority_vs_spending (default: all).
+  getHomeBundle: async (userId, sections = []) => {
+    try {
+      const params = sections.length ? { sections: sections.join(',') } : {};
+      const response = await axios.get(`${API_URL}/user/${userId}/home-bundle`, { params });
+      return response.data;
+    } catch (error) {
+      console.error('Get home bundle error:', error.response?.data || error.message);
+      throw error.response?.data?.error || 'Failed to fetch home data';
+    }
+  },
+
+  // Delta sync. Call without a token to get the starting token (before loading full lists),
+  // then with it to receive { token, has_more, expense, priority, income } where each entity
+  // is { upserted: [rows], deleted: [ids] }.
+  getChanges: async (userId, since = null, limit = undefined) => {
+    try {
+      const params = {};
+      if (since) params.since = since;
+      if (limit) params.limit = limit;
+      const response = await axios.get(`${API_URL}/user/${userId}/changes`, { params });
+      return response.data;
+    } catch (error) {
+      throw error.response?.data?.error || 'Failed to fetch changes';
+    }
+  },
+
+  // Budget threshold alerts (50/80/100% of this month's suggestion), oldest first. Pass the last seen id as since.
+  getBudgetAlerts: async (userId, since = 0) => {
+    try {
+      const response = await axios.get(`${API_URL}/user/${userId}/budget-alerts`, { params: { since } });
+      return response.data;
+    } catch (error) {
+      throw error.response?.data?.error || 'Failed to fetch budget alerts';
+    }
+  },
+
+  // Totals over any range: { from, to (YYYY-MM-DD, inclusive), granularity: day|week|month|year,
+  // group_by: 'category,source', category, source }. Returns { rows: [{ period, ..., total, count }], total, count }.
+  getAnalytics: async (userId, query = {}) => {
+    try {
+      const response = await axios.get(`${API_URL}/user/${userId}/analytics`, { params: query });
+      return response.data;
+    } catch (error) {
+      throw error.response?.data?.error || 'Failed to fetch analytics';
+    }
+  },
+
+  // Push feed instead of polling: long-polls /events/poll and calls onEvent({ type, op, id, seq, ... })
+  // for every expense / income / priority / suggestions write. Returns a function that stops it.
+  watchEvents: (userId, onEvent) => {
+    let stopped = false;
+    let since = null;
+    const loop = async () => {
+      while (!stopped) {
+        try {
+          const params = since ? { since, timeout: 25 } : { timeout: 25 };
+          const response = await axios.get(`${API_URL}/user/${userId}/events/poll`, { params, timeout: 35000 });
+          since = response.data.last_seq;
+          if (!stopped) response.data.events.forEach(onEvent);
+        } catch (error) {
+          // Server restarting or offline: back off before the next attempt
+          await new Promise((resolve) => setTimeout(resolve, 5000));
+        }
+      }
+    };
+    loop();
+    return () => { stopped = true; };
+  },
+
 };
 
 export default ApiProvider;
\ No newline at end of file
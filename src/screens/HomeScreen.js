@@ -38,13 +38,14 @@ const HomeScreen = ({ route, navigation }) => {
         }
         setUserId(storedUserId);
 
-        const [summary, progressData, expenses, priorities, priorityVsSpending] = await Promise.all([
-          ApiProvider.getUserSummary(storedUserId),
-          ApiProvider.getProgressBar(storedUserId),
+        const [bundle, expenses, priorities] = await Promise.all([
+          ApiProvider.getHomeBundle(storedUserId, ['summary', 'progressbar', 'priority_vs_spending']),
           ApiProvider.getExpenses(storedUserId),
           ApiProvider.getPriorities(storedUserId),
-          ApiProvider.getPriorityVsSpending(storedUserId),
         ]);
+        const summary = bundle.summary || {};
+        const progressData = bundle.progressbar;
+        const priorityVsSpending = bundle.priority_vs_spending;
 
         setFixedSalary(summary.fixed_salary ?? 0);
         setAdditionalIncome(summary.additional_income ?? 0);
@@ -64,6 +65,27 @@ const HomeScreen = ({ route, navigation }) => {
     initializeUserData();
   }, [navigation]);
 
+  // Totals change only when the user's data does: reload on pushed events rather than on a timer
+  useEffect(() => {
+    if (!userId) return undefined;
+    return ApiProvider.watchEvents(userId, async (event) => {
+      if (!['expense', 'income', 'priority'].includes(event.type)) return;
+      try {
+        const bundle = await ApiProvider.getHomeBundle(userId, ['summary', 'progressbar', 'priority_vs_spending']);
+        const summary = bundle.summary || {};
+        setFixedSalary(summary.fixed_salary ?? 0);
+        setAdditionalIncome(summary.additional_income ?? 0);
+        setTotalIncome(summary.total_income ?? 0);
+        setTotalExpenses(summary.total_expenses ?? 0);
+        setBalance(summary.balance ?? 0);
+        setProgressData(Array.isArray(bundle.progressbar) ? bundle.progressbar : []);
+        setPriorityVsSpending(Array.isArray(bundle.priority_vs_spending) ? bundle.priority_vs_spending : []);
+      } catch (error) {
+        console.error('Error refreshing home data:', error);
+      }
+    });
+  }, [userId]);
+
   const handleUpdateSalary = async () => {
     if (!editSalary || isNaN(editSalary) || Number(editSalary) < 0) {
       alert('Please enter a valid salary');
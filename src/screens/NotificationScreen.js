@@ -27,6 +27,7 @@ const NotificationScreen = ({ route, navigation }) => {
         }
         const notificationData = await ApiProvider.getNotifications(effectiveUserId);
         groupNotificationsByDate(notificationData);
+        acknowledge(effectiveUserId, notificationData);
       } catch (error) {
         console.error('Error fetching notifications:', error);
         alert('Failed to load notifications: ' + error.message);
@@ -37,6 +38,29 @@ const NotificationScreen = ({ route, navigation }) => {
     fetchUserIdAndNotifications();
   }, [userId, navigation]);
 
+  // Shown once: acknowledged items are not returned by the next fetch
+  const acknowledge = (id, data) => {
+    const ids = (Array.isArray(data) ? data : []).map((item) => item.id);
+    if (ids.length) {
+      ApiProvider.ackNotifications(id, ids).catch((error) => console.error('Error acknowledging notifications:', error));
+    }
+  };
+
+  // Refetch when an expense changes or a payment falls due instead of polling
+  useEffect(() => {
+    if (!userId) return undefined;
+    return ApiProvider.watchEvents(userId, async (event) => {
+      if (event.type !== 'expense' && !(event.type === 'notification' && event.op === 'due')) return;
+      try {
+        const notificationData = await ApiProvider.getNotifications(userId);
+        groupNotificationsByDate(notificationData);
+        acknowledge(userId, notificationData);
+      } catch (error) {
+        console.error('Error refreshing notifications:', error);
+      }
+    });
+  }, [userId]);
+
   const groupNotificationsByDate = (data) => {
     // Use local date instead of UTC
     const today = new Date();
@@ -98,14 +98,10 @@ const ReportScreen = ({ route, navigation }) => {
   const fetchData = async () => {
     try {
       setLoading(true);
-      const [categoryData, priorityData, trendData] = await Promise.all([
-        ApiProvider.getExpensesByCategory(userId),
-        ApiProvider.getPriorityVsSpending(userId),
-        ApiProvider.getMonthlyExpenseTrends(userId),
-      ]);
-      setCategoryExpenses(categoryData || []);
-      setPriorityVsSpending(priorityData || []);
-      setTrends(trendData || []);
+      const bundle = await ApiProvider.getHomeBundle(userId, ['by_category', 'priority_vs_spending', 'trends']);
+      setCategoryExpenses(bundle.by_category || []);
+      setPriorityVsSpending(bundle.priority_vs_spending || []);
+      setTrends(bundle.trends || []);
     } catch (error) {
       console.error('Error fetching report data:', error);
       alert('Failed to load report data');
@@ -0,0 +1,208 @@
+"""Recompute tbl_suggestions for every user in tbl_user for one month.
+
+Users are streamed from the database in login_id order, in chunks, and the
+chunks are spread over a process pool. Each worker loads the inputs for its
+whole chunk with a handful of IN (...) queries, computes the suggestions with
+the same rules as POST /api/suggestion/<user_id>, and writes them back with
+one DELETE plus multi-row INSERTs.
+
+Progress is checkpointed to a JSON file: the highest login_id below which
+every chunk has finished. After a crash, rerunning the same command resumes
+from there (chunks that finished out of order past the checkpoint are simply
+recomputed).
+
+Usage:
+    python suggestion_job.py [--month March] [--year 2025] [--workers 4] [--chunk-size 500]
+                             [--checkpoint suggestion_job.checkpoint.json] [--restart]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+
+import events
+import forecast_state
+import suggestions as suggestion_rules
+from config import Database
+
+
+_worker_db = None
+
+
+def _init_worker():
+    global _worker_db
+    # Each process gets its own pool; connections can't cross a fork
+    _worker_db = Database(size=1)
+
+
+def _in(ids):
+    return ', '.join(['%s'] * len(ids))
+
+
+def load_chunk_inputs(db, login_ids):
+    """Priorities, per-category totals, forecast states and income for every user in ``login_ids``."""
+    ids = tuple(login_ids)
+    priorities = db.fetchall(
+        "SELECT p.login_id, p.priority, c.category_name, c.id as category_id "
+        "FROM tbl_priority p INNER JOIN tbl_category c ON p.category_id = c.id "
+        "WHERE p.login_id IN ({})".format(_in(ids)), ids
+    )
+    expenses = db.fetchall(
+        "SELECT m.login_id, m.category_id, c.category_name, SUM(m.total) as total_amount "
+        "FROM tbl_expense_monthly m INNER JOIN tbl_category c ON m.category_id = c.id "
+        "WHERE m.login_id IN ({}) GROUP BY m.login_id, m.category_id, c.category_name".format(_in(ids)), ids
+    )
+    states = db.fetchall(
+        "SELECT login_id, category_id, n, sum_x, sum_xx, sum_y, sum_xy "
+        "FROM tbl_forecast_state WHERE login_id IN ({})".format(_in(ids)), ids
+    )
+    incomes = db.fetchall(
+        "SELECT u.login_id, (IFNULL(a.total, 0) + IFNULL(u.salary, 0)) AS total_amount "
+        "FROM tbl_user u LEFT JOIN ("
+        "  SELECT login_id, SUM(amount) AS total FROM tbl_add_income WHERE login_id IN ({0}) GROUP BY login_id"
+        ") a ON a.login_id = u.login_id "
+        "WHERE u.login_id IN ({0})".format(_in(ids)), ids + ids
+    )
+
+    by_user = defaultdict(lambda: {'priorities': [], 'expenses': [], 'states': [], 'income': 0})
+    for key, rows in (('priorities', priorities), ('expenses', expenses), ('states', states)):
+        for row in rows:
+            by_user[row['login_id']][key].append(row)
+    for row in incomes:
+        by_user[row['login_id']]['income'] = row['total_amount'] or 0
+    return by_user
+
+
+def process_chunk(login_ids, month, year, target):
+    """Worker entry point. Returns (users processed, users with suggestions written, suggestion rows)."""
+    db = _worker_db
+    inputs = load_chunk_inputs(db, login_ids)
+    written_users = []
+    rows = []
+    for login_id in login_ids:
+        data = inputs.get(login_id)
+        # Same preconditions as the API: priorities and positive income are required
+        if not data or not data['priorities'] or float(data['income']) <= 0:
+            continue
+        forecasts = forecast_state.forecasts(
+            data['states'], [p['category_id'] for p in data['priorities']], target
+        )
+        rows.extend(suggestion_rules.compute(
+            login_id, data['priorities'], data['expenses'], data['income'], forecasts, month, year
+        ))
+        written_users.append(login_id)
+
+    with db.transaction() as tx:
+        suggestion_rules.replace(tx, written_users, month, year, rows)
+    if events.shared():   # an in-process broker here would reach no HTTP worker
+        events.publish_many(written_users, {'type': 'suggestions', 'month': month, 'year': year})
+    return len(login_ids), len(written_users), len(rows)
+
+
+def user_chunks(db, after, chunk_size):
+    """Yield lists of login_ids > ``after`` using keyset pagination, so memory stays per-chunk."""
+    while True:
+        rows = db.fetchall(
+            "SELECT login_id FROM tbl_user WHERE login_id > %s ORDER BY login_id LIMIT %s", (after, chunk_size)
+        )
+        if not rows:
+            return
+        chunk = [row['login_id'] for row in rows]
+        yield chunk
+        after = chunk[-1]
+
+
+def read_checkpoint(path, month, year):
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        state = json.load(f)
+    if state.get('month') != month or state.get('year') != year:
+        return 0
+    return state.get('last_login_id', 0)
+
+
+def write_checkpoint(path, month, year, last_login_id, users_done):
+    if not path:
+        return
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'month': month, 'year': year, 'last_login_id': last_login_id,
+                   'users_done': users_done, 'updated_at': datetime.now().isoformat()}, f)
+    os.replace(tmp, path)
+
+
+def run(month, year, workers=None, chunk_size=500, checkpoint=None, restart=False, out=sys.stderr):
+    db = Database(size=2)
+    target = year * 12 + datetime.strptime(month, '%B').month + 1
+    start_after = 0 if restart else read_checkpoint(checkpoint, month, year)
+    total = db.fetchone("SELECT COUNT(*) AS count FROM tbl_user WHERE login_id > %s", (start_after,))['count']
+    if start_after:
+        print('Resuming after login_id {}'.format(start_after), file=out)
+    if not events.shared():
+        print('EVENTS_BROKER is not Redis: connected clients are not told about the new suggestions', file=out)
+
+    workers = workers or os.cpu_count() or 1
+    started = time.monotonic()
+    users_done = written = suggestion_rows = 0
+    watermark = start_after
+    pending = {}          # future -> (first login_id, last login_id)
+    finished = {}         # first login_id -> last login_id, completed out of order
+    order = deque()       # chunk starts in submission order
+
+    def drain():
+        nonlocal users_done, written, suggestion_rows, watermark
+        done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+        for future in done:
+            first, last = pending.pop(future)
+            processed, users, count = future.result()
+            users_done += processed
+            written += users
+            suggestion_rows += count
+            finished[first] = last
+        # Advance the checkpoint over the contiguous prefix of finished chunks
+        while order and order[0] in finished:
+            watermark = finished.pop(order.popleft())
+        write_checkpoint(checkpoint, month, year, watermark, users_done)
+        elapsed = time.monotonic() - started
+        rate = users_done / elapsed if elapsed else 0
+        eta = (total - users_done) / rate if rate else 0
+        print('{}/{} users ({:.0f}/s, eta {:.0f}s), {} with suggestions'.format(
+            users_done, total, rate, eta, written), file=out)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        for chunk in user_chunks(db, start_after, chunk_size):
+            while len(pending) >= workers * 2:
+                drain()
+            pending[pool.submit(process_chunk, chunk, month, year, target)] = (chunk[0], chunk[-1])
+            order.append(chunk[0])
+        while pending:
+            drain()
+
+    print('Done: {} users, {} with suggestions, {} rows in {:.1f}s'.format(
+        users_done, written, suggestion_rows, time.monotonic() - started), file=out)
+    return users_done, written, suggestion_rows
+
+
+def main(argv=None):
+    now = datetime.now()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--month', default=now.strftime('%B'), help='month name as stored in tbl_suggestions')
+    parser.add_argument('--year', type=int, default=now.year)
+    parser.add_argument('--workers', type=int, default=None, help='processes (default: CPU count)')
+    parser.add_argument('--chunk-size', type=int, default=500, help='users per chunk')
+    parser.add_argument('--checkpoint', default='suggestion_job.checkpoint.json')
+    parser.add_argument('--restart', action='store_true', help='ignore an existing checkpoint')
+    args = parser.parse_args(argv)
+
+    month = datetime.strptime(args.month, '%B').strftime('%B')
+    run(month, args.year, args.workers, args.chunk_size, args.checkpoint, args.restart)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
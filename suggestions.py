@@ -0,0 +1,60 @@
+"""Monthly budget suggestions (tbl_suggestions).
+
+Shared by POST /api/suggestion/<user_id> and the fleet-wide suggestion_job.py
+so both produce identical numbers.
+"""
+import budgets
+import versions
+
+PRIORITY_WEIGHTS = {'high': 0.5, 'medium': 0.3, 'low': 0.2}
+COLUMNS = ('login_id', 'category_id', 'suggested_amount', 'month', 'year')
+
+
+def compute(user_id, priorities, expenses, total_income, forecasts, month, year):
+    """Blend priority weight (60%) and past spending share (40%) of income, capped by the forecast.
+
+    ``expenses`` are per-category all-time totals, ``forecasts`` maps category_id to
+    next month's predicted spend. Suggestions are scaled down to fit ``total_income``.
+    """
+    total_income = float(total_income or 0)
+    past = {e['category_id']: float(e['total_amount'] or 0) for e in expenses}
+    total_expenses = sum(past.values())
+    total_weight = sum(PRIORITY_WEIGHTS[p['priority']] for p in priorities)
+
+    suggestions = []
+    for priority in priorities:
+        category_id = priority['category_id']
+        priority_weight = PRIORITY_WEIGHTS.get(priority['priority'], 0) / total_weight
+        expense_weight = (past.get(category_id, 0.0) / total_expenses) if total_expenses > 0 else 0
+        ai_weight = (0.6 * priority_weight) + (0.4 * expense_weight)
+        predicted_expense = float(forecasts.get(category_id) or 0.0)
+
+        suggestions.append({
+            'login_id': user_id,
+            'category_id': category_id,
+            'suggested_amount': round(min(predicted_expense, total_income * ai_weight), 2),
+            'month': month,
+            'year': year
+        })
+
+    total_suggested = sum(s['suggested_amount'] for s in suggestions)
+    if total_suggested > total_income and total_suggested > 0:
+        scale_factor = total_income / total_suggested
+        for s in suggestions:
+            s['suggested_amount'] = round(s['suggested_amount'] * scale_factor, 2)
+    return suggestions
+
+
+def replace(tx, login_ids, month, year, suggestions):
+    """Swap the (month, year) suggestions of ``login_ids`` for ``suggestions`` in one DELETE + multi-row INSERT."""
+    if not login_ids:
+        return
+    tx.execute(
+        "DELETE FROM tbl_suggestions WHERE login_id IN ({}) AND month = %s AND year = %s".format(
+            ', '.join(['%s'] * len(login_ids))
+        ),
+        tuple(login_ids) + (month, year)
+    )
+    tx.insert_many('tbl_suggestions', COLUMNS, [tuple(s[c] for c in COLUMNS) for s in suggestions])
+    budgets.set_budgets(tx, login_ids, month, year, suggestions)
+    versions.bump_users(tx, login_ids)
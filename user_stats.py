@@ -0,0 +1,161 @@
+"""Per-user monthly income / expenses / savings rate for the admin pages (tbl_user_stats).
+
+One row per (login_id, year, month): income is the salary plus that month's
+additional income, expenses come from the monthly rollup, and savings_rate is a
+stored generated column so both sort orders are served by an index. Write
+routes refresh just the (user, month) rows they touch. Migration 9 seeds every
+month that has data; after that each new month is seeded for every user by
+``python user_stats.py refresh`` (run it from cron on the 1st, e.g.
+``5 0 1 * *``). tbl_user_stats_month remembers which months are seeded; the
+admin pages only read. Pages are keyset-paginated, so the cost of a page does
+not grow with the number of users.
+
+Income uses the salary at refresh time; tbl_user keeps no salary history.
+
+Usage:
+    python user_stats.py refresh [--month 2025-03]   recompute a month for every user
+"""
+import argparse
+import sys
+from datetime import date
+
+import pagination
+from config import Database
+from rollup import as_date
+
+SORTS = {'expenses': 's.expenses', 'savings_rate': 's.savings_rate'}
+ORDERS = ('desc', 'asc')
+PAGE_SIZE = 50
+
+REFRESH = (
+    "INSERT INTO tbl_user_stats (login_id, year, month, income, expenses) "
+    "SELECT u.login_id, %s, %s, "
+    "COALESCE(u.salary, 0) + COALESCE((SELECT SUM(a.amount) FROM tbl_add_income a "
+    "  WHERE a.login_id = u.login_id AND a.month = %s), 0), "
+    "COALESCE((SELECT SUM(m.total) FROM tbl_expense_monthly m "
+    "  WHERE m.login_id = u.login_id AND m.year = %s AND m.month = %s), 0) "
+    "FROM tbl_user u {where} "
+    "ON DUPLICATE KEY UPDATE income = VALUES(income), expenses = VALUES(expenses)"
+)
+
+
+def _month_params(year, month):
+    return (year, month, '{:04d}-{:02d}'.format(year, month), year, month)
+
+
+def income_month(value):
+    """(year, month) of a tbl_add_income.month value ('YYYY-MM'). Raises ValueError on anything else."""
+    year, month = str(value).split('-')[:2]
+    year, month = int(year), int(month)
+    if not 1 <= month <= 12:
+        raise ValueError('month must be YYYY-MM')
+    return year, month
+
+
+def prefix_pattern(search):
+    """LIKE pattern matching values that start with ``search`` (wildcards in it are taken literally)."""
+    return search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def expense_months(*rows):
+    """{(login_id, year, month)} touched by these tbl_expense rows (None entries are skipped)."""
+    months = set()
+    for row in rows:
+        if row:
+            day = as_date(row['date'])
+            months.add((row['login_id'], day.year, day.month))
+    return months
+
+
+def refresh(q, keys):
+    """Recompute the rows for ``keys`` — (login_id, year, month) — one statement per month."""
+    by_month = {}
+    for login_id, year, month in keys:
+        by_month.setdefault((year, month), set()).add(login_id)
+    for (year, month), login_ids in sorted(by_month.items()):
+        ids = sorted(login_ids)
+        q.execute(
+            REFRESH.format(where="WHERE u.login_id IN ({})".format(', '.join(['%s'] * len(ids)))),
+            _month_params(year, month) + tuple(ids)
+        )
+
+
+def refresh_month(q, year, month):
+    """Recompute (year, month) for every user and remember that it is seeded."""
+    q.execute(REFRESH.format(where=''), _month_params(year, month))
+    q.execute("INSERT IGNORE INTO tbl_user_stats_month (year, month) VALUES (%s, %s)", (year, month))
+
+
+def month_seeded(db, year, month):
+    return db.fetchone("SELECT 1 AS seeded FROM tbl_user_stats_month WHERE year = %s AND month = %s", (year, month)) is not None
+
+
+def _after(column, order, value, login_id):
+    """Keyset condition for rows after (value, login_id); MySQL sorts NULLs first ascending, last descending."""
+    cmp = '<' if order == 'desc' else '>'
+    if value is None:
+        condition = "({0} IS NULL AND s.login_id {1} %s)".format(column, cmp)
+        if order == 'asc':
+            condition = "({} OR {} IS NOT NULL)".format(condition, column)
+        return condition, [login_id]
+    condition = "({0} {1} %s OR ({0} = %s AND s.login_id {1} %s))".format(column, cmp)
+    if order == 'desc':
+        condition = "({} OR {} IS NULL)".format(condition, column)
+    return condition, [value, value, login_id]
+
+
+def page(db, year, month, sort='expenses', order='desc', search=None, cursor=None, limit=PAGE_SIZE):
+    """One page of users for (year, month). Returns (rows, next cursor or None).
+
+    ``search`` matches the start of the username or name; ``limit=None`` returns every remaining row.
+    Raises pagination.BadRequest on bad arguments.
+    """
+    if sort not in SORTS:
+        raise pagination.BadRequest('sort must be one of: {}'.format(', '.join(SORTS)))
+    if order not in ORDERS:
+        raise pagination.BadRequest('order must be asc or desc')
+    column = SORTS[sort]
+    conditions = ["s.year = %s", "s.month = %s"]
+    params = [year, month]
+    if search:
+        pattern = prefix_pattern(search)
+        conditions.append("(l.username LIKE %s OR u.name LIKE %s)")
+        params.extend([pattern, pattern])
+    if cursor:
+        after = pagination.decode_cursor(cursor, (str, type(None)), int)
+        condition, values = _after(column, order, after[0], after[1])
+        conditions.append(condition)
+        params.extend(values)
+
+    rows = db.fetchall(
+        "SELECT s.login_id, l.username, u.name, s.income, s.expenses AS total_expenses, s.savings_rate "
+        "FROM tbl_user_stats s "
+        "INNER JOIN tbl_login l ON l.id = s.login_id "
+        "INNER JOIN tbl_user u ON u.login_id = s.login_id "
+        "WHERE " + ' AND '.join(conditions) + " "
+        "ORDER BY {0} {1}, s.login_id {1}{2}".format(column, order.upper(), '' if limit is None else ' LIMIT %s'),
+        params + ([] if limit is None else [limit + 1])
+    )
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        value = last['total_expenses'] if sort == 'expenses' else last['savings_rate']
+        next_cursor = pagination.encode_cursor([str(value) if value is not None else None, last['login_id']])
+    return rows, next_cursor
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['refresh'])
+    parser.add_argument('--month', help='YYYY-MM (default: this month)')
+    args = parser.parse_args(argv)
+
+    year, month = income_month(args.month) if args.month else (date.today().year, date.today().month)
+    refresh_month(Database(), year, month)
+    print('User stats refreshed for {:04d}-{:02d}'.format(year, month))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,46 @@
+"""Data version counters (tbl_data_version) behind the ETags on the polled read endpoints.
+
+Every write route bumps the scope it touches: ``user:<login_id>`` for a
+user's own data, ``global`` for shared data such as categories. A read
+endpoint's ETag is derived from the versions of the scopes it depends on,
+so a poll with a matching If-None-Match costs one primary-key lookup
+instead of the aggregate query.
+"""
+import hashlib
+
+GLOBAL = 'global'
+
+
+def user_scope(login_id):
+    return 'user:{}'.format(int(login_id))
+
+
+def bump(q, *scopes):
+    """Increment ``scopes``. ``q`` is the Database or, preferably, the Transaction doing the write."""
+    if not scopes:
+        return
+    q.execute(
+        "INSERT INTO tbl_data_version (scope, version) VALUES {} "
+        "ON DUPLICATE KEY UPDATE version = version + 1".format(', '.join(['(%s, 1)'] * len(scopes))),
+        scopes
+    )
+
+
+def bump_users(q, login_ids):
+    bump(q, *sorted({user_scope(login_id) for login_id in login_ids}))
+
+
+def current(db, scopes):
+    """{scope: version} for ``scopes``; scopes never written are 0."""
+    rows = db.fetchall(
+        "SELECT scope, version FROM tbl_data_version WHERE scope IN ({})".format(', '.join(['%s'] * len(scopes))),
+        tuple(scopes)
+    )
+    found = {row['scope']: row['version'] for row in rows}
+    return {scope: found.get(scope, 0) for scope in scopes}
+
+
+def etag(versions, *parts):
+    """Opaque tag for a response built from ``versions`` plus whatever else it varies on (endpoint, args, month)."""
+    key = '|'.join([str(p) for p in parts] + ['{}={}'.format(s, versions[s]) for s in sorted(versions)])
+    return hashlib.sha1(key.encode()).hexdigest()[:20]